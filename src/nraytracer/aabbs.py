@@ -0,0 +1,113 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+
+from __future__ import annotations
+from nimic.ntypes import *
+
+from math import inf
+from primitives import Point3, point3, Vec3, Ray
+
+# Axis-Aligned Bounding Boxes
+# ------------------------------------------------------------------------------------------
+# From book 2, used by the acceleration structures
+
+class AABB(Object):
+    minimum: Point3
+    maximum: Point3
+
+    @template_expand
+    def hit(self: AABB, r: Ray, inv_dir: Vec3, t_min: float64, t_max: float64) -> bool:
+        """{.inline, noSideEffect.}"""
+        ## Slab test.
+        ## `inv_dir` is the componentwise inverse of `r.direction`,
+        ## it is computed once per ray by the caller instead of once per box.
+        with var:
+            t0 = t_min
+            t1 = t_max
+        @template
+        def _slab(origin: untyped, inv_d: untyped, lo: untyped, hi: untyped) -> untyped:
+            """{.dirty.}"""
+            with block:
+                with var:
+                    tNear = (lo - origin) * inv_d
+                    tFar = (hi - origin) * inv_d
+                if inv_d < 0.0:
+                    swap(tNear, tFar)
+                t0 = max(tNear, t0)
+                t1 = min(tFar, t1)
+                if t1 <= t0:
+                    return False
+        _slab(r.origin.x, inv_dir.x, self.minimum.x, self.maximum.x)
+        _slab(r.origin.y, inv_dir.y, self.minimum.y, self.maximum.y)
+        _slab(r.origin.z, inv_dir.z, self.minimum.z, self.maximum.z)
+        return True
+
+    def centroid(self: AABB) -> Point3:
+        """{.inline, noSideEffect.}"""
+        return point3(
+            0.5 * (self.minimum.x + self.maximum.x),
+            0.5 * (self.minimum.y + self.maximum.y),
+            0.5 * (self.minimum.z + self.maximum.z)
+        )
+
+    def longest_axis(self: AABB) -> nint:
+        """{.inline, noSideEffect.}"""
+        ## 0, 1, 2 for x, y, z
+        with let:
+            dx = self.maximum.x - self.minimum.x
+            dy = self.maximum.y - self.minimum.y
+            dz = self.maximum.z - self.minimum.z
+        if dx > dy and dx > dz:
+            return 0
+        if dy > dz:
+            return 1
+        return 2
+
+    def surface_area(self: AABB) -> float64:
+        """{.inline, noSideEffect.}"""
+        ## Surface area, 0 for the empty box
+        with let:
+            dx = self.maximum.x - self.minimum.x
+            dy = self.maximum.y - self.minimum.y
+            dz = self.maximum.z - self.minimum.z
+        if dx < 0.0 or dy < 0.0 or dz < 0.0:
+            return 0.0
+        return 2.0 * (dx*dy + dy*dz + dz*dx)
+
+def aabb(minimum: Point3, maximum: Point3) -> AABB:
+    """{.inline, noSideEffect.}"""
+    result = AABB()
+    result.minimum = minimum
+    result.maximum = maximum
+    return result
+
+def emptyAABB() -> AABB:
+    """{.inline, noSideEffect.}"""
+    ## The identity of surrounding_box
+    return aabb(point3(inf, inf, inf), point3(-inf, -inf, -inf))
+
+def surrounding_box(box0: AABB, box1: AABB) -> AABB:
+    """{.inline, noSideEffect.}"""
+    return aabb(
+        point3(
+            min(box0.minimum.x, box1.minimum.x),
+            min(box0.minimum.y, box1.minimum.y),
+            min(box0.minimum.z, box1.minimum.z)
+        ),
+        point3(
+            max(box0.maximum.x, box1.maximum.x),
+            max(box0.maximum.y, box1.maximum.y),
+            max(box0.maximum.z, box1.maximum.z)
+        )
+    )
+
+def component(p: Point3, axis: nint) -> float64:
+    """{.inline, noSideEffect.}"""
+    ## Coordinate of a point along axis 0, 1, 2 for x, y, z
+    if axis == 0: return p.x
+    if axis == 1: return p.y
+    return p.z
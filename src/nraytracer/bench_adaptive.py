@@ -0,0 +1,108 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.os import *
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from primitives import Canvas, newCanvas, point3, vec3, CTime, Degrees
+from cameras import camera
+from hittables import Scene
+from render import renderParallel, renderAdaptive, AdaptiveSampling
+from scenes import random_scene
+from sampling import Rng
+from ppm import exportSampleHeatmap
+
+# Benchmark: adaptive sampling
+# ------------------------------------------------------------------------
+# Renders the still scene of book 1 with a fixed 100 samples per pixel,
+# then adaptively with at most 100 samples for several relative error targets.
+# Reports the render time, the average samples per pixel and the mean squared
+# error against a 512 spp reference (linear canvases, gamma 1),
+# and writes the sample count heatmap of each target to build/bench_adaptive.
+
+with const:
+    _Width = 384
+    _Height = 216
+    _SamplesPerPixel = 100
+    _ReferenceSamples = 512
+    _MinSamples = 16
+    _MaxDepth = 50
+    _RelativeErrors = [0.05, 0.02, 0.01]
+    _OutDir = string("build") / "bench_adaptive"
+
+def _meanSquaredError(a: Canvas, b: Canvas) -> float64:
+    with var: sum = 0.0
+    for i in range(a.nrows * a.ncols):
+        with let: d = a.pixels[i] - b.pixels[i]
+        sum += d.x * d.x + d.y * d.y + d.z * d.z
+    return sum / float64(3 * a.nrows * a.ncols)
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    with let:
+        world = random_scene(worldRNG)
+        worldBVH = world.bvh(CTime(0.0), CTime(1.0))
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    with var:
+        reference = newCanvas(_Height, _Width, _ReferenceSamples, 1.0)
+        canvas = newCanvas(_Height, _Width, _SamplesPerPixel, 1.0)
+        sampleCounts = seq[int32]()
+
+    create_dir(_OutDir)
+    try:
+        renderParallel(reference, cam, worldBVH.list(), _MaxDepth)
+        print(f"{_Width}x{_Height}, at most {_SamplesPerPixel} spp, error against {_ReferenceSamples} spp")
+
+        with let: start = get_mono_time()
+        renderParallel(canvas, cam, worldBVH.list(), _MaxDepth)
+        with let:
+            fixed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+        print(f"  fixed:          {fixed:>8.3f} s, {_SamplesPerPixel:>6.1f} spp, MSE {_meanSquaredError(canvas, reference):.6f}")
+
+        for relativeError in _RelativeErrors:
+            with let: start = get_mono_time()
+            renderAdaptive(canvas, cam, worldBVH.list(), _MaxDepth,
+                           AdaptiveSampling(minSamples = _MinSamples, relativeError = relativeError),
+                           sampleCounts)
+            with let:
+                elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+            with var: total = 0
+            for n in sampleCounts:
+                total += n
+            print(f"  adaptive {relativeError:<5}: {elapsed:>8.3f} s, {float64(total) / float64(len(sampleCounts)):>6.1f} spp, " +
+                  f"MSE {_meanSquaredError(canvas, reference):.6f}, speedup {fixed / elapsed:>5.2f}x")
+
+            with let: f = open(_OutDir / f"heatmap_{relativeError}.ppm", fmWrite)
+            try:
+                exportSampleHeatmap(sampleCounts, _Height, _Width, _SamplesPerPixel, f)
+            finally:
+                f.close()
+    finally:
+        reference.delete()
+        canvas.delete()
+
+if comptime(__name__ == "__main__"):
+    main()
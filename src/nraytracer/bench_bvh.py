@@ -0,0 +1,166 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from math import inf
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from primitives import point3, vec3, CTime, Degrees
+from cameras import Camera, camera
+from core import HitRecord
+from hittables import Scene, BVH, BVHBuildMode
+from render import radiance
+from scenes import random_scene
+from scenes_animated import random_moving_spheres, scenes, frames, Animation, ATime
+from sampling import Rng, random
+
+# Benchmark: BVH vs flat HittableList
+# ------------------------------------------------------------------------
+# Rays/sec of world.hit for the primary rays of a 384x216 image
+# and of full paths (radiance, max_depth 50) at 4 samples per pixel,
+# on the still scene of book 1 and the first frame of the animation.
+# Both BVH build modes are compared: build time, tree shape, SAH cost
+# and the resulting traversal speed.
+# For the animation, the per-frame setup of a rebuilt Scene and BVH
+# is compared with the persistent scene and BVH refit of `frames`.
+
+with const:
+    _Width = 384
+    _Height = 216
+    _PathSamples = 4
+    _MaxDepth = 50
+
+def _benchPrimary[W](name: string, world: W, cam: Camera):
+    with var:
+        rng = Rng()
+        rec = HitRecord()
+        hits = 0
+    rng.seed(0xFACADE)
+    with let: start = get_mono_time()
+    for row in range(_Height):
+        for col in range(_Width):
+            with let:
+                u = (float64(col) + random(rng, float64)) / float64(_Width - 1)
+                v = (float64(row) + random(rng, float64)) / float64(_Height - 1)
+                r = cam.ray(u, v, rng)
+            if world.hit(r, 0.001, inf, rec):
+                hits += 1
+    with let:
+        stop = get_mono_time()
+        elapsed = float64(in_microseconds(stop - start)) * 1e-6
+        rays = float64(_Width * _Height)
+    print(f"  {name:<6} primary: {rays / elapsed * 1e-6:>8.3f} Mrays/s ({hits} hits)")
+
+def _benchPaths[W](name: string, world: W, cam: Camera):
+    with var:
+        rng = Rng()
+    with let: start = get_mono_time()
+    for row in range(_Height):
+        for col in range(_Width):
+            rng.seed(row, col)
+            for _ in range(_PathSamples):
+                with let:
+                    u = (float64(col) + random(rng, float64)) / float64(_Width - 1)
+                    v = (float64(row) + random(rng, float64)) / float64(_Height - 1)
+                    r = cam.ray(u, v, rng)
+                _ = radiance(r, world, _MaxDepth, rng)
+    with let:
+        stop = get_mono_time()
+        elapsed = float64(in_microseconds(stop - start)) * 1e-6
+        paths = float64(_Width * _Height * _PathSamples)
+    print(f"  {name:<6} paths:   {paths / elapsed * 1e-3:>8.3f} Kpaths/s")
+
+def _printStats(name: string, bvh: BVH):
+    with let: buildTime = float64(in_microseconds(bvh.stats.buildTime)) * 1e-3
+    with let: stats = bvh.stats
+    print(f"  {name:<6} build:   {buildTime:>8.3f} ms, {stats.nodeCount} nodes, {stats.leafCount} leaves, depth {stats.depth}, SAH cost {stats.cost:.3f}")
+
+def _benchScene(title: string, scene: Scene, cam: Camera):
+    with let:
+        medianBVH = scene.bvh(mode = BVHBuildMode.bvhMedian)
+        sahBVH = scene.bvh(mode = BVHBuildMode.bvhSAH)
+    print(f"{title}: {len(scene.objects)} objects")
+    _printStats("median", medianBVH)
+    _printStats("sah", sahBVH)
+    _benchPrimary("list", scene.list(), cam)
+    _benchPrimary("median", medianBVH.list(), cam)
+    _benchPrimary("sah", sahBVH.list(), cam)
+    _benchPaths("list", scene.list(), cam)
+    _benchPaths("median", medianBVH.list(), cam)
+    _benchPaths("sah", sahBVH.list(), cam)
+
+def _newAnimation() -> Animation:
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+    return random_moving_spheres(
+        worldRNG,
+        int32(_Height), int32(_Width),
+        ATime(0.005), ATime(0.0), ATime(6.0)
+    )
+
+def _benchAnimationSetup():
+    with var:
+        animation = _newAnimation()
+        count = 0
+    with let: start = get_mono_time()
+    for frameCam, scene in scenes(animation, skip=6):
+        with let: frameBVH = scene.bvh(mode = BVHBuildMode.bvhMedian)
+        count += frameBVH.stats.nodeCount
+    with let:
+        rebuild = float64(in_microseconds(get_mono_time() - start)) * 1e-3
+
+    animation = _newAnimation()
+    with let: refitStart = get_mono_time()
+    for frameCam, world in frames(animation, skip=6):
+        count += world.len
+    with let:
+        refit = float64(in_microseconds(get_mono_time() - refitStart)) * 1e-3
+    print(f"random_moving_spheres setup of all frames: rebuild {rebuild:>8.3f} ms, refit {refit:>8.3f} ms, {count} nodes in total")
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    # Book 1 still scene
+    with let:
+        world = random_scene(worldRNG)
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    _benchScene("random_scene", world, cam)
+
+    # First frame of the animation
+    worldRNG.seed(0xFACADE)
+    with var:
+        animation = random_moving_spheres(
+            worldRNG,
+            int32(_Height), int32(_Width),
+            ATime(0.005), ATime(0.0), ATime(6.0)
+        )
+    for frameCam, scene in scenes(animation, skip=6):
+        _benchScene("random_moving_spheres", scene, frameCam)
+        break
+
+    _benchAnimationSetup()
+
+if comptime(__name__ == "__main__"):
+    main()
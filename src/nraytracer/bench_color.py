@@ -0,0 +1,88 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.system.ansi_c import cmp_mem
+from primitives import Canvas, newCanvas, color, draw
+from sampling import Rng, random
+from ppm import quantizeToRGB
+from color_conversions import RGB_Raw, initChannelDesc, rgbRaw_to_ycbcr420, canvas_to_ycbcr420, YCbCrKind
+
+# Benchmark: Canvas to Y'CbCr 4:2:0
+# ------------------------------------------------------------------------
+# Quantizing the canvas to RGB24 then rgbRaw_to_ycbcr420
+# against canvas_to_ycbcr420 reading the float canvas directly.
+# Both must produce the same planes.
+
+with const:
+    _Frames = 100
+
+def _planeSize(width: nint, height: nint) -> nint:
+    return width * height + 2 * ((width + 1) // 2) * ((height + 1) // 2)
+
+@template_expand
+def _benchResolution(width: nint, height: nint):
+    with var:
+        canvas = newCanvas(height, width, 1, 2.2)
+        rng = Rng()
+        rgb = seq[uint8]()
+        reference = new_seq[uint8](_planeSize(width, height))
+        fused = new_seq[uint8](_planeSize(width, height))
+    rng.seed(0xFACADE)
+    for row in range(height):
+        for col in range(width):
+            # Slightly out of [0, 1) to exercise the clamping
+            draw(canvas, row, col, color(
+                1.1 * random(rng, float64), 1.1 * random(rng, float64), 1.1 * random(rng, float64)
+            ))
+
+    @template
+    def _planes(buf: untyped) -> untyped:
+        """{.dirty.}"""
+        with let:
+            yD = initChannelDesc(addr(buf[0]), width, subsampled=False)
+            uD = initChannelDesc(addr(buf[width * height]), width, subsampled=True)
+            vD = initChannelDesc(addr(buf[width * height + ((width + 1) // 2) * ((height + 1) // 2)]), width, subsampled=True)
+
+    try:
+        with block:
+            _planes(reference)
+            with let: start = get_mono_time()
+            for _ in range(_Frames):
+                quantizeToRGB(canvas, rgb)
+                with let:
+                    rgbD = initChannelDesc(cast[ptr[UncheckedArray[RGB_Raw]]](addr(rgb[0])), width, subsampled=False)
+                rgbRaw_to_ycbcr420(int32(width), int32(height), rgbD, yD, uD, vD, YCbCrKind.BT601)
+            with let:
+                elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-3 / float64(_Frames)
+            print(f"  {width}x{height} quantize + rgbRaw_to_ycbcr420: {elapsed:>8.3f} ms/frame")
+
+        with block:
+            _planes(fused)
+            with let: start = get_mono_time()
+            for _ in range(_Frames):
+                canvas_to_ycbcr420(canvas, yD, uD, vD, YCbCrKind.BT601)
+            with let:
+                elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-3 / float64(_Frames)
+            print(f"  {width}x{height} canvas_to_ycbcr420:            {elapsed:>8.3f} ms/frame")
+
+        doAssert(cmp_mem(addr(reference[0]), addr(fused[0]), len(fused)) == 0,
+                 "canvas_to_ycbcr420 differs from rgbRaw_to_ycbcr420")
+    finally:
+        canvas.delete()
+
+def main():
+    print(f"{_Frames} conversions per run")
+    _benchResolution(512, 288)
+    _benchResolution(1920, 1080)
+
+if comptime(__name__ == "__main__"):
+    main()
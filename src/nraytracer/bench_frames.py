@@ -0,0 +1,91 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.std.cpuinfo import countProcessors
+from nimic.system.ansi_c import cmp_mem, copy_mem
+from primitives import Color, newCanvas
+from hittables import BVHList
+from render import renderParallel
+from render_frames import FramePool, initFramePool, renderFrames, delete
+from scenes_animated import Animation, random_moving_spheres, frames, ATime
+from sampling import Rng
+
+# Benchmark: frame-parallel animation
+# ------------------------------------------------------------------------
+# Frames/sec of the first second of random_moving_spheres,
+# rendered one after another with the multi-threaded tile renderer,
+# then one frame per thread with a growing number of frames in flight.
+# Every frame must be bit-identical to the serial loop and come out in order.
+
+with const:
+    _Width = 256
+    _Height = 144
+    _SamplesPerPixel = 8
+    _MaxDepth = 50
+    _Skip = 6
+
+def _animation() -> Animation:
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+    return random_moving_spheres(
+        worldRNG,
+        int32(_Height), int32(_Width),
+        ATime(0.005), ATime(0.0), ATime(1.0)
+    )
+
+def main():
+    with let:
+        numThreads = countProcessors()
+        frameSize = _Width * _Height * sizeof(Color)
+    with var:
+        canvas = newCanvas(_Height, _Width, _SamplesPerPixel, 2.2)
+        reference = seq[seq[Color]]()
+
+    try:
+        with var:
+            animation = _animation()
+        with let: start = get_mono_time()
+        for cam, world in frames(animation, skip=_Skip):
+            renderParallel(canvas, cam, world, _MaxDepth)
+            with var: pixels = new_seq[Color](_Width * _Height)
+            copy_mem(addr(pixels[0]), canvas.pixels, frameSize)
+            reference.add(pixels)
+        with let:
+            serial = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+            numFrames = float64(len(reference))
+        print(f"random_moving_spheres, {len(reference)} frames {_Width}x{_Height}, {_SamplesPerPixel} spp, {numThreads} threads")
+        print(f"  serial frames, parallel tiles: {numFrames / serial:>7.3f} frames/s")
+
+        for framesInFlight in [numThreads, numThreads + 2, 2 * numThreads]:
+            with var:
+                pool = initFramePool(_Height, _Width, _SamplesPerPixel, 2.2, framesInFlight)
+                expected = 0
+            animation = _animation()
+            try:
+                with let: start = get_mono_time()
+                for sceneID, frame in renderFrames(pool, animation, _Skip, _MaxDepth, numThreads):
+                    doAssert(sceneID == expected, "frames out of order")
+                    doAssert(cmp_mem(frame.pixels, addr(reference[sceneID][0]), frameSize) == 0,
+                             f"frame {sceneID} differs from the serial loop")
+                    expected += 1
+                with let:
+                    elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+                doAssert(expected == len(reference))
+                print(f"  parallel frames, {framesInFlight:>3} in flight: {numFrames / elapsed:>7.3f} frames/s, speedup {serial / elapsed:>5.2f}x")
+            finally:
+                pool.delete()
+    finally:
+        canvas.delete()
+
+if comptime(__name__ == "__main__"):
+    main()
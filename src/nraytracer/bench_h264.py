@@ -0,0 +1,104 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.os import *
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.std.cpuinfo import countProcessors
+from h264 import H264Encoder, init, getFrameBuffer, getFrameBufferSize, flushFrame, clearStream, finish
+
+# Benchmark: H.264 encoding throughput
+# ------------------------------------------------------------------------
+# Frames/sec of flushFrame, in memory and to a .264 file,
+# at the animation resolution and at 1080p.
+# 1080p is measured at 1920x1088: the encoder has no cropping yet
+# and needs dimensions that are multiples of 16.
+# Then in memory at 1080p with one slice per thread, from 1 thread to one per core.
+
+with const:
+    _Frames = 100
+    _OutDir = string("build") / "bench_h264"
+
+def _fillFrame(enc: mut@H264Encoder):
+    ## Deterministic gradient, the same frame is encoded repeatedly
+    with let:
+        buf = getFrameBuffer(enc)
+    for i in range(getFrameBufferSize(enc)):
+        buf[i] = uint8(i and 255)
+
+def _benchResolution(width: nint, height: nint):
+    # In memory, stream consumed after each frame like the MP4 path
+    with var:
+        encoder = init(H264Encoder, width, height)
+        bytesPerFrame = 0
+    _fillFrame(encoder)
+    with let: start = get_mono_time()
+    for i in range(_Frames):
+        flushFrame(encoder)
+        bytesPerFrame = len(encoder.stream)
+        clearStream(encoder)
+    with let:
+        memElapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+    finish(encoder)
+
+    # To a file, one write per slice
+    with let:
+        path = _OutDir / f"bench_{width}x{height}.264"
+        f = open(path, fmWrite)
+    encoder = init(H264Encoder, width, height, f)
+    _fillFrame(encoder)
+    with let: fileStart = get_mono_time()
+    for i in range(_Frames):
+        flushFrame(encoder)
+    with let:
+        fileElapsed = float64(in_microseconds(get_mono_time() - fileStart)) * 1e-6
+    finish(encoder)
+    f.close()
+
+    print(f"  {width}x{height}: memory {float64(_Frames) / memElapsed:>8.2f} fps, " +
+          f"file {float64(_Frames) / fileElapsed:>8.2f} fps, {bytesPerFrame} bytes/frame")
+
+def _benchSlices(width: nint, height: nint):
+    with let:
+        numCores = countProcessors()
+    with var:
+        threads = 1
+        serial = 0.0
+    print(f"  {width}x{height} in memory, one slice per thread, {numCores} cores:")
+    while True:
+        with var:
+            encoder = init(H264Encoder, width, height, slices = threads, numThreads = threads)
+            bytesPerFrame = 0
+        _fillFrame(encoder)
+        with let: start = get_mono_time()
+        for i in range(_Frames):
+            flushFrame(encoder)
+            bytesPerFrame = len(encoder.stream)
+            clearStream(encoder)
+        with let:
+            elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+        finish(encoder)
+        if threads == 1:
+            serial = elapsed
+        print(f"    {threads:>3} threads: {float64(_Frames) / elapsed:>8.2f} fps, speedup {serial / elapsed:>5.2f}x, " +
+              f"{bytesPerFrame} bytes/frame")
+        if threads >= numCores:
+            break
+        threads = min(2 * threads, numCores)
+
+def main():
+    create_dir(_OutDir)
+    print(f"{_Frames} frames per run")
+    _benchResolution(512, 288)
+    _benchResolution(1920, 1088)
+    _benchSlices(1920, 1088)
+
+if comptime(__name__ == "__main__"):
+    main()
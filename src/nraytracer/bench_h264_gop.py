@@ -0,0 +1,114 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.os import *
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.system.ansi_c import copy_mem
+from primitives import newCanvas
+from hittables import BVHList
+from render import renderParallel
+from scenes_animated import random_moving_spheres, frames, ATime
+from sampling import Rng
+from color_conversions import initChannelDesc, canvas_to_ycbcr420, YCbCrKind
+from h264 import H264Encoder, init, getFrameBuffers, getFrameBuffer, getFrameBufferSize, \
+    flushFrame, clearStream, finish
+from mp4 import MP4Muxer, initialize, writeFrame, close
+
+# Benchmark: P frames with P_Skip macroblocks
+# ------------------------------------------------------------------------
+# Encodes and muxes to MP4 the first 2 seconds of random_moving_spheres
+# with IDR frames only, then with an IDR frame every `gopSize` frames and
+# P frames in between, where macroblocks within `skipTolerance` of their
+# last coded samples are P_Skip: bytes/frame, encoding and muxing time
+# per frame, and size of the MP4 file.
+# Frames are rendered once and kept in memory, only the encoding is timed.
+
+with const:
+    _Width = 512
+    _Height = 288
+    _SamplesPerPixel = 16
+    _MaxDepth = 50
+    _Skip = 6
+    _Fps = 30
+    _OutDir = string("build") / "bench_h264_gop"
+
+def _bench(sources: seq[seq[uint8]], gopSize: nint, skipTolerance: nint):
+    with let:
+        path = _OutDir / f"gop{gopSize}_tol{skipTolerance}.mp4"
+        f = open(path, fmWrite)
+    with var:
+        encoder = init(H264Encoder, _Width, _Height, gopSize = gopSize, skipTolerance = skipTolerance)
+        muxer = MP4Muxer()
+        bytes = 0
+        encodeTime = 0.0
+        muxTime = 0.0
+    initialize(muxer, f, int32(_Width), int32(_Height), _Fps)
+    try:
+        for source in sources:
+            copy_mem(getFrameBuffer(encoder), unsafe_addr(source[0]), getFrameBufferSize(encoder))
+            with let: start = get_mono_time()
+            flushFrame(encoder)
+            with let: muxStart = get_mono_time()
+            writeFrame(muxer, encoder.stream)
+            with let: stop = get_mono_time()
+            encodeTime += float64(in_microseconds(muxStart - start)) * 1e-6
+            muxTime += float64(in_microseconds(stop - muxStart)) * 1e-6
+            bytes += len(encoder.stream)
+            clearStream(encoder)
+    finally:
+        close(muxer)
+        f.close()
+        finish(encoder)
+    with let:
+        numFrames = float64(len(sources))
+    print(f"  GOP {gopSize:>3}, tolerance {skipTolerance}: {float64(bytes) / numFrames:>10.0f} bytes/frame, " +
+          f"encode {encodeTime * 1000.0 / numFrames:>7.3f} ms/frame, mux {muxTime * 1000.0 / numFrames:>7.3f} ms/frame, " +
+          f"MP4 {get_file_size(path)} bytes")
+
+def main():
+    create_dir(_OutDir)
+    with var:
+        worldRNG = Rng()
+        canvas = newCanvas(_Height, _Width, _SamplesPerPixel, 2.2)
+        encoder = init(H264Encoder, _Width, _Height)
+        sources = seq[seq[uint8]]()
+    worldRNG.seed(0xFACADE)
+    with var:
+        animation = random_moving_spheres(
+            worldRNG,
+            int32(_Height), int32(_Width),
+            ATime(0.005), ATime(0.0), ATime(2.0)
+        )
+    try:
+        with let:
+            (Y, Cb, Cr) = getFrameBuffers(encoder)
+            yD = initChannelDesc(Y, _Width, subsampled=False)
+            uD = initChannelDesc(Cb, _Width, subsampled=True)
+            vD = initChannelDesc(Cr, _Width, subsampled=True)
+        for cam, world in frames(animation, skip=_Skip):
+            renderParallel(canvas, cam, world, _MaxDepth)
+            canvas_to_ycbcr420(canvas, yD, uD, vD, YCbCrKind.BT601)
+            with var: source = new_seq[uint8](getFrameBufferSize(encoder))
+            copy_mem(addr(source[0]), getFrameBuffer(encoder), len(source))
+            sources.add(source)
+    finally:
+        finish(encoder)
+        canvas.delete()
+
+    print(f"random_moving_spheres, {len(sources)} frames {_Width}x{_Height}, {_SamplesPerPixel} spp")
+    _bench(sources, 1, 0)
+    for gopSize in [10, 30, 60]:
+        _bench(sources, gopSize, 0)
+    _bench(sources, 30, 2)
+    _bench(sources, 30, 4)
+
+if comptime(__name__ == "__main__"):
+    main()
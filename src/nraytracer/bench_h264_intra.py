@@ -0,0 +1,114 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from math import log10
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.system.ansi_c import copy_mem
+from primitives import newCanvas
+from hittables import BVHList
+from render import renderParallel
+from scenes_animated import random_moving_spheres, frames, ATime
+from sampling import Rng
+from color_conversions import initChannelDesc, canvas_to_ycbcr420, YCbCrKind
+from h264 import H264Encoder, H264Coding, init, getFrameBuffers, getFrameBuffer, getFrameBufferSize, \
+    getReconstructedBuffers, flushFrame, clearStream, finish
+
+# Benchmark: H.264 intra coding
+# ------------------------------------------------------------------------
+# Encodes the first frame of random_moving_spheres at the animation resolution
+# with I_PCM macroblocks and with intra 16x16 prediction, transform and CAVLC
+# at several QPs: bytes/frame, compression against PCM, luma PSNR of the
+# decoded picture against the source, and frames/sec of flushFrame in memory.
+
+with const:
+    _Width = 512
+    _Height = 288
+    _SamplesPerPixel = 64
+    _MaxDepth = 50
+    _Frames = 20
+    _QPs = [18, 24, 30, 36, 42]
+
+def _lumaPSNR(source: ptr[UncheckedArray[uint8]], decoded: ptr[UncheckedArray[uint8]]) -> float64:
+    with var: sum = 0.0
+    for i in range(_Width * _Height):
+        with let: d = float64(source[i]) - float64(decoded[i])
+        sum += d * d
+    if sum == 0.0:
+        return Inf
+    return 10.0 * log10(255.0 * 255.0 * float64(_Width * _Height) / sum)
+
+class _Result(NTuple):
+    bytesPerFrame: nint
+    fps: float64
+    psnr: float64
+
+def _bench(source: seq[uint8], coding: H264Coding, qp: nint) -> _Result:
+    with var:
+        encoder = init(H264Encoder, _Width, _Height, coding = coding, qp = qp)
+    copy_mem(getFrameBuffer(encoder), unsafe_addr(source[0]), getFrameBufferSize(encoder))
+    with let: start = get_mono_time()
+    for i in range(_Frames):
+        clearStream(encoder) # Also drops the SPS and PPS
+        flushFrame(encoder)
+    with let:
+        elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+    result.bytesPerFrame = len(encoder.stream)
+    result.fps = float64(_Frames) / elapsed
+    result.psnr = Inf
+    if coding != H264Coding.codingPCM:
+        result.psnr = _lumaPSNR(cast[ptr[UncheckedArray[uint8]]](unsafe_addr(source[0])),
+                                getReconstructedBuffers(encoder).Y)
+    finish(encoder)
+    return result
+
+def main():
+    with var:
+        worldRNG = Rng()
+        canvas = newCanvas(_Height, _Width, _SamplesPerPixel, 2.2)
+        encoder = init(H264Encoder, _Width, _Height)
+        source = seq[uint8]()
+    worldRNG.seed(0xFACADE)
+    with var:
+        animation = random_moving_spheres(
+            worldRNG,
+            int32(_Height), int32(_Width),
+            ATime(0.005), ATime(0.0), ATime(1.0)
+        )
+
+    # Source frame, converted like the MP4 path
+    try:
+        for cam, world in frames(animation, skip=6):
+            renderParallel(canvas, cam, world, _MaxDepth)
+            break
+        with let:
+            (Y, Cb, Cr) = getFrameBuffers(encoder)
+            yD = initChannelDesc(Y, _Width, subsampled=False)
+            uD = initChannelDesc(Cb, _Width, subsampled=True)
+            vD = initChannelDesc(Cr, _Width, subsampled=True)
+        canvas_to_ycbcr420(canvas, yD, uD, vD, YCbCrKind.BT601)
+        source = new_seq[uint8](getFrameBufferSize(encoder))
+        copy_mem(addr(source[0]), getFrameBuffer(encoder), len(source))
+    finally:
+        finish(encoder)
+        canvas.delete()
+
+    print(f"random_moving_spheres, first frame {_Width}x{_Height}, {_SamplesPerPixel} spp, {_Frames} encodes per run")
+    with let:
+        pcm = _bench(source, H264Coding.codingPCM, 26)
+    print(f"   PCM: {pcm.bytesPerFrame:>8} bytes/frame               lossless   {pcm.fps:>8.2f} fps")
+    for qp in _QPs:
+        with let:
+            coded = _bench(source, H264Coding.codingIntra16x16, qp)
+        print(f"  QP {qp:>2}: {coded.bytesPerFrame:>8} bytes/frame, {float64(pcm.bytesPerFrame) / float64(coded.bytesPerFrame):>6.1f}x   " +
+              f"{coded.psnr:>6.2f} dB   {coded.fps:>8.2f} fps")
+
+if comptime(__name__ == "__main__"):
+    main()
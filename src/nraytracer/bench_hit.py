@@ -0,0 +1,131 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from math import inf
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from primitives import Ray
+from cameras import Camera
+from core import HitRecord, Material
+from hittables import HittableList
+from render import radiance
+from scenes_animated import random_moving_spheres, scenes, ATime
+from sampling import Rng, random
+
+# Benchmark: deferred hit-record construction
+# ------------------------------------------------------------------------
+# HittableList.hit finds the nearest t and object, then builds one hit record.
+# It is compared with the eager scan it replaced, where every object closer
+# than the current hit builds a full record (point, normal, face, material),
+# on the first frame of random_moving_spheres (about 1600 spheres, no BVH)
+# for primary rays and for full paths.
+# Both must find the same hits.
+
+with const:
+    _Width = 192
+    _Height = 108
+    _PathSamples = 2
+    _MaxDepth = 10
+
+class _EagerList(Object):
+    ## The previous HittableList.hit, counting the hit records built
+    world: HittableList
+    materials: ptr[UncheckedArray[Material]]
+    records: ptr[int64]
+
+    def hit(self: _EagerList, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.inline.}"""
+        result = False
+        with var: closest_so_far = t_max
+
+        for i in range(self.world.len):
+            with let: hit = self.world.objects[i].hit(r, t_min, closest_so_far, rec)
+            if hit:
+                closest_so_far = rec.t
+                self.records.contents += 1
+                result = True
+        return result
+
+def _benchPrimary(world: HittableList, eager: _EagerList, cam: Camera):
+    with var:
+        rng = Rng()
+        rec = HitRecord()
+        eagerRec = HitRecord()
+        hits = 0
+        deferredTime = Duration()
+        eagerTime = Duration()
+    rng.seed(0xFACADE)
+    for row in range(_Height):
+        for col in range(_Width):
+            with let:
+                u = (float64(col) + random(rng, float64)) / float64(_Width - 1)
+                v = (float64(row) + random(rng, float64)) / float64(_Height - 1)
+                r = cam.ray(u, v, rng)
+                start = get_mono_time()
+                found = world.hit(r, 0.001, inf, rec)
+                mid = get_mono_time()
+                eagerFound = eager.hit(r, 0.001, inf, eagerRec)
+            eagerTime += get_mono_time() - mid
+            deferredTime += mid - start
+            doAssert(found == eagerFound)
+            if found:
+                doAssert(rec.t == eagerRec.t and rec.materialId == eagerRec.materialId)
+                hits += 1
+    with let:
+        rays = float64(_Width * _Height)
+        deferred = float64(in_microseconds(deferredTime)) * 1e-6
+        eagerElapsed = float64(in_microseconds(eagerTime)) * 1e-6
+    print(f"  primary: deferred {rays / deferred * 1e-3:>8.3f} Krays/s, eager {rays / eagerElapsed * 1e-3:>8.3f} Krays/s")
+    print(f"           {hits} hits, eager built {float64(eager.records.contents) / float64(hits):.2f} hit records per hit")
+
+def _benchPaths[W](name: string, world: W, cam: Camera):
+    with var:
+        rng = Rng()
+    with let: start = get_mono_time()
+    for row in range(_Height):
+        for col in range(_Width):
+            rng.seed(row, col)
+            for _ in range(_PathSamples):
+                with let:
+                    u = (float64(col) + random(rng, float64)) / float64(_Width - 1)
+                    v = (float64(row) + random(rng, float64)) / float64(_Height - 1)
+                    r = cam.ray(u, v, rng)
+                _ = radiance(r, world, _MaxDepth, rng)
+    with let:
+        elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+        paths = float64(_Width * _Height * _PathSamples)
+    print(f"  {name:<8} paths: {paths / elapsed * 1e-3:>8.3f} Kpaths/s")
+
+def main():
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+    with var:
+        animation = random_moving_spheres(
+            worldRNG,
+            int32(_Height), int32(_Width),
+            ATime(0.005), ATime(0.0), ATime(6.0)
+        )
+    for cam, scene in scenes(animation, skip=6):
+        with var:
+            records = int64(0)
+        with let:
+            world = scene.list()
+            eager = _EagerList(world = world, materials = world.materials, records = addr(records))
+        print(f"random_moving_spheres, first frame: {len(scene.objects)} objects, {_Width}x{_Height}")
+        _benchPrimary(world, eager, cam)
+        records = 0
+        _benchPaths("deferred", world, cam)
+        _benchPaths("eager", eager, cam)
+        print(f"  eager built {records} hit records over the paths")
+        break
+
+if comptime(__name__ == "__main__"):
+    main()
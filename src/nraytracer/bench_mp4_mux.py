@@ -0,0 +1,118 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.os import *
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from h264 import H264Encoder, H264Coding, init, getFrameBuffers, \
+    flushFrame, clearStream, finish
+from mp4 import MP4Muxer, initialize, writeFrame, close
+if comptime(defined(minimp4Stats)):
+    from minimp4 import minimp4_allocations, minimp4_scratch_grows
+
+# Benchmark: MP4 muxing
+# ------------------------------------------------------------------------
+# Muxes a 1000 frames H.264 stream, encoded beforehand in memory, frame by
+# frame like the animation: frames/sec, MB/s and time per NAL unit.
+# A moving gradient keeps the frames cheap to produce, with an IDR frame
+# every second and P frames in between, both with I_PCM and intra 16x16
+# macroblocks. mp4_h26x_write_nal reuses the scratch buffers of the writer
+# instead of allocating 2 buffers per NAL unit: built with -d:minimp4Stats,
+# the allocations of the muxer are counted while muxing the first frame and
+# the following ones, with the growths of the scratch buffers.
+# Each stream is also muxed as a fragmented MP4, one fragment per GOP.
+
+with const:
+    _Width = 512
+    _Height = 288
+    _Frames = 1000
+    _Fps = 30
+    _OutDir = string("build") / "bench_mp4_mux"
+
+def _countNals(stream: seq[uint8]) -> nint:
+    ## Annex B start codes
+    for i in range(2, len(stream)):
+        if stream[i] == 1 and stream[i - 1] == 0 and stream[i - 2] == 0:
+            result += 1
+    return result
+
+def _encode(coding: H264Coding) -> seq[seq[uint8]]:
+    with var:
+        encoder = init(H264Encoder, _Width, _Height, coding = coding, gopSize = _Fps)
+    try:
+        with let:
+            (Y, Cb, Cr) = getFrameBuffers(encoder)
+        for f in range(_Frames):
+            for row in range(_Height):
+                for col in range(_Width):
+                    Y[row * _Width + col] = uint8((row + col + 2 * f) & 255)
+            for i in range(_Width * _Height // 4):
+                Cb[i] = uint8(128)
+                Cr[i] = uint8((i + f) & 255)
+            flushFrame(encoder)
+            result.add(encoder.stream)
+            clearStream(encoder)
+    finally:
+        finish(encoder)
+    return result
+
+def _bench(name: string, frames: seq[seq[uint8]], fragmented: bool):
+    with let:
+        path = _OutDir / (f"{name}_fragmented.mp4" if fragmented else f"{name}.mp4")
+        f = open(path, fmWrite)
+    with var:
+        muxer = MP4Muxer()
+        bytes = 0
+        nals = 0
+    for frame in frames:
+        bytes += len(frame)
+        nals += _countNals(frame)
+    initialize(muxer, f, int32(_Width), int32(_Height), _Fps, fragmented = fragmented)
+    with var:
+        allocations = 0
+        scratchGrows = 0
+        firstFrameAllocations = 0
+    if comptime(defined(minimp4Stats)):
+        allocations = minimp4_allocations
+        scratchGrows = minimp4_scratch_grows
+    with let: start = get_mono_time()
+    try:
+        for i in range(len(frames)):
+            writeFrame(muxer, frames[i])
+            if comptime(defined(minimp4Stats)):
+                if i == 0:
+                    firstFrameAllocations = minimp4_allocations - allocations
+    finally:
+        close(muxer)
+        f.close()
+    with let:
+        elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+        mode = "fragmented" if fragmented else "moov"
+    print(f"  {name:>5}, {mode:>10}: {float64(_Frames) / elapsed:>9.1f} frames/s, {float64(bytes) / elapsed * 1e-6:>8.1f} MB/s, " +
+          f"{elapsed * 1e9 / float64(nals):>7.0f} ns/NAL, {nals} NAL units, MP4 {get_file_size(path)} bytes")
+    if comptime(defined(minimp4Stats)):
+        print(f"                     allocations: {firstFrameAllocations} for the first frame, " +
+              f"{minimp4_allocations - allocations - firstFrameAllocations} for the next {_Frames - 1} frames and the close, " +
+              f"scratch buffers grown {minimp4_scratch_grows - scratchGrows} times")
+
+def main():
+    create_dir(_OutDir)
+    print(f"{_Frames} frames {_Width}x{_Height}, IDR every {_Fps} frames, muxing time including the file writes")
+    if comptime(not defined(minimp4Stats)):
+        print("Build with -d:minimp4Stats to count the allocations of the muxer")
+    for coding in [H264Coding.codingPCM, H264Coding.codingIntra16x16]:
+        with let:
+            name = "pcm" if coding == H264Coding.codingPCM else "intra"
+            frames = _encode(coding)
+        _bench(name, frames, False)
+        _bench(name, frames, True)
+
+if comptime(__name__ == "__main__"):
+    main()
@@ -0,0 +1,81 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.os import *
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from primitives import Canvas, newCanvas, point3, vec3, CTime, Degrees
+from cameras import camera
+from hittables import Scene
+from render import renderParallel
+from scenes import random_scene
+from sampling import Rng
+from ppm import exportToPPM, PPMFormat
+
+# Benchmark: PPM export, P6 vs P3
+# ------------------------------------------------------------------------
+# Export time per frame and size on disk of one frame
+# at the resolution of the animation (512x288).
+
+with const:
+    _Width = 512
+    _Height = 288
+    _Frames = 50
+    _OutDir = string("build") / "bench_ppm"
+
+def _benchFormat(name: string, canvas: Canvas, format: PPMFormat):
+    with var:
+        buffer = seq[uint8]()
+    with let: start = get_mono_time()
+    for i in range(_Frames):
+        exportToPPM(canvas, _OutDir, name, i, buffer, format)
+    with let:
+        stop = get_mono_time()
+        perFrame = float64(in_microseconds(stop - start)) * 1e-3 / float64(_Frames)
+        size = get_file_size(_OutDir / (name + "_00000.ppm"))
+    print(f"  {name}: {perFrame:>8.3f} ms/frame, {size:>8} bytes/frame")
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    # A low sample count is enough, the content only matters for P3 digit counts
+    with let:
+        world = random_scene(worldRNG)
+        worldBVH = world.bvh(CTime(0.0), CTime(1.0))
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    with var:
+        canvas = newCanvas(_Height, _Width, 4, 2.2)
+
+    try:
+        renderParallel(canvas, cam, worldBVH.list(), 10)
+        create_dir(_OutDir)
+        print(f"{_Width}x{_Height}, {_Frames} exports per format")
+        _benchFormat("p6", canvas, PPMFormat.ppmBinary)
+        _benchFormat("p3", canvas, PPMFormat.ppmAscii)
+    finally:
+        canvas.delete()
+
+if comptime(__name__ == "__main__"):
+    main()
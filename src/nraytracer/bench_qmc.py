@@ -0,0 +1,96 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from primitives import Canvas, newCanvas, point3, vec3, CTime, Degrees
+from cameras import camera
+from hittables import Scene
+from render import renderParallel, SamplerKind
+from scenes import random_scene
+from sampling import Rng
+
+# Benchmark: quasi-Monte Carlo convergence
+# ------------------------------------------------------------------------
+# Renders the still scene of book 1 with independent random samples (Rng)
+# and with Owen-scrambled Sobol points (QmcSampler) for powers of 2
+# samples per pixel, and reports the mean squared error against a high
+# sample count reference rendered with Rng. The error of independent samples
+# decreases as 1/spp, so "random spp for the same error" is
+# spp x (random MSE / Sobol MSE): the sample count that Sobol saves.
+# Canvases are linear (gamma 1) so the error is measured on radiance.
+
+with const:
+    _Width = 384
+    _Height = 216
+    _SampleCounts = [1, 2, 4, 8, 16, 32, 64]
+    _ReferenceSamples = 1024
+    _MaxDepth = 50
+
+def _meanSquaredError(a: Canvas, b: Canvas) -> float64:
+    with var: sum = 0.0
+    for i in range(a.nrows * a.ncols):
+        with let: d = a.pixels[i] - b.pixels[i]
+        sum += d.x * d.x + d.y * d.y + d.z * d.z
+    return sum / float64(3 * a.nrows * a.ncols)
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    with let:
+        world = random_scene(worldRNG)
+        worldBVH = world.bvh(CTime(0.0), CTime(1.0))
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    with var:
+        reference = newCanvas(_Height, _Width, _ReferenceSamples, 1.0)
+
+    try:
+        renderParallel(reference, cam, worldBVH.list(), _MaxDepth)
+        print(f"{_Width}x{_Height}, max depth {_MaxDepth}, error against {_ReferenceSamples} spp")
+        print("   spp   random MSE    Sobol MSE   ratio   random spp for the same error   random s   Sobol s")
+
+        for spp in _SampleCounts:
+            with var:
+                canvas = newCanvas(_Height, _Width, spp, 1.0)
+            try:
+                with let: start = get_mono_time()
+                renderParallel(canvas, cam, worldBVH.list(), _MaxDepth, sampler = SamplerKind.samplerRandom)
+                with let:
+                    randomTime = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+                    randomMSE = _meanSquaredError(canvas, reference)
+                    sobolStart = get_mono_time()
+                renderParallel(canvas, cam, worldBVH.list(), _MaxDepth, sampler = SamplerKind.samplerSobol)
+                with let:
+                    sobolTime = float64(in_microseconds(get_mono_time() - sobolStart)) * 1e-6
+                    sobolMSE = _meanSquaredError(canvas, reference)
+                print(f"  {spp:>4}   {randomMSE:>10.6f}   {sobolMSE:>10.6f}   {randomMSE / sobolMSE:>5.2f}   " +
+                      f"{float64(spp) * randomMSE / sobolMSE:>29.1f}   {randomTime:>8.3f}  {sobolTime:>8.3f}")
+            finally:
+                canvas.delete()
+    finally:
+        reference.delete()
+
+if comptime(__name__ == "__main__"):
+    main()
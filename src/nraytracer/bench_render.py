@@ -0,0 +1,85 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.std.cpuinfo import countProcessors
+from nimic.system.ansi_c import cmp_mem
+from primitives import Canvas, Color, newCanvas, point3, vec3, CTime, Degrees
+from cameras import camera
+from hittables import Scene
+from render import render, renderParallel
+from scenes import random_scene
+from sampling import Rng
+
+# Benchmark: multi-threaded tile renderer
+# ------------------------------------------------------------------------
+# Renders the still scene of book 1 through its BVH
+# with the serial renderer then with 1 to N threads,
+# reports the speedup and parallel efficiency
+# and checks that every output is bit-identical to the serial one.
+
+with const:
+    _Width = 384
+    _Height = 216
+    _SamplesPerPixel = 16
+    _MaxDepth = 50
+
+def _sameImage(a: Canvas, b: Canvas) -> bool:
+    return cmp_mem(a.pixels, b.pixels, a.nrows * a.ncols * sizeof(Color)) == 0
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    with let:
+        world = random_scene(worldRNG)
+        worldBVH = world.bvh(CTime(0.0), CTime(1.0))
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    with var:
+        reference = newCanvas(_Height, _Width, _SamplesPerPixel, 2.2)
+        canvas = newCanvas(_Height, _Width, _SamplesPerPixel, 2.2)
+
+    try:
+        with let: start = get_mono_time()
+        render(reference, cam, worldBVH.list(), _MaxDepth)
+        with let:
+            serial = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+        print(f"{_Width}x{_Height}, {_SamplesPerPixel} spp, {countProcessors()} cores")
+        print(f"  serial:     {serial:>8.3f} s")
+
+        for numThreads in range(1, countProcessors() + 1):
+            with let: start = get_mono_time()
+            renderParallel(canvas, cam, worldBVH.list(), _MaxDepth, numThreads)
+            with let:
+                elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+                speedup = serial / elapsed
+            doAssert(_sameImage(reference, canvas), f"output with {numThreads} threads differs from the serial render")
+            print(f"  {numThreads:>3} threads: {elapsed:>8.3f} s, speedup {speedup:>6.2f}x, efficiency {100.0 * speedup / float64(numThreads):>5.1f}%")
+    finally:
+        reference.delete()
+        canvas.delete()
+
+if comptime(__name__ == "__main__"):
+    main()
@@ -0,0 +1,92 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from primitives import Canvas, newCanvas, point3, vec3, CTime, Degrees
+from cameras import camera
+from hittables import Scene
+from render import renderParallel, NoRussianRoulette
+from scenes import random_scene
+from sampling import Rng
+
+# Benchmark: Russian roulette
+# ------------------------------------------------------------------------
+# Renders the still scene of book 1 at equal samples per pixel,
+# without Russian roulette then with several minimum depths, and reports
+# the render time and the mean squared error against a high sample count
+# reference without roulette. Roulette is unbiased, so the error measures
+# the variance it adds; time x error compares the efficiency (lower is better).
+# Canvases are linear (gamma 1) so the error is measured on radiance.
+
+with const:
+    _Width = 384
+    _Height = 216
+    _SamplesPerPixel = 16
+    _ReferenceSamples = 512
+    _MaxDepth = 50
+    _RouletteDepths = [NoRussianRoulette, 10, 5, 3, 1]
+
+def _meanSquaredError(a: Canvas, b: Canvas) -> float64:
+    with var: sum = 0.0
+    for i in range(a.nrows * a.ncols):
+        with let: d = a.pixels[i] - b.pixels[i]
+        sum += d.x * d.x + d.y * d.y + d.z * d.z
+    return sum / float64(3 * a.nrows * a.ncols)
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    with let:
+        world = random_scene(worldRNG)
+        worldBVH = world.bvh(CTime(0.0), CTime(1.0))
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    with var:
+        reference = newCanvas(_Height, _Width, _ReferenceSamples, 1.0)
+        canvas = newCanvas(_Height, _Width, _SamplesPerPixel, 1.0)
+
+    try:
+        renderParallel(reference, cam, worldBVH.list(), _MaxDepth)
+        print(f"{_Width}x{_Height}, {_SamplesPerPixel} spp, max depth {_MaxDepth}, error against {_ReferenceSamples} spp")
+
+        with var: baseline = 0.0
+        for rouletteDepth in _RouletteDepths:
+            with let: start = get_mono_time()
+            renderParallel(canvas, cam, worldBVH.list(), _MaxDepth, roulette_depth = rouletteDepth)
+            with let:
+                elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+                mse = _meanSquaredError(canvas, reference)
+            if rouletteDepth == NoRussianRoulette:
+                baseline = elapsed
+                print(f"  no roulette:     {elapsed:>8.3f} s, MSE {mse:.6f}, time x MSE {elapsed * mse:.6f}")
+            else:
+                print(f"  from depth {rouletteDepth:>3}: {elapsed:>8.3f} s ({100.0 * (1.0 - elapsed / baseline):>5.1f}% saved), " +
+                      f"MSE {mse:.6f}, time x MSE {elapsed * mse:.6f}")
+    finally:
+        reference.delete()
+        canvas.delete()
+
+if comptime(__name__ == "__main__"):
+    main()
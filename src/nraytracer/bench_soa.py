@@ -0,0 +1,121 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from math import inf
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from primitives import Ray, point3, vec3, CTime, Degrees
+from cameras import Camera, camera
+from core import HitRecord
+from hittables import Scene
+from scenes import random_scene
+from scenes_animated import random_moving_spheres, scenes, ATime
+from sampling import Rng, random
+
+# Benchmark: structure-of-arrays spheres vs HittableVariant array
+# ------------------------------------------------------------------------
+# Rays/sec of world.hit for the primary rays of a 384x216 image,
+# flat HittableList (array of structures) against SphereSoA
+# with batches of 4, 8 and 16 spheres, on both stock scenes.
+# Every ray must find the same hit with both layouts.
+
+with const:
+    _Width = 384
+    _Height = 216
+
+def _primaryRays(cam: Camera) -> seq[Ray]:
+    with var:
+        rng = Rng()
+    rng.seed(0xFACADE)
+    result = new_seq_of_cap[Ray](_Width * _Height)
+    for row in range(_Height):
+        for col in range(_Width):
+            with let:
+                u = (float64(col) + random(rng, float64)) / float64(_Width - 1)
+                v = (float64(row) + random(rng, float64)) / float64(_Height - 1)
+            result.add(cam.ray(u, v, rng))
+    return result
+
+def _benchLayout[W](name: string, world: W, lanes: static[int], rays: seq[Ray], reference: seq[HitRecord]):
+    ## `lanes` = 0 uses `world.hit`, otherwise `world.hitLanes` with that batch width
+    with var:
+        rec = HitRecord()
+        hits = 0
+    with let: start = get_mono_time()
+    for i in range(len(rays)):
+        with var: found = False
+        if comptime(lanes == 0):
+            found = world.hit(rays[i], 0.001, inf, rec)
+        else:
+            found = world.hitLanes(rays[i], 0.001, inf, rec, lanes)
+        doAssert(found == (reference[i].t > 0.0), name + " hit differs from HittableList")
+        if found:
+            hits += 1
+            doAssert(rec.t == reference[i].t and rec.materialId == reference[i].materialId,
+                     name + " hit differs from HittableList")
+    with let:
+        elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+    print(f"  {name:<8} {float64(len(rays)) / elapsed * 1e-6:>8.3f} Mrays/s ({hits} hits)")
+
+def _benchScene(title: string, scene: Scene, cam: Camera):
+    with let:
+        rays = _primaryRays(cam)
+        aos = scene.list()
+        soaStorage = scene.soa()
+        soa = soaStorage.list()
+    with var:
+        reference = new_seq[HitRecord](len(rays))
+    for i in range(len(rays)):
+        _ = aos.hit(rays[i], 0.001, inf, reference[i]) # t stays 0 on a miss
+
+    print(f"{title}: {len(scene.objects)} spheres, {_Width}x{_Height} primary rays")
+    _benchLayout("aos", aos, 0, rays, reference)
+    _benchLayout("soa x4", soa, 4, rays, reference)
+    _benchLayout("soa x8", soa, 8, rays, reference)
+    _benchLayout("soa x16", soa, 16, rays, reference)
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    # Book 1 still scene
+    with let:
+        world = random_scene(worldRNG)
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    _benchScene("random_scene", world, cam)
+
+    # First frame of the animation
+    worldRNG.seed(0xFACADE)
+    with var:
+        animation = random_moving_spheres(
+            worldRNG,
+            int32(_Height), int32(_Width),
+            ATime(0.005), ATime(0.0), ATime(6.0)
+        )
+    for frameCam, scene in scenes(animation, skip=6):
+        _benchScene("random_moving_spheres", scene, frameCam)
+        break
+
+if comptime(__name__ == "__main__"):
+    main()
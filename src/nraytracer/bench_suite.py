@@ -0,0 +1,159 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.os import *
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.std.cpuinfo import countProcessors
+from primitives import Ray, newCanvas, point3, vec3, CTime, Degrees
+from cameras import Camera, camera
+from core import HitRecord, Material
+from hittables import Scene, BVHList, TraversalStats
+from render import render, renderParallel
+from scenes import random_scene
+from scenes_animated import random_moving_spheres, frames, ATime
+from sampling import Rng
+from ppm import exportToPPM
+
+# Benchmark suite
+# ------------------------------------------------------------------------
+# Renders a fixed matrix of scenes, resolutions, samples per pixel and max depths
+# with fixed seeds and writes one CSV row per configuration:
+# - time per phase: scene build (scene and BVH), physics steps and BVH refits
+#   up to the frame (animation only), render (all cores), PPM export
+# - primary rays/s, path segments/s, box and primitive intersection tests/s.
+#
+# Work counts come from a second, instrumented single-threaded render:
+# pixels are seeded from their coordinates so it traces exactly the same paths
+# as the timed render, which stays uninstrumented.
+#
+# Usage: bench_suite [output.csv], by default build/bench_suite/bench_suite.csv
+
+with const:
+    _Resolutions = [(256, 144), (512, 288)]
+    _SamplesPerPixel = [4, 16]
+    _MaxDepths = [8, 50]
+    _MovingFrames = [0, 30]     # Frames of random_moving_spheres, 6 physics steps apart
+    _OutDir = string("build") / "bench_suite"
+    _Header = ("scene,width,height,spp,max_depth,threads,build_ms,physics_ms,render_ms,export_ms," +
+               "primary_rays_per_s,segments_per_s,box_tests_per_s,primitive_tests_per_s")
+
+class _CountingWorld(Object):
+    ## Forwards to the BVH and accumulates its traversal statistics
+    world: BVHList
+    materials: ptr[UncheckedArray[Material]]
+    stats: ptr[TraversalStats]
+
+    def hit(self: _CountingWorld, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.inline.}"""
+        return self.world.hit(r, t_min, t_max, rec, self.stats.contents)
+
+def _ms(d: Duration) -> float64:
+    """{.inline.}"""
+    return float64(in_microseconds(d)) * 1e-3
+
+def _runConfigs(output: File, name: string, cam: Camera, world: BVHList,
+                width: nint, height: nint, buildMs: float64, physicsMs: float64):
+    with var:
+        rgbBuffer = seq[uint8]()
+    for spp in _SamplesPerPixel:
+        for maxDepth in _MaxDepths:
+            with var:
+                canvas = newCanvas(height, width, spp, 2.2)
+                stats = TraversalStats()
+            try:
+                with let: renderStart = get_mono_time()
+                renderParallel(canvas, cam, world, maxDepth)
+                with let:
+                    renderMs = _ms(get_mono_time() - renderStart)
+                    exportStart = get_mono_time()
+                exportToPPM(canvas, _OutDir, name, 0, rgbBuffer)
+                with let:
+                    exportMs = _ms(get_mono_time() - exportStart)
+                    counting = _CountingWorld(world = world, materials = world.materials, stats = addr(stats))
+                render(canvas, cam, counting, maxDepth)
+
+                with let:
+                    seconds = renderMs * 1e-3
+                    primaryRays = float64(width * height * spp)
+                output.write_line(
+                    f"{name},{width},{height},{spp},{maxDepth},{countProcessors()}," +
+                    f"{buildMs:.3f},{physicsMs:.3f},{renderMs:.3f},{exportMs:.3f}," +
+                    f"{primaryRays / seconds:.0f},{float64(stats.traversals) / seconds:.0f}," +
+                    f"{float64(stats.boxTests) / seconds:.0f},{float64(stats.primitiveTests) / seconds:.0f}"
+                )
+                output.flush_file()
+                stderr.write(f"{name} {width}x{height} {spp} spp depth {maxDepth}: {renderMs:.1f} ms\n")
+            finally:
+                canvas.delete()
+
+def main():
+    with let:
+        path = paramStr(1) if paramCount() >= 1 else _OutDir / "bench_suite.csv"
+    create_dir(_OutDir)
+    with let:
+        output = open(path, fmWrite)
+    try:
+        output.write_line(_Header)
+        for (width, height) in _Resolutions:
+            with let:
+                aspect_ratio = float64(width) / float64(height)
+
+            # Book 1 still scene
+            with let: buildStart = get_mono_time()
+            with var:
+                worldRNG = Rng()
+            worldRNG.seed(0xFACADE)
+            with let:
+                scene = random_scene(worldRNG)
+                worldBVH = scene.bvh(CTime(0.0), CTime(1.0))
+                buildMs = _ms(get_mono_time() - buildStart)
+                cam = camera(
+                    point3(13,2,3),
+                    point3(0,0,0),
+                    vec3(0,1,0),
+                    Degrees(20),
+                    aspect_ratio,
+                    0.1,
+                    10.0,
+                    shutterOpen = CTime(0.0),
+                    shutterClose = CTime(1.0)
+                )
+            _runConfigs(output, "random_scene", cam, worldBVH.list(), width, height, buildMs, 0.0)
+
+            # Animation frames: the scene and its BVH are built by the first frame,
+            # the physics steps and BVH refits up to the frame are timed apart
+            for frame in _MovingFrames:
+                with let: animStart = get_mono_time()
+                worldRNG.seed(0xFACADE)
+                with var:
+                    animation = random_moving_spheres(
+                        worldRNG,
+                        int32(height), int32(width),
+                        ATime(0.005), ATime(0.0), ATime(6.0)
+                    )
+                    frameID = 0
+                    animBuildMs = 0.0
+                    physicsStart = animStart
+                for frameCam, world in frames(animation, skip=6):
+                    if frameID == 0:
+                        animBuildMs = _ms(get_mono_time() - animStart)
+                        physicsStart = get_mono_time()
+                    if frameID == frame:
+                        _runConfigs(output, f"random_moving_spheres_{frame}", frameCam, world,
+                                    width, height, animBuildMs, _ms(get_mono_time() - physicsStart))
+                        break
+                    frameID += 1
+    finally:
+        output.close()
+    stderr.write(f"Results written to {path}\n")
+
+if comptime(__name__ == "__main__"):
+    main()
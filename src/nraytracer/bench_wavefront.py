@@ -0,0 +1,85 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.strformat import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
+from nimic.system.ansi_c import cmp_mem
+from primitives import Canvas, Color, newCanvas, point3, vec3, CTime, Degrees
+from cameras import camera
+from hittables import Scene
+from render import render, renderWavefront
+from scenes import random_scene
+from sampling import Rng
+
+# Benchmark: wavefront renderer
+# ------------------------------------------------------------------------
+# Renders the still scene of book 1 through its BVH, single-threaded,
+# with the path-at-a-time renderer then with the wavefront renderer
+# for batch sizes from 16 to 4096 pixels,
+# and checks that every output is bit-identical to the reference.
+
+with const:
+    _Width = 384
+    _Height = 216
+    _SamplesPerPixel = 8
+    _MaxDepth = 50
+    _BatchSizes = [16, 64, 256, 1024, 4096]
+
+def _sameImage(a: Canvas, b: Canvas) -> bool:
+    return cmp_mem(a.pixels, b.pixels, a.nrows * a.ncols * sizeof(Color)) == 0
+
+def main():
+    with const:
+        aspect_ratio = float64(_Width) / float64(_Height)
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    with let:
+        world = random_scene(worldRNG)
+        worldBVH = world.bvh(CTime(0.0), CTime(1.0))
+        cam = camera(
+            point3(13,2,3),
+            point3(0,0,0),
+            vec3(0,1,0),
+            Degrees(20),
+            aspect_ratio,
+            0.1,
+            10.0,
+            shutterOpen = CTime(0.0),
+            shutterClose = CTime(1.0)
+        )
+    with var:
+        reference = newCanvas(_Height, _Width, _SamplesPerPixel, 2.2)
+        canvas = newCanvas(_Height, _Width, _SamplesPerPixel, 2.2)
+
+    try:
+        with let: start = get_mono_time()
+        render(reference, cam, worldBVH.list(), _MaxDepth)
+        with let:
+            pathAtATime = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+            paths = float64(_Width * _Height * _SamplesPerPixel)
+        print(f"{_Width}x{_Height}, {_SamplesPerPixel} spp, single thread")
+        print(f"  path at a time:   {pathAtATime:>8.3f} s, {paths / pathAtATime * 1e-3:>8.1f} Kpaths/s")
+
+        for batchSize in _BatchSizes:
+            with let: start = get_mono_time()
+            renderWavefront(canvas, cam, worldBVH.list(), _MaxDepth, batchSize)
+            with let:
+                elapsed = float64(in_microseconds(get_mono_time() - start)) * 1e-6
+            doAssert(_sameImage(reference, canvas), f"wavefront output with batches of {batchSize} differs from render")
+            print(f"  wavefront {batchSize:>5}:  {elapsed:>8.3f} s, {paths / elapsed * 1e-3:>8.1f} Kpaths/s, speedup {pathAtATime / elapsed:>5.2f}x")
+    finally:
+        reference.delete()
+        canvas.delete()
+
+if comptime(__name__ == "__main__"):
+    main()
@@ -0,0 +1,449 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+
+from __future__ import annotations
+from nimic.ntypes import *
+
+# Stdlib
+from nimic.std.monotimes import *
+from nimic.std.times import *
+# Internals
+from primitives import Point3, Ray, vec3, CTime
+from core import HitRecord, Material
+from aabbs import AABB, aabb, emptyAABB, surrounding_box, component
+from hittables_variants import HittableVariant
+
+# Bounding Volume Hierarchy
+# ------------------------------------------------------------------------------------------
+# Replaces the linear scan of HittableList.hit by a tree of bounding boxes.
+# Like Scene and HittableList we avoid ref types:
+# nodes reference their children and primitives by index into plain arrays
+# and traversal uses a fixed-size stack, so there is no allocation per ray.
+#
+# Construction is done in 2 steps:
+# - a builder produces a binary tree of BVHNode,
+#   either with a median split (fast build) or with the surface area heuristic (SAH)
+#   evaluated on a fixed number of bins (slower build, cheaper traversal).
+# - the tree is flattened depth-first into compact LinearBVHNode
+#   where the first child of a node is always the next node in the array.
+
+with const:
+    MaxLeafSize = 4         # Primitives per leaf
+    SAHBins = 12            # Candidate split planes per axis are the bins boundaries
+    TraversalCost = 0.5     # Cost of a box test relative to a primitive test
+    IntersectionCost = 1.0
+    _MaxSAHDepth = 32       # Past this depth the builder falls back to median splits
+    _StackSize = 64         # Traversal stack, bounds the tree depth
+
+class BVHBuildMode(NIntEnum):
+    bvhMedian = auto()      # Fast build, for large or per-frame scenes
+    bvhSAH = auto()         # High quality, for static scenes rendered many times
+
+class BVHNode(Object):
+    ## Build tree node.
+    ## Interior nodes have count == 0 and reference their 2 children,
+    ## leaves reference `count` consecutive primitives starting at `first`.
+    box: AABB
+    left: int32
+    right: int32
+    first: int32
+    count: int32
+    axis: int32
+
+class LinearBVHNode(Object):
+    ## Flattened node, 56 bytes
+    box: AABB
+    offset: int32   # leaves: first primitive, interior nodes: second child
+    count: uint16   # number of primitives, 0 for interior nodes
+    axis: uint8     # split axis, to visit the closest child first
+
+class BVHStats(Object):
+    buildTime: Duration
+    nodeCount: nint
+    leafCount: nint
+    depth: nint
+    cost: float64   # Expected traversal cost of a random ray hitting the root (SAH)
+
+class TraversalStats(Object):
+    ## Work done by BVH traversals, for benchmarks
+    traversals: int64       # Calls to hit, i.e. ray segments
+    boxTests: int64
+    primitiveTests: int64
+
+class NoStats(Object):
+    ## Discards the statistics, traversal compiles to the uninstrumented code
+    pass
+
+@dispatch
+def _count(stats: mut @ TraversalStats, traversals: nint, boxTests: nint, primitiveTests: nint):
+    """{.inline, noSideEffect.}"""
+    stats.traversals += traversals
+    stats.boxTests += boxTests
+    stats.primitiveTests += primitiveTests
+
+@dispatch
+def _count(stats: mut @ NoStats, traversals: nint, boxTests: nint, primitiveTests: nint):
+    """{.inline, noSideEffect.}"""
+    pass
+
+class BVHList(Object):
+    ## A view over the flattened nodes and the objects of a BVH
+    ## ⚠: lifetime
+    len: nint
+    nodes: ptr[UncheckedArray[LinearBVHNode]]
+    objects: ptr[UncheckedArray[HittableVariant]]
+    materials: ptr[UncheckedArray[Material]]
+
+    def _traverse[S](self: BVHList, r: Ray, t_min: float64, t_max: float64,
+                     rec: mut @ HitRecord, stats: mut @ S) -> bool:
+        """{.inline, noSideEffect.}"""
+        with var:
+            closest_so_far = t_max
+            closest = int32(-1)
+            t = 0.0
+            stack = array[_StackSize, int32]()
+            top = 0
+            current = int32(0)
+        with let:
+            inv_dir = vec3(1.0 / r.direction.x, 1.0 / r.direction.y, 1.0 / r.direction.z)
+            dirIsNeg = array[3, bool]([inv_dir.x < 0.0, inv_dir.y < 0.0, inv_dir.z < 0.0])
+        _count(stats, 1, 0, 0)
+
+        while True:
+            with let:
+                node = unsafe_addr(self.nodes[current])
+            _count(stats, 0, 1, 0)
+            if node.box.hit(r, inv_dir, t_min, closest_so_far):
+                if node.count > 0:
+                    _count(stats, 0, 0, nint(node.count))
+                    for i in range(node.offset, node.offset + int32(node.count)):
+                        if self.objects[i].intersect(r, t_min, closest_so_far, t):
+                            closest_so_far = t
+                            closest = i
+                    if top == 0: break
+                    top -= 1
+                    current = stack[top]
+                else:
+                    # Visit the child closest to the ray origin first
+                    # so that closest_so_far shrinks early and culls the other
+                    if dirIsNeg[node.axis]:
+                        stack[top] = current + 1
+                        current = node.offset
+                    else:
+                        stack[top] = node.offset
+                        current = current + 1
+                    top += 1
+            else:
+                if top == 0: break
+                top -= 1
+                current = stack[top]
+
+        # Only the closest object builds the hit record
+        if closest < 0:
+            return False
+        self.objects[closest].setHitRecord(r, closest_so_far, rec)
+        return True
+
+    @dispatch
+    def hit(self: BVHList, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.noSideEffect.}"""
+        with var: stats = NoStats()
+        return self._traverse(r, t_min, t_max, rec, stats)
+
+    @dispatch
+    def hit(self: BVHList, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord,
+            stats: mut @ TraversalStats) -> bool:
+        """{.noSideEffect.}"""
+        ## Instrumented traversal, accumulates into `stats`
+        return self._traverse(r, t_min, t_max, rec, stats)
+
+class BVH(Object):
+    ## A bounding volume hierarchy over the objects of a Scene.
+    ## Objects are copied in leaf order so that each leaf is a contiguous range.
+    ## ⚠ not thread-safe
+    nodes: seq[LinearBVHNode]
+    objects: seq[HittableVariant]
+    materials: seq[Material]
+    indices: seq[int32]     # Index in the source objects of each object, for refit
+    stats: BVHStats
+
+    def list(self: BVH) -> BVHList:
+        """{.inline, noSideEffect.}"""
+        assert len(self.nodes) > 0
+        result = BVHList()
+        result.len = len(self.nodes)
+        result.nodes = cast[ptr[UncheckedArray[LinearBVHNode]]](
+            unsafe_addr(self.nodes[0])
+        )
+        result.objects = cast[ptr[UncheckedArray[HittableVariant]]](
+            unsafe_addr(self.objects[0])
+        )
+        result.materials = cast[ptr[UncheckedArray[Material]]](
+            unsafe_addr(self.materials[0])
+        )
+        return result
+
+    def hit(self: BVH, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.inline, noSideEffect.}"""
+        return self.list().hit(r, t_min, t_max, rec)
+
+# Construction
+# ------------------------------------------------------------------------------------------
+
+class _BuildPrimitive(Object):
+    box: AABB
+    centroid: Point3
+    index: int32
+
+class _Bin(Object):
+    box: AABB
+    count: nint
+
+def _nthElement(prims: mut @ seq[_BuildPrimitive], lo: nint, hi: nint, nth: nint, axis: nint):
+    """{.noSideEffect.}"""
+    ## Quickselect on the centroids along `axis`:
+    ## partially reorders prims[lo ..< hi] so that prims[nth] is at its sorted position,
+    ## with no larger centroid before it and no smaller centroid after it.
+    with var:
+        left = lo
+        right = hi - 1
+    while right > left:
+        with let:
+            pivot = component(prims[(left + right) // 2].centroid, axis)
+        with var:
+            i = left
+            j = right
+        while i <= j:
+            while component(prims[i].centroid, axis) < pivot: i += 1
+            while component(prims[j].centroid, axis) > pivot: j -= 1
+            if i <= j:
+                swap(prims[i], prims[j])
+                i += 1
+                j -= 1
+        if nth <= j:
+            right = j
+        elif nth >= i:
+            left = i
+        else:
+            return
+
+def _binOf(prim: _BuildPrimitive, axis: nint, cmin: float64, cmax: float64) -> nint:
+    """{.inline, noSideEffect.}"""
+    result = nint(float64(SAHBins) * (component(prim.centroid, axis) - cmin) / (cmax - cmin))
+    if result >= SAHBins:
+        result = SAHBins - 1
+    return result
+
+def _sahSplit(prims: mut @ seq[_BuildPrimitive], lo: nint, hi: nint,
+              box: AABB, centroidBox: AABB, axis: nint) -> nint:
+    """{.noSideEffect.}"""
+    ## Binned SAH: evaluate the SAHBins-1 planes between bins along `axis`.
+    ## Returns the partition point, or -1 if a leaf is cheaper than any split,
+    ## or `lo` if no plane pays off but there are too many primitives for a leaf.
+    with let:
+        cmin = component(centroidBox.minimum, axis)
+        cmax = component(centroidBox.maximum, axis)
+    with var:
+        bins = array[SAHBins, _Bin]()
+    for b in range(SAHBins):
+        bins[b].box = emptyAABB()
+    for i in range(lo, hi):
+        with let: b = _binOf(prims[i], axis, cmin, cmax)
+        bins[b].count += 1
+        bins[b].box = surrounding_box(bins[b].box, prims[i].box)
+
+    # Sweep from the right to get the area and count right of each plane,
+    # then from the left to evaluate the cost of each plane.
+    with var:
+        rightArea = array[SAHBins, float64]()
+        rightCount = array[SAHBins, nint]()
+        acc = emptyAABB()
+        accCount = 0
+    for b in countdown(SAHBins - 1, 1):
+        acc = surrounding_box(acc, bins[b].box)
+        accCount += bins[b].count
+        rightArea[b] = acc.surface_area()
+        rightCount[b] = accCount
+
+    with var:
+        bestCost = float64(hi - lo) * IntersectionCost # Leaf
+        bestPlane = -1
+    acc = emptyAABB()
+    accCount = 0
+    with let: invArea = 1.0 / box.surface_area()
+    for plane in range(1, SAHBins):
+        acc = surrounding_box(acc, bins[plane - 1].box)
+        accCount += bins[plane - 1].count
+        if accCount == 0 or rightCount[plane] == 0:
+            continue
+        with let:
+            cost = TraversalCost + IntersectionCost * invArea * (
+                float64(accCount) * acc.surface_area() +
+                float64(rightCount[plane]) * rightArea[plane]
+            )
+        if cost < bestCost:
+            bestCost = cost
+            bestPlane = plane
+
+    if bestPlane == -1 and hi - lo <= MaxLeafSize:
+        return -1
+    if bestPlane == -1:
+        # Too many primitives for a leaf: the caller splits at the median
+        return lo
+
+    # Partition in place around the chosen plane
+    with var:
+        i = lo
+        j = hi - 1
+    while i <= j:
+        if _binOf(prims[i], axis, cmin, cmax) < bestPlane:
+            i += 1
+        else:
+            swap(prims[i], prims[j])
+            j -= 1
+    return i
+
+def _buildRecursive(nodes: mut @ seq[BVHNode], prims: mut @ seq[_BuildPrimitive],
+                    lo: nint, hi: nint, mode: BVHBuildMode,
+                    depth: nint, stats: mut @ BVHStats) -> int32:
+    """{.noSideEffect.}"""
+    ## Build the subtree over prims[lo ..< hi] and return its root index.
+    with var:
+        node = BVHNode()
+        centroidBox = aabb(prims[lo].centroid, prims[lo].centroid)
+    node.box = prims[lo].box
+    for i in range(lo + 1, hi):
+        node.box = surrounding_box(node.box, prims[i].box)
+        centroidBox = surrounding_box(centroidBox, aabb(prims[i].centroid, prims[i].centroid))
+
+    result = int32(len(nodes))
+    nodes.add(node)
+    stats.depth = max(stats.depth, depth)
+
+    with let:
+        count = hi - lo
+        axis = centroidBox.longest_axis()
+    with var:
+        mid = -1
+    if component(centroidBox.maximum, axis) == component(centroidBox.minimum, axis):
+        # All centroids coincide: no plane can separate them
+        pass
+    elif mode == BVHBuildMode.bvhSAH and depth < _MaxSAHDepth and count > 2:
+        mid = _sahSplit(prims, lo, hi, node.box, centroidBox, axis)
+        if mid == lo or mid == hi:
+            # Forced split of an oversized leaf, the chosen planes have primitives on both sides
+            mid = lo + count // 2
+            _nthElement(prims, lo, hi, mid, axis)
+    elif count > MaxLeafSize:
+        mid = lo + count // 2
+        _nthElement(prims, lo, hi, mid, axis)
+
+    if mid == -1:
+        nodes[result].first = int32(lo)
+        nodes[result].count = int32(count)
+        return result
+
+    with let:
+        left = _buildRecursive(nodes, prims, lo, mid, mode, depth + 1, stats)
+        right = _buildRecursive(nodes, prims, mid, hi, mode, depth + 1, stats)
+    nodes[result].left = left
+    nodes[result].right = right
+    nodes[result].axis = int32(axis)
+    return result
+
+def _flatten(linear: mut @ seq[LinearBVHNode], nodes: seq[BVHNode], idx: int32) -> int32:
+    """{.noSideEffect.}"""
+    ## Depth-first layout: the first child of an interior node is the next node,
+    ## the second child is at `offset`.
+    result = int32(len(linear))
+    with var:
+        lnode = LinearBVHNode()
+    lnode.box = nodes[idx].box
+    linear.add(lnode)
+    if nodes[idx].count > 0:
+        assert nodes[idx].count <= nint(high(uint16))
+        linear[result].offset = nodes[idx].first
+        linear[result].count = uint16(nodes[idx].count)
+    else:
+        linear[result].axis = uint8(nodes[idx].axis)
+        _ = _flatten(linear, nodes, nodes[idx].left)
+        with let: second = _flatten(linear, nodes, nodes[idx].right)
+        linear[result].offset = second
+    return result
+
+def _expectedCost(linear: seq[LinearBVHNode]) -> float64:
+    """{.noSideEffect.}"""
+    ## SAH cost of the tree: the probability for a ray hitting the root
+    ## to hit a node is the ratio of their surface areas.
+    with let: invRootArea = 1.0 / linear[0].box.surface_area()
+    result = 0.0
+    for i in range(len(linear)):
+        with let: p = linear[i].box.surface_area() * invRootArea
+        if linear[i].count > 0:
+            result += p * IntersectionCost * float64(linear[i].count)
+        else:
+            result += p * TraversalCost
+    return result
+
+def buildBVH(objects: openArray[HittableVariant], materials: openArray[Material],
+             time0: CTime, time1: CTime, mode = BVHBuildMode.bvhSAH) -> BVH:
+    ## Build a BVH over `objects`, whose material ids index `materials`.
+    ## Moving objects are bounded over the whole shutter interval [time0, time1].
+    assert len(objects) > 0
+    with let: start = get_mono_time()
+    with var:
+        prims = new_seq[_BuildPrimitive](len(objects))
+        tree = new_seq_of_cap[BVHNode](2 * len(objects) // MaxLeafSize + 1)
+    for i in range(len(objects)):
+        prims[i].box = objects[i].bounding_box(time0, time1)
+        prims[i].centroid = prims[i].box.centroid()
+        prims[i].index = int32(i)
+
+    result = BVH()
+    _ = _buildRecursive(tree, prims, 0, len(prims), mode, 0, result.stats)
+    assert result.stats.depth < _StackSize
+
+    result.nodes = new_seq_of_cap[LinearBVHNode](len(tree))
+    _ = _flatten(result.nodes, tree, 0)
+
+    result.objects = new_seq[HittableVariant](len(objects))
+    result.indices = new_seq[int32](len(objects))
+    for i in range(len(prims)):
+        result.objects[i] = objects[prims[i].index]
+        result.indices[i] = prims[i].index
+    result.materials = new_seq[Material](len(materials))
+    for i in range(len(materials)):
+        result.materials[i] = materials[i]
+
+    result.stats.buildTime = get_mono_time() - start
+    result.stats.nodeCount = len(result.nodes)
+    for i in range(len(result.nodes)):
+        if result.nodes[i].count > 0:
+            result.stats.leafCount += 1
+    result.stats.cost = _expectedCost(result.nodes)
+    return result
+
+def refit(self: mut @ BVH, objects: openArray[HittableVariant], time0: CTime, time1: CTime):
+    """{.noSideEffect.}"""
+    ## Update the BVH after the objects moved, keeping its topology.
+    ## `objects` are the objects it was built over, in the same order.
+    ## No allocation: objects are copied in place and boxes recomputed bottom-up,
+    ## children are always after their parent in the flattened layout.
+    ## The tree quality degrades as objects drift from their initial positions.
+    assert len(objects) == len(self.objects)
+    for i in range(len(self.objects)):
+        self.objects[i] = objects[self.indices[i]]
+
+    for n in countdown(len(self.nodes) - 1, 0):
+        with var:
+            box = emptyAABB()
+        if self.nodes[n].count > 0:
+            for i in range(self.nodes[n].offset, self.nodes[n].offset + int32(self.nodes[n].count)):
+                box = surrounding_box(box, self.objects[i].bounding_box(time0, time1))
+        else:
+            box = surrounding_box(self.nodes[n + 1].box, self.nodes[self.nodes[n].offset].box)
+        self.nodes[n].box = box
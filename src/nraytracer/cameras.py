@@ -10,7 +10,7 @@ from nimic.ntypes import *
 
 from math import tan
 from primitives import Point3, Vec3, CTime, Ray, ray, Degrees, degToRad
-from sampling import Rng, random_in_unit_disk, random
+from sampling import Rng, QmcSampler, random_in_unit_disk, random
 
 class Camera(Object):
     origin: Point3
@@ -24,7 +24,8 @@ class Camera(Object):
     shutterOpen: CTime
     shutterClose: CTime
 
-    def ray(self: Camera, s: float64, t: float64, var_rng: mut @ Rng) -> Ray:
+    def ray[R](self: Camera, s: float64, t: float64, var_rng: mut @ R) -> Ray:
+        ## `var_rng` is an Rng or a QmcSampler
         with let:
             rd = self.lens_radius * random_in_unit_disk(var_rng, Vec3)
             offset = self.u*rd.x + self.v*rd.y
@@ -49,11 +49,13 @@ def newCanvas(
     result.gamma_correction = float32(gamma_correction)
     return result
 
-def draw(canvas: mut @ Canvas, row: SomeInteger, col: SomeInteger, pixel: Color):
+@dispatch
+def draw(canvas: mut @ Canvas, row: SomeInteger, col: SomeInteger, pixel: Color, samples: SomeInteger):
     """{.inline.}"""
-    # Draw a gamma-corrected pixel in the canvas
+    # Draw a gamma-corrected pixel in the canvas,
+    # `pixel` is the sum of `samples` samples
     with let:
-        scale = 1.0 / float64(canvas.samples_per_pixel)
+        scale = 1.0 / float64(samples)
         gamma = 1.0 / float64(canvas.gamma_correction)
         pos = row*canvas.ncols + col
     # print(pos, pixel.x, pixel.y, pixel.z)
@@ -61,6 +63,12 @@ def draw(canvas: mut @ Canvas, row: SomeInteger, col: SomeInteger, pixel: Color)
     canvas.pixels[pos].y = pow(scale * pixel.y, gamma)
     canvas.pixels[pos].z = pow(scale * pixel.z, gamma)
 
+@dispatch
+def draw(canvas: mut @ Canvas, row: SomeInteger, col: SomeInteger, pixel: Color):
+    """{.inline.}"""
+    # Draw a gamma-corrected pixel in the canvas
+    draw(canvas, row, col, pixel, canvas.samples_per_pixel)
+
 # Trace of Radiance
 # Copyright (c) 2020 Mamy André-Ratsimbazafy
 # Licensed and distributed under either of
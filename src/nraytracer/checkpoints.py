@@ -0,0 +1,90 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.os import *
+from nimic.std.strutils import *
+from nimic.std.syncio import write_buffer, read_file
+from nimic.system.ansi_c import copy_mem
+
+# Checkpoints
+# ------------------------------------------------------------------------
+# Long renders save their state to a checkpoint file to be resumed later.
+# Values and sequences of plain old data (no seq, string, ref or pointer inside)
+# are appended to a byte buffer as in memory, without any conversion:
+# a checkpoint is only readable by the same build on the same machine.
+# The file is written to a temporary file then renamed,
+# so that an interrupted save leaves the previous checkpoint intact.
+
+with const:
+    CheckpointMagic = "NRTCKPT1"
+
+class CheckpointWriter(Object):
+    buffer: seq[uint8]
+
+class CheckpointReader(Object):
+    data: string
+    pos: nint
+
+def _append(w: mut @ CheckpointWriter, p: pointer, size: nint):
+    if size == 0:
+        return
+    with let: pos = len(w.buffer)
+    w.buffer.set_len(pos + size)
+    copy_mem(addr(w.buffer[pos]), p, size)
+
+def writeValue[T](w: mut @ CheckpointWriter, x: T):
+    """{.inline.}"""
+    w._append(unsafe_addr(x), sizeof(T))
+
+def writeSeq[T](w: mut @ CheckpointWriter, s: openArray[T]):
+    ## Length then elements
+    w.writeValue(int64(len(s)))
+    if len(s) > 0:
+        w._append(unsafe_addr(s[0]), len(s) * sizeof(T))
+
+def _take(r: mut @ CheckpointReader, p: pointer, size: nint):
+    doAssert(size >= 0 and r.pos + size <= len(r.data), "Truncated checkpoint")
+    if size > 0:
+        copy_mem(p, unsafe_addr(r.data[r.pos]), size)
+    r.pos += size
+
+def readValue[T](r: mut @ CheckpointReader, x: mut @ T):
+    """{.inline.}"""
+    r._take(addr(x), sizeof(T))
+
+def readSeq[T](r: mut @ CheckpointReader, s: mut @ seq[T]):
+    ## Read a sequence saved by `writeSeq`, `s` is resized
+    with var: n = int64(0)
+    r.readValue(n)
+    doAssert(n >= 0 and r.pos + nint(n) * sizeof(T) <= len(r.data), "Truncated checkpoint")
+    s.set_len(nint(n))
+    if n > 0:
+        r._take(addr(s[0]), nint(n) * sizeof(T))
+
+def saveCheckpoint(w: CheckpointWriter, path: string):
+    with let:
+        tmpPath = path + ".tmp"
+        f = open(tmpPath, fmWrite)
+    try:
+        f.write(CheckpointMagic)
+        if len(w.buffer) > 0:
+            with let:
+                written = write_buffer(f, unsafe_addr(w.buffer[0]), len(w.buffer))
+            doAssert(written == len(w.buffer), "Failed to write the checkpoint")
+    finally:
+        f.close()
+    move_file(tmpPath, path)
+
+def loadCheckpoint(path: string) -> CheckpointReader:
+    ## The reader is positioned after the header
+    result = CheckpointReader(data = read_file(path))
+    doAssert(result.data.starts_with(CheckpointMagic), path + " is not a checkpoint")
+    result.pos = len(CheckpointMagic)
+    return result
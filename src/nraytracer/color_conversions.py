@@ -9,6 +9,8 @@
 from __future__ import annotations
 from nimic.ntypes import *
 
+from primitives import Canvas, Color, clamp
+
 class RGB_to_YCbCr_Coefs(Object):
     kr: uint8
     kg: uint8
@@ -210,6 +212,80 @@ def rgbRaw_to_ycbcr420(
             V[ii, jj] = uint8((((tV >> 2) * int16(coefs.fr)) >> 8) + 128)
 
 
+# Float canvas input
+# ------------------------------------------------------
+# Same conversion as rgbRaw_to_ycbcr420 but reading the float Canvas:
+# clamping and quantization to 8-bit (as in the PPM export) are fused
+# with the conversion, so there is no intermediate RGB buffer.
+# The canvas pixels are already gamma corrected by `draw`.
+# Canvas rows are stored bottom-up, image rows top-down.
+#
+# Rows are processed whole in loops without dependencies between columns
+# so that they can be vectorized:
+# - per row, quantize, compute and store the luma and accumulate
+#   B - Y' and R - Y' per column,
+# - per pair of rows, reduce the 2x2 accumulators into Cb and Cr.
+# The output is bit-identical to quantizing then calling rgbRaw_to_ycbcr420.
+
+def _quantize(c: float64) -> int16:
+    """{.inline.}"""
+    return int16(256 * clamp(c, 0.0, 0.999))
+
+def canvas_to_ycbcr420(
+    canvas: Canvas,
+    luma: ChannelDescriptor[uint8],
+    chromaBlue: ChannelDescriptor[uint8],
+    chromaRed: ChannelDescriptor[uint8],
+    ycbcrKind: static[YCbCrKind]
+):
+    with let:
+        coefs = RGB_YCbCr_Coefs[int32(ycbcrKind)]
+        width = canvas.ncols
+        height = canvas.nrows
+        kr = int16(coefs.kr)
+        kg = int16(coefs.kg)
+        kb = int16(coefs.kb)
+        yScale = int16(coefs.y_scale)
+        yMin = int16(coefs.y_min)
+
+    assert (width % 2) == 0, "Width must be a multiple of 2"
+    assert (height % 2) == 0, "Height must be a multiple of 2"
+
+    with var:
+        # B - Y' and R - Y' summed over the 2 rows of a pair, per column
+        diffB = new_seq[int16](width)
+        diffR = new_seq[int16](width)
+
+    for ii in range(0, height, 2):
+        for j in range(width):
+            diffB[j] = 0
+            diffR[j] = 0
+
+        for row in range(ii, ii + 2):
+            with let:
+                src = cast[ptr[UncheckedArray[Color]]](addr(canvas.pixels[(height - 1 - row) * width]))
+                dst = cast[ptr[UncheckedArray[uint8]]](addr(luma.buffer[row * luma.stride]))
+            for j in range(width):
+                with let:
+                    r = _quantize(src[j].x)
+                    g = _quantize(src[j].y)
+                    b = _quantize(src[j].z)
+                    tY = int16((uint16(kr) * uint16(r) + uint16(kg) * uint16(g) + uint16(kb) * uint16(b)) >> 8)
+                dst[j] = uint8(((uint16(tY) * uint16(yScale)) >> 7) + uint16(yMin))
+                diffB[j] += b - tY
+                diffR[j] += r - tY
+
+        with let:
+            cb = cast[ptr[UncheckedArray[uint8]]](addr(chromaBlue.buffer[(ii >> 1) * chromaBlue.stride]))
+            cr = cast[ptr[UncheckedArray[uint8]]](addr(chromaRed.buffer[(ii >> 1) * chromaRed.stride]))
+        for jj in range(width >> 1):
+            with let:
+                tU = diffB[2*jj] + diffB[2*jj + 1]
+                tV = diffR[2*jj] + diffR[2*jj + 1]
+            cb[jj] = uint8((((tU >> 2) * int16(coefs.fb)) >> 8) + 128)
+            cr[jj] = uint8((((tV >> 2) * int16(coefs.fr)) >> 8) + 128)
+
+
 
 # Trace of Radiance
 # Copyright (c) 2020 Mamy André-Ratsimbazafy
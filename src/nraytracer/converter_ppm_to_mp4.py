@@ -11,6 +11,7 @@ from nimic.std.os import *
 from nimic.std.strutils import *
 from nimic.std.strformat import *
 from nimic.std.algorithm import *
+from nimic.system.ansi_c import copy_mem
 from h264 import H264Encoder, init, getFrameBuffers, flushFrame, finish
 from mp4 import *
 from color_conversions import RGB_Raw, initChannelDesc, rgbRaw_to_ycbcr420, YCbCrKind
@@ -21,43 +22,47 @@ with const:
     Height = 288
     FPS = 30
 
-# Parse a P3 PPM file into a flat array of RGB bytes (r,g,b,r,g,b,...)
+# Parse a P3 or P6 PPM file into a flat array of RGB bytes (r,g,b,r,g,b,...)
 def readPPM(path: string) -> seq[uint8]:
     with let:
         content = read_file(path)
     with var:
         pos = 0
-        lineNum = 0
-        width = 0
-        height = 0
-        maxVal = 0
-
-    # Parse header
-    for line in string(content).splitlines():
-        if len(line) == 0 or str(line[0]) == "#":
-            pos += len(line) + 1
+        header = seq[string]()
+
+    # Header: magic, width, height, maxVal, separated by whitespace or comments,
+    # followed by a single whitespace before the pixel data
+    while len(header) < 4:
+        while pos < len(content) and content[pos] in Whitespace:
+            pos += 1
+        if pos < len(content) and content[pos] == ch('#'):
+            while pos < len(content) and content[pos] != ch('\n'):
+                pos += 1
             continue
-        match lineNum:
-            case 0:
-                assert line == "P3", "Expected P3 format, got: " + line
-            case 1:
-                with let:
-                    parts = string(line).strip().split()
-                width = parse_int(parts[0])
-                height = parse_int(parts[1])
-            case 2:
-                maxVal = parse_int(string(line).strip())
-                assert maxVal == 255
-                pos += len(line) + 1
-                lineNum += 1
-                break
-            case _:
-                pass
-        lineNum += 1
-        pos += len(line) + 1
+        with var:
+            tok = ""
+        while pos < len(content) and content[pos] not in Whitespace:
+            tok.add(content[pos])
+            pos += 1
+        doAssert(len(tok) > 0, "Truncated PPM header: " + path)
+        header.add(tok)
+    pos += 1
+
+    with let:
+        magic = header[0]
+        width = parse_int(header[1])
+        height = parse_int(header[2])
+        maxVal = parse_int(header[3])
+    assert maxVal == 255
 
-    # Parse pixel data
     result = new_seq[uint8](width * height * 3)
+    if magic == "P6":
+        assert len(content) - pos >= len(result), "Truncated P6 pixel data: " + path
+        copy_mem(addr(result[0]), unsafe_addr(content[pos]), len(result))
+        return result
+
+    # Parse pixel data
+    assert magic == "P3", "Expected P3 or P6 format, got: " + magic
     with var:
         idx = 0
     with let:
@@ -68,7 +73,6 @@ def readPPM(path: string) -> seq[uint8]:
             idx += 1
     return result
 
-
 def main():
     print("Reference MP4 Generator")
     print(f"Reading PPM frames from {RenderedDir}/")
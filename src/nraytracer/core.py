@@ -8,7 +8,7 @@
 from __future__ import annotations
 from nimic.ntypes import *
 
-from primitives import Point3, Vec3, Attenuation, Ray
+from primitives import Point3, Vec3, Color, Attenuation, Ray
 
 # Type declarations
 # ------------------------------------------------------------------------------------------
@@ -40,6 +40,18 @@ class Material(Object):
         case MaterialKind.kDielectric:
             fDielectric: Dielectric
 
+    def __eq__(a: Material, b: Material) -> bool:
+        """{.noSideEffect.}"""
+        if a.kind != b.kind:
+            return False
+        match a.kind:
+            case MaterialKind.kMetal:
+                return Color(a.fMetal.albedo) == Color(b.fMetal.albedo) and a.fMetal.fuzz == b.fMetal.fuzz
+            case MaterialKind.kLambertian:
+                return Color(a.fLambertian.albedo) == Color(b.fLambertian.albedo)
+            case MaterialKind.kDielectric:
+                return a.fDielectric.refraction_index == b.fDielectric.refraction_index
+
 @dispatch
 def material(subtype: Metal) -> Material:
     """{.inline, noSideEffect.}"""
@@ -58,10 +70,36 @@ def material(subtype: Dielectric) -> Material:
     result = Material(kind=MaterialKind.kDielectric, fDielectric=subtype)
     return result
 
+class MaterialTable(Object):
+    ## Deduplicated materials of a scene.
+    ## Primitives and HitRecord refer to them by index (material id)
+    ## so that a hit only copies a small integer.
+    entries: seq[Material]
+
+    @dispatch
+    def add(self: mut @ MaterialTable, m: Material) -> uint16:
+        """{.noSideEffect.}"""
+        ## Returns the id of `m`, appending it if it is not in the table yet
+        for i in range(len(self.entries)):
+            if self.entries[i] == m:
+                return uint16(i)
+        assert len(self.entries) < 65536, "Too many materials for a uint16 material id"
+        self.entries.add(m)
+        return uint16(len(self.entries) - 1)
+
+    @dispatch
+    def add[T](self: mut @ MaterialTable, materialKind: T) -> uint16:
+        """{.inline, noSideEffect.}"""
+        return self.add(material(materialKind))
+
+    def clear(self: mut @ MaterialTable):
+        """{.inline, noSideEffect.}"""
+        self.entries.set_len(0)
+
 class HitRecord(Object):
     p: Point3
     normal: Vec3
-    material: Material
+    materialId: uint16  # Index in the MaterialTable of the scene
     t: float64        # t_min < t < t_max, the ray position
     front_face: bool
 
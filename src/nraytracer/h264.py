@@ -9,6 +9,10 @@
 from __future__ import annotations
 from nimic.ntypes import *
 from nimic.std.endians import big_endian32
+from nimic.std.atomics import *
+from nimic.std.cpuinfo import countProcessors
+from nimic.std.typedthreads import *
+from nimic.system.ansi_c import copy_mem
 
 
 class BitBuffer(Object):
@@ -30,19 +34,40 @@ class Frame(Object):
 
 # class Frame(FrameObject): pass
 
+class H264Coding(NIntEnum):
+    ## Macroblock coding of `H264Encoder`
+    codingPCM = auto()          # Lossless I_PCM samples, about 1.5 bytes per pixel
+    codingIntra16x16 = auto()   # 16x16 intra prediction, 4x4 integer transform, quantization at `qp`, CAVLC
+
 class H264Encoder(Object):
     sps: seq[byte]
     pps: seq[byte]
     slice_header: seq[byte]
     needCropping: bool
-    output: File
+    output: File        # nil when encoding to memory
+    stream: seq[byte]   # Annex B byte stream when encoding to memory
+    slice: seq[byte]    # Slice assembled before a single write to `output`, reused across frames
     frame: Frame
+    numSlices: nint     # Slices per frame, bands of whole macroblock rows
+    numThreads: nint    # Threads encoding the slices, 0 for one per core
+    sliceBuffers: seq[seq[byte]]    # One per slice when numSlices > 1 or coded, reused across frames
+    sliceSizes: seq[nint]
+    coding: H264Coding
+    qp: nint            # Quantization parameter of codingIntra16x16, 0 (finest) to 51
+    recon: Frame        # Decoded frame with codingIntra16x16, source of the intra prediction
+    totalCoeffs: seq[uint8]         # Non-zero coefficients of each 4x4 block (luma, Cb, Cr) for the CAVLC contexts
+    sliceRbsp: seq[seq[byte]]       # Slices written bit by bit before emulation prevention, one per slice
+    gopSize: nint       # Frames from one IDR frame to the next, 1 for IDR frames only
+    gopIndex: nint      # Frame being encoded in the GOP, P frames after the first
+    skipTolerance: nint # Largest sample difference of a P_Skip macroblock with its reference
+    reference: Frame    # Source samples of each macroblock when last coded, with P frames
 
 with const:
-    _PPS = array[8, byte]([0x00, 0x00, 0x00, 0x01, 0x68, 0xce, 0x38, 0x80])
-    _SliceHeader = array[9, byte]([0x00, 0x00, 0x00, 0x01, 0x05, 0x88, 0x84, 0x21, 0xa0])
     _MacroblockHeader = array[2, byte]([0x0d, 0x00])
     _SliceStopBit = uint8(0x80)
+    _MacroblockSize = 16*16 + 2 * 8*8 # I_PCM samples: 16x16 luma, 2x 8x8 chroma
+    _MaxSliceHeaderSize = 24 # Start code, slice header with the longest first_mb_in_slice, first mb_type
+    _MaxCodedMacroblockSize = _MacroblockSize + 8 # I_PCM written bit by bit: mb_skip_run, mb_type, alignment
 
 # Accessors Pointer arithmetics
 @template
@@ -101,6 +126,11 @@ def UE(val: SomeInteger):
     """{.dirty.}"""
     putGolomb(bb, uint32(val))
 
+@template
+def SE(val: SomeInteger):
+    """{.dirty.}"""
+    putGolomb(bb, uint32(2 * val - 1) if val > 0 else uint32(-2 * val))
+
 @template_expand
 def initSPS(enc: mut@H264Encoder, width: nint, height: nint):
     enc.sps.newSeq(32) # A hack to avoid realloc
@@ -139,7 +169,7 @@ def initSPS(enc: mut@H264Encoder, width: nint, height: nint):
     UE(0)    # pic_order_cnt_type
     UE(0)    # log2_max_pic_order_cnt_lsb_minus4
 
-    UE(0)    # num_ref_frames
+    UE(1 if enc.gopSize > 1 else 0)  # num_ref_frames: P frames predict from the previous frame
     U(1, uint32(0))  # gaps_in_frame_num_value_allowed_flag
     # in Python bitwise operators have lower precedance than arithmetic operators
     UE(((width + 15) >> 4) - 1)  # pic_width_in_mbs_minus_1
@@ -160,6 +190,101 @@ def initSPS(enc: mut@H264Encoder, width: nint, height: nint):
     flush(bb)
     enc.sps.setLen(bb.cursor - (bb.shift // 8))
 
+def _isPFrame(enc: H264Encoder) -> bool:
+    """{.inline.}"""
+    return enc.gopIndex > 0
+
+def _intraMbTypeOffset(enc: H264Encoder) -> nint:
+    """{.inline.}"""
+    ## Intra mb_type values follow the 5 inter ones in P slices
+    return 5 if _isPFrame(enc) else 0
+
+def _deblockingDisabled(enc: H264Encoder) -> bool:
+    """{.inline.}"""
+    ## Without the deblocking filter the decoded picture is exactly the encoder's
+    ## reconstruction, and P_Skip is an exact copy of the reference
+    return enc.coding != H264Coding.codingPCM or enc.gopSize > 1
+
+@template_expand
+def initPPS(enc: mut@H264Encoder):
+    ## With codingPCM: 00 00 00 01 68 ce 38 80
+    enc.pps.newSeq(16)
+    with var:
+        bb = BitBuffer(
+            shift=32,
+            cache=0,
+            buf=cast[ptr[UncheckedArray[uint8]]](addr(enc.pps[0])),
+            cursor=4
+        )
+    enc.pps[0:4] = array[4, byte]([0x00, 0x00, 0x00, 0x01])
+
+    U(1, uint32(0))  # forbidden_zero_bit
+    U(2, uint32(3))  # nal_ref_idc
+    U(5, uint32(8))  # nal_unit_type
+
+    UE(0)            # pic_parameter_set_id
+    UE(0)            # seq_parameter_set_id
+    U(1, uint32(0))  # entropy_coding_mode_flag: CAVLC
+    U(1, uint32(0))  # bottom_field_pic_order_in_frame_present_flag
+    UE(0)            # num_slice_groups_minus1
+    UE(0)            # num_ref_idx_l0_default_active_minus1
+    UE(0)            # num_ref_idx_l1_default_active_minus1
+    U(1, uint32(0))  # weighted_pred_flag
+    U(2, uint32(0))  # weighted_bipred_idc
+    SE(enc.qp - 26)  # pic_init_qp_minus26
+    SE(0)            # pic_init_qs_minus26
+    SE(0)            # chroma_qp_index_offset
+    U(1, uint32(_deblockingDisabled(enc))) # deblocking_filter_control_present_flag
+    U(1, uint32(0))  # constrained_intra_pred_flag
+    U(1, uint32(0))  # redundant_pic_cnt_present_flag
+    U(1, uint32(1))  # Stop bit
+
+    flush(bb)
+    enc.pps.setLen(bb.cursor - (bb.shift // 8))
+
+@template_expand
+def _putSliceHeader(bb: mut@BitBuffer, enc: H264Encoder, firstMb: nint):
+    ## NAL unit header and header of a slice starting at macroblock `firstMb`:
+    ## IDR slice at the start of a GOP, P slice otherwise.
+    ## Every frame is a reference: IDR slices must be, and with P frames
+    ## each frame is the reference of the next one.
+    U(1, uint32(0))  # forbidden_zero_bit
+    U(2, uint32(3))  # nal_ref_idc
+    U(5, uint32(1) if _isPFrame(enc) else uint32(5))  # nal_unit_type: non-IDR or IDR slice
+
+    UE(firstMb)      # first_mb_in_slice
+    UE(5 if _isPFrame(enc) else 7) # slice_type: P or I, all the slices of the picture
+    UE(0)            # pic_parameter_set_id
+    U(4, uint32(enc.gopIndex & 15)) # frame_num
+    if not _isPFrame(enc):
+        UE(0)        # idr_pic_id
+    U(4, uint32((2 * enc.gopIndex) & 15)) # pic_order_cnt_lsb
+    if _isPFrame(enc):
+        U(1, uint32(0)) # num_ref_idx_active_override_flag
+        U(1, uint32(0)) # ref_pic_list_modification_flag_l0
+    # dec_ref_pic_marking
+    if _isPFrame(enc):
+        U(1, uint32(0)) # adaptive_ref_pic_marking_mode_flag: sliding window
+    else:
+        U(1, uint32(0)) # no_output_of_prior_pics_flag
+        U(1, uint32(0)) # long_term_reference_flag
+    UE(0)            # slice_qp_delta
+    if _deblockingDisabled(enc):
+        UE(1)        # disable_deblocking_filter_idc
+
+def _writeSliceHeader(enc: H264Encoder, dst: ptr[UncheckedArray[byte]], firstMb: nint) -> nint:
+    ## Start code and header of a PCM slice starting at macroblock `firstMb`,
+    ## followed by the mb_type of its first macroblock, returns the size in bytes.
+    ## For the first slice: 00 00 00 01 65 88 84 10 d0
+    dst[0] = byte(0x00); dst[1] = byte(0x00); dst[2] = byte(0x00); dst[3] = byte(0x01)
+    with var:
+        bb = BitBuffer(shift=32, cache=0, buf=dst, cursor=4)
+    _putSliceHeader(bb, enc, firstMb)
+    putGolomb(bb, uint32(25))   # mb_type: I_PCM
+    # pcm_alignment_zero_bits
+    flush(bb)
+    return bb.cursor - (bb.shift // 8)
+
 def initialize(frame: mut@Frame, width: nint, height: nint):
     assert frame.is_nil, "Frame must be nil"
 
@@ -184,37 +309,974 @@ def initialize(frame: mut@Frame, width: nint, height: nint):
     frame.Cb = offset(addr(frame.buffer), fullSized)
     frame.Cr = offset(frame.Cb, halfSized)
 
-def init(_: type[H264Encoder], width: nint, height: nint, output: File) -> H264Encoder:
+# Output
+def _emit(enc: mut@H264Encoder, data: openArray[byte]):
+    """{.inline.}"""
+    if enc.output.is_nil:
+        enc.stream.add(data)
+    else:
+        _ = write_bytes(enc.output, data, 0, len(data))
+
+def _initSlices(enc: mut@H264Encoder, slices: nint, numThreads: nint):
+    with let:
+        mbRows = enc.frame.lumaHeight // 16
+    doAssert(slices >= 1 and slices <= mbRows,
+             "A slice is at least one macroblock row, 1 to " + str(mbRows) + " slices")
+    enc.numSlices = slices
+    enc.numThreads = numThreads
+    if slices > 1 or enc.coding != H264Coding.codingPCM or enc.gopSize > 1:
+        enc.sliceBuffers = new_seq[seq[byte]](slices)
+        enc.sliceSizes = new_seq[nint](slices)
+    if enc.coding != H264Coding.codingPCM or enc.gopSize > 1:
+        enc.sliceRbsp = new_seq[seq[byte]](slices)
+
+def _initCoding(enc: mut@H264Encoder, width: nint, height: nint, coding: H264Coding, qp: nint,
+                gopSize: nint, skipTolerance: nint):
+    doAssert(qp >= 0 and qp <= 51, "qp is 0 to 51")
+    doAssert(gopSize >= 1, "A GOP is at least one frame")
+    enc.coding = coding
+    enc.qp = qp
+    enc.gopSize = gopSize
+    enc.skipTolerance = skipTolerance
+    if coding != H264Coding.codingPCM:
+        initialize(enc.recon, width, height)
+        enc.totalCoeffs = new_seq[uint8]((height // 16) * (width // 16) * (16 + 2 * 4))
+    if gopSize > 1:
+        initialize(enc.reference, width, height)
+
+@dispatch
+def init(_: type[H264Encoder], width: nint, height: nint, output: File,
+         slices = 1, numThreads = 0, coding = H264Coding.codingPCM, qp = 26,
+         gopSize = 1, skipTolerance = 0) -> H264Encoder:
+    ## Encoder writing an Annex B .264 stream to `output`.
+    ## Frames are split into `slices` bands of macroblock rows encoded on `numThreads` threads.
+    ## `qp` sets the quality of codingIntra16x16, about 20 (high) to 40 (low).
+    ## Every `gopSize` frames an IDR frame starts a GOP, the frames in between are P frames:
+    ## macroblocks within `skipTolerance` of their last coded samples are P_Skip.
     result = H264Encoder()
     initialize(result.frame, width, height)
+    _initCoding(result, width, height, coding, qp, gopSize, skipTolerance)
     initSPS(result, width, height)
+    initPPS(result)
+    _initSlices(result, slices, numThreads)
     result.output = output
 
-    _ = write_bytes(result.output, result.sps, 0, len(result.sps))
-    _ = write_bytes(result.output, _PPS, 0, len(_PPS))
+    result._emit(result.sps)
+    result._emit(result.pps)
+
+    return result
+
+@dispatch
+def init(_: type[H264Encoder], width: nint, height: nint,
+         slices = 1, numThreads = 0, coding = H264Coding.codingPCM, qp = 26,
+         gopSize = 1, skipTolerance = 0) -> H264Encoder:
+    ## Encoder accumulating the Annex B stream in `stream`, no file involved
+    result = H264Encoder()
+    initialize(result.frame, width, height)
+    _initCoding(result, width, height, coding, qp, gopSize, skipTolerance)
+    initSPS(result, width, height)
+    initPPS(result)
+    _initSlices(result, slices, numThreads)
+
+    result._emit(result.sps)
+    result._emit(result.pps)
 
     return result
 
 def finish(enc: mut@H264Encoder):
     dealloc_shared(enc.frame)
+    if not enc.recon.is_nil:
+        dealloc_shared(enc.recon)
+    if not enc.reference.is_nil:
+        dealloc_shared(enc.reference)
     #c_free(enc.frame)
 
 # Encoding
-def encodeMacroblock(enc: mut@H264Encoder, i: nint, j: nint):
-    if not (i == 0 and j == 0):
-        _ = write_bytes(enc.output, _MacroblockHeader, 0, len(_MacroblockHeader))
+class _SliceRows(NTuple):
+    first: nint
+    stop: nint
+
+def _sliceRows(enc: H264Encoder, sliceID: nint) -> _SliceRows:
+    ## Macroblock rows [first, stop) of slice `sliceID`
+    with let:
+        mbRows = enc.frame.lumaHeight // 16
+    return _SliceRows(first = sliceID * mbRows // enc.numSlices,
+                      stop = (sliceID + 1) * mbRows // enc.numSlices)
+
+def _bitSlice(enc: H264Encoder) -> bool:
+    """{.inline.}"""
+    ## Slices of the current frame are written bit by bit, otherwise
+    ## they are I_PCM macroblocks assembled from byte copies
+    return enc.coding != H264Coding.codingPCM or _isPFrame(enc)
+
+def maxSliceSize(enc: H264Encoder, sliceID: nint) -> nint:
+    ## Upper bound of the size in bytes of slice `sliceID`, with PCM only its header size varies.
+    ## Slices written bit by bit are bounded by I_PCM macroblocks and emulation prevention.
+    with let:
+        rows = _sliceRows(enc, sliceID)
+        macroblocks = (rows.stop - rows.first) * (enc.frame.lumaWidth // 16)
+    if _bitSlice(enc):
+        with let:
+            rbsp = _MaxSliceHeaderSize + macroblocks * _MaxCodedMacroblockSize
+        return 4 + rbsp + rbsp // 2 + 1
+    return (_MaxSliceHeaderSize + macroblocks * _MacroblockSize +
+            (macroblocks - 1) * len(_MacroblockHeader) + 1)
+
+def encodeMacroblock(enc: H264Encoder, i: nint, j: nint, dst: ptr[UncheckedArray[byte]], pos: nint,
+                     first = False) -> nint:
+    ## Write macroblock (i, j) to dst[pos], returns the position past it.
+    ## Frame rows are contiguous: each row of the macroblock is one copy.
+    ## The mb_type of the `first` macroblock of a slice is written with the slice header.
+    with var:
+        pos = pos
+    if not first:
+        copy_mem(addr(dst[pos]), unsafe_addr(_MacroblockHeader[0]), len(_MacroblockHeader))
+        pos += len(_MacroblockHeader)
 
     for x in range(i * 16, (i + 1) * 16):
-        for y in range(j * 16, (j + 1) * 16):
-            enc.output.write(char(int(luma(enc.frame, x, y))))
+        copy_mem(addr(dst[pos]), addr(luma(enc.frame, x, j * 16)), 16)
+        pos += 16
 
     for x in range(i * 8, (i + 1) * 8):
-        for y in range(j * 8, (j + 1) * 8):
-            enc.output.write(char(int(chromaB(enc.frame, x, y))))
+        copy_mem(addr(dst[pos]), addr(chromaB(enc.frame, x, j * 8)), 8)
+        pos += 8
 
+    for x in range(i * 8, (i + 1) * 8):
+        copy_mem(addr(dst[pos]), addr(chromaR(enc.frame, x, j * 8)), 8)
+        pos += 8
+    return pos
+
+# Intra 16x16 coding
+# ------------------------------------------------------
+# With codingIntra16x16 each macroblock is predicted from the decoded pixels
+# of its left and top neighbours (vertical, horizontal or DC, the mode with the
+# lowest SAD), the residual goes through the 4x4 integer transform of the standard,
+# with a Hadamard transform of the DC coefficients, and the dead-zone
+# quantized levels are CAVLC coded. The encoder decodes each macroblock into
+# `recon` as a decoder would, the deblocking filter is disabled so `recon`
+# is exactly the decoded picture. Neighbours in other slices are unavailable:
+# slices stay independent and are still encoded concurrently.
+# A macroblock costing more than its PCM samples is sent as I_PCM.
+
+class _Vlc(Object):
+    code: uint32
+    size: nint
+
+def _vlcTable(codes: openArray[string]) -> seq[_Vlc]:
+    ## Codewords as written in the standard, "" where there is none
+    result = new_seq[_Vlc](len(codes))
+    for i in range(len(codes)):
+        result[i].size = len(codes[i])
+        for bit in codes[i]:
+            result[i].code = (result[i].code << 1) | (uint32(1) if bit == '1' else uint32(0))
+    return result
+
+with const:
+    # coeff_token, 0 <= nC < 2, index TotalCoeff * 4 + TrailingOnes
+    _CoeffToken0 = _vlcTable([
+        "1", "", "", "",
+        "000101", "01", "", "",
+        "00000111", "000100", "001", "",
+        "000000111", "00000110", "0000101", "00011",
+        "0000000111", "000000110", "00000101", "000011",
+        "00000000111", "0000000110", "000000101", "0000100",
+        "0000000001111", "00000000110", "0000000101", "00000100",
+        "0000000001011", "0000000001110", "00000000101", "000000100",
+        "0000000001000", "0000000001010", "0000000001101", "0000000100",
+        "00000000001111", "00000000001110", "0000000001001", "00000000100",
+        "00000000001011", "00000000001010", "00000000001101", "0000000001100",
+        "000000000001111", "000000000001110", "00000000001001", "00000000001100",
+        "000000000001011", "000000000001010", "000000000001101", "00000000001000",
+        "0000000000001111", "000000000000001", "000000000001001", "000000000001100",
+        "0000000000001011", "0000000000001110", "0000000000001101", "000000000001000",
+        "0000000000000111", "0000000000001010", "0000000000001001", "0000000000001100",
+        "0000000000000100", "0000000000000110", "0000000000000101", "0000000000001000"])
+    # coeff_token, 2 <= nC < 4
+    _CoeffToken2 = _vlcTable([
+        "11", "", "", "",
+        "001011", "10", "", "",
+        "000111", "00111", "011", "",
+        "0000111", "001010", "001001", "0101",
+        "00000111", "000110", "000101", "0100",
+        "00000100", "0000110", "0000101", "00110",
+        "000000111", "00000110", "00000101", "001000",
+        "00000001111", "000000110", "000000101", "000100",
+        "00000001011", "00000001110", "00000001101", "0000100",
+        "000000001111", "00000001010", "00000001001", "000000100",
+        "000000001011", "000000001110", "000000001101", "00000001100",
+        "000000001000", "000000001010", "000000001001", "00000001000",
+        "0000000001111", "0000000001110", "0000000001101", "000000001100",
+        "0000000001011", "0000000001010", "0000000001001", "0000000001100",
+        "0000000000111", "00000000001011", "0000000000110", "0000000001000",
+        "00000000001001", "00000000001000", "00000000001010", "0000000000001",
+        "00000000000111", "00000000000110", "00000000000101", "00000000000100"])
+    # coeff_token, 4 <= nC < 8
+    _CoeffToken4 = _vlcTable([
+        "1111", "", "", "",
+        "001111", "1110", "", "",
+        "001011", "01111", "1101", "",
+        "001000", "01100", "01110", "1100",
+        "0001111", "01010", "01011", "1011",
+        "0001011", "01000", "01001", "1010",
+        "0001001", "001110", "001101", "1001",
+        "0001000", "001010", "001001", "1000",
+        "00001111", "0001110", "0001101", "01101",
+        "00001011", "00001110", "0001010", "001100",
+        "000001111", "00001010", "00001101", "0001100",
+        "000001011", "000001110", "00001001", "00001100",
+        "000001000", "000001010", "000001101", "00001000",
+        "0000001101", "000000111", "000001001", "000001100",
+        "0000001001", "0000001100", "0000001011", "0000001010",
+        "0000000101", "0000001000", "0000000111", "0000000110",
+        "0000000001", "0000000100", "0000000011", "0000000010"])
+    # coeff_token, nC = -1
+    _CoeffTokenChromaDC = _vlcTable([
+        "01", "", "", "",
+        "000111", "1", "", "",
+        "000100", "000110", "001", "",
+        "000011", "0000011", "0000010", "000101",
+        "000010", "00000011", "00000010", "0000000"])
+    # total_zeros of 4x4 blocks, index (TotalCoeff - 1) * 16 + total_zeros
+    _TotalZeros = _vlcTable([
+        "1", "011", "010", "0011", "0010", "00011", "00010", "000011",
+        "000010", "0000011", "0000010", "00000011", "00000010", "000000011", "000000010", "000000001",
+        "111", "110", "101", "100", "011", "0101", "0100", "0011",
+        "0010", "00011", "00010", "000011", "000010", "000001", "000000", "",
+        "0101", "111", "110", "101", "0100", "0011", "100", "011",
+        "0010", "00011", "00010", "000001", "00001", "000000", "", "",
+        "00011", "111", "0101", "0100", "110", "101", "100", "0011",
+        "011", "0010", "00010", "00001", "00000", "", "", "",
+        "0101", "0100", "0011", "111", "110", "101", "100", "011",
+        "0010", "00001", "0001", "00000", "", "", "", "",
+        "000001", "00001", "111", "110", "101", "100", "011", "010",
+        "0001", "001", "000000", "", "", "", "", "",
+        "000001", "00001", "101", "100", "011", "11", "010", "0001",
+        "001", "000000", "", "", "", "", "", "",
+        "000001", "0001", "00001", "011", "11", "10", "010", "001",
+        "000000", "", "", "", "", "", "", "",
+        "000001", "000000", "0001", "11", "10", "001", "01", "00001",
+        "", "", "", "", "", "", "", "",
+        "00001", "00000", "001", "11", "10", "01", "0001", "",
+        "", "", "", "", "", "", "", "",
+        "0000", "0001", "001", "010", "1", "011", "", "",
+        "", "", "", "", "", "", "", "",
+        "0000", "0001", "01", "1", "001", "", "", "",
+        "", "", "", "", "", "", "", "",
+        "000", "001", "1", "01", "", "", "", "",
+        "", "", "", "", "", "", "", "",
+        "00", "01", "1", "", "", "", "", "",
+        "", "", "", "", "", "", "", "",
+        "0", "1", "", "", "", "", "", "",
+        "", "", "", "", "", "", "", ""])
+    # total_zeros of the chroma DC, index (TotalCoeff - 1) * 4 + total_zeros
+    _TotalZerosChromaDC = _vlcTable([
+        "1", "01", "001", "000",
+        "1", "01", "00", "",
+        "1", "0", "", ""])
+    # run_before, index (min(zerosLeft, 7) - 1) * 15 + run_before
+    _RunBefore = _vlcTable([
+        "1", "0", "", "", "", "", "", "", "", "", "", "", "", "", "",
+        "1", "01", "00", "", "", "", "", "", "", "", "", "", "", "", "",
+        "11", "10", "01", "00", "", "", "", "", "", "", "", "", "", "", "",
+        "11", "10", "01", "001", "000", "", "", "", "", "", "", "", "", "", "",
+        "11", "10", "011", "010", "001", "000", "", "", "", "", "", "", "", "", "",
+        "11", "000", "001", "011", "010", "101", "100", "", "", "", "", "", "", "", "",
+        "111", "110", "101", "100", "011", "010", "001", "0001", "00001", "000001", "0000001", "00000001", "000000001", "0000000001", "00000000001"])
+
+    _Zigzag = [0, 1, 4, 8, 5, 2, 3, 6, 9, 12, 13, 10, 7, 11, 14, 15] # Scan order, raster positions
+    _CoefficientClass = [0, 2, 0, 2, 2, 1, 2, 1, 0, 2, 0, 2, 2, 1, 2, 1] # Position in the scaling tables
+    _QuantScale = [
+        [13107, 5243, 8066], [11916, 4660, 7490], [10082, 4194, 6554],
+        [9362, 3647, 5825], [8192, 3355, 5243], [7282, 2893, 4559]]
+    _DequantScale = [
+        [10, 16, 13], [11, 18, 14], [13, 20, 16],
+        [14, 23, 18], [16, 25, 20], [18, 29, 23]]
+    _ChromaQP = [29, 30, 31, 32, 32, 33, 34, 34, 35, 35, 36, 36, 37, 37, 37, 38, 38, 38, 39, 39, 39, 39] # QP 30 to 51
+    _MaxLevel = 2047 # Fits the escape code of level_prefix 15 at any suffixLength
+    _CodedMacroblockSlack = 4096 # A coded macroblock before its I_PCM fallback
+
+class _IntraMode(NIntEnum):
+    intraVertical = 0   # Intra16x16PredMode values
+    intraHorizontal = 1
+    intraDC = 2
+
+def _chromaPredMode(mode: _IntraMode) -> nint:
+    match mode:
+        case _IntraMode.intraDC:
+            return 0
+        case _IntraMode.intraHorizontal:
+            return 1
+        case _IntraMode.intraVertical:
+            return 2
+
+def _lumaPredMode(mode: _IntraMode) -> nint:
+    match mode:
+        case _IntraMode.intraVertical:
+            return 0
+        case _IntraMode.intraHorizontal:
+            return 1
+        case _IntraMode.intraDC:
+            return 2
+
+def _chromaQP(qp: nint) -> nint:
+    """{.inline.}"""
+    return qp if qp < 30 else _ChromaQP[qp - 30]
+
+def _putVlc(bb: mut@BitBuffer, vlc: _Vlc):
+    """{.inline.}"""
+    put(bb, vlc.size, vlc.code)
+
+def _bitPosition(bb: BitBuffer) -> nint:
+    """{.inline.}"""
+    return bb.cursor * 8 + 32 - bb.shift
+
+# Transforms, on 4x4 blocks in raster order
+def _forward4x4(blk: mut@array[16, nint]):
+    ## Core transform of the residual, rows then columns
+    for r in range(4):
+        with let:
+            s03 = blk[r * 4] + blk[r * 4 + 3]
+            d03 = blk[r * 4] - blk[r * 4 + 3]
+            s12 = blk[r * 4 + 1] + blk[r * 4 + 2]
+            d12 = blk[r * 4 + 1] - blk[r * 4 + 2]
+        blk[r * 4] = s03 + s12
+        blk[r * 4 + 1] = 2 * d03 + d12
+        blk[r * 4 + 2] = s03 - s12
+        blk[r * 4 + 3] = d03 - 2 * d12
+    for c in range(4):
+        with let:
+            s03 = blk[c] + blk[12 + c]
+            d03 = blk[c] - blk[12 + c]
+            s12 = blk[4 + c] + blk[8 + c]
+            d12 = blk[4 + c] - blk[8 + c]
+        blk[c] = s03 + s12
+        blk[4 + c] = 2 * d03 + d12
+        blk[8 + c] = s03 - s12
+        blk[12 + c] = d03 - 2 * d12
+
+def _inverse4x4(blk: mut@array[16, nint]):
+    ## Inverse transform of dequantized coefficients to the residual, rows then columns
+    for r in range(4):
+        with let:
+            e0 = blk[r * 4] + blk[r * 4 + 2]
+            e1 = blk[r * 4] - blk[r * 4 + 2]
+            e2 = (blk[r * 4 + 1] >> 1) - blk[r * 4 + 3]
+            e3 = blk[r * 4 + 1] + (blk[r * 4 + 3] >> 1)
+        blk[r * 4] = e0 + e3
+        blk[r * 4 + 1] = e1 + e2
+        blk[r * 4 + 2] = e1 - e2
+        blk[r * 4 + 3] = e0 - e3
+    for c in range(4):
+        with let:
+            e0 = blk[c] + blk[8 + c]
+            e1 = blk[c] - blk[8 + c]
+            e2 = (blk[4 + c] >> 1) - blk[12 + c]
+            e3 = blk[4 + c] + (blk[12 + c] >> 1)
+        blk[c] = (e0 + e3 + 32) >> 6
+        blk[4 + c] = (e1 + e2 + 32) >> 6
+        blk[8 + c] = (e1 - e2 + 32) >> 6
+        blk[12 + c] = (e0 - e3 + 32) >> 6
+
+def _hadamard4x4(blk: mut@array[16, nint]):
+    ## Transform of the 16 luma DC coefficients, its own inverse up to a scale
+    for r in range(4):
+        with let:
+            a = blk[r * 4]
+            b = blk[r * 4 + 1]
+            c = blk[r * 4 + 2]
+            d = blk[r * 4 + 3]
+        blk[r * 4] = a + b + c + d
+        blk[r * 4 + 1] = a + b - c - d
+        blk[r * 4 + 2] = a - b - c + d
+        blk[r * 4 + 3] = a - b + c - d
+    for col in range(4):
+        with let:
+            a = blk[col]
+            b = blk[4 + col]
+            c = blk[8 + col]
+            d = blk[12 + col]
+        blk[col] = a + b + c + d
+        blk[4 + col] = a + b - c - d
+        blk[8 + col] = a - b - c + d
+        blk[12 + col] = a - b + c - d
+
+def _hadamard2x2(dc: mut@array[4, nint]):
+    with let:
+        a = dc[0]
+        b = dc[1]
+        c = dc[2]
+        d = dc[3]
+    dc[0] = a + b + c + d
+    dc[1] = a - b + c - d
+    dc[2] = a + b - c - d
+    dc[3] = a - b - c + d
+
+def _quantize(w: nint, scale: nint, qbits: nint, deadZone: nint) -> nint:
+    """{.inline.}"""
+    with let:
+        level = min((abs(w) * scale + deadZone) >> qbits, _MaxLevel)
+    return -level if w < 0 else level
+
+# Prediction
+def _sumTop(plane: ptr[UncheckedArray[uint8]], stride: nint, row0: nint, col0: nint, n: nint) -> nint:
+    for x in range(n):
+        result += nint(plane[(row0 - 1) * stride + col0 + x])
+    return result
+
+def _sumLeft(plane: ptr[UncheckedArray[uint8]], stride: nint, row0: nint, col0: nint, n: nint) -> nint:
+    for y in range(n):
+        result += nint(plane[(row0 + y) * stride + col0 - 1])
+    return result
+
+def _predict(plane: ptr[UncheckedArray[uint8]], stride: nint, row0: nint, col0: nint, size: nint,
+             mode: _IntraMode, left: bool, top: bool, chroma: bool, pred: mut@array[256, nint]):
+    ## Prediction of the `size` x `size` block at (row0, col0) from the decoded `plane`,
+    ## `pred` has a stride of `size`. Vertical needs `top`, horizontal needs `left`.
+    match mode:
+        case _IntraMode.intraVertical:
+            for y in range(size):
+                for x in range(size):
+                    pred[y * size + x] = nint(plane[(row0 - 1) * stride + col0 + x])
+        case _IntraMode.intraHorizontal:
+            for y in range(size):
+                for x in range(size):
+                    pred[y * size + x] = nint(plane[(row0 + y) * stride + col0 - 1])
+        case _IntraMode.intraDC:
+            if not chroma:
+                with var:
+                    dc = 128
+                if top and left:
+                    dc = (_sumTop(plane, stride, row0, col0, 16) + _sumLeft(plane, stride, row0, col0, 16) + 16) >> 5
+                elif top:
+                    dc = (_sumTop(plane, stride, row0, col0, 16) + 8) >> 4
+                elif left:
+                    dc = (_sumLeft(plane, stride, row0, col0, 16) + 8) >> 4
+                for k in range(256):
+                    pred[k] = dc
+                return
+            # Chroma: one DC per 4x4 block, the top right block prefers the top
+            # neighbours and the bottom left block the left ones
+            for br in [0, 4]:
+                for bc in [0, 4]:
+                    with var:
+                        dc = 128
+                    if br == bc and top and left:
+                        dc = (_sumTop(plane, stride, row0, col0 + bc, 4) +
+                              _sumLeft(plane, stride, row0 + br, col0, 4) + 4) >> 3
+                    elif top and (bc > br or not left):
+                        dc = (_sumTop(plane, stride, row0, col0 + bc, 4) + 2) >> 2
+                    elif left:
+                        dc = (_sumLeft(plane, stride, row0 + br, col0, 4) + 2) >> 2
+                    for y in range(br, br + 4):
+                        for x in range(bc, bc + 4):
+                            pred[y * 8 + x] = dc
+
+def _sad(plane: ptr[UncheckedArray[uint8]], stride: nint, row0: nint, col0: nint, size: nint,
+         pred: array[256, nint]) -> nint:
+    for y in range(size):
+        for x in range(size):
+            result += abs(nint(plane[(row0 + y) * stride + col0 + x]) - pred[y * size + x])
+    return result
+
+# Macroblock coding
+class _Macroblock(Object):
+    lumaMode: _IntraMode
+    chromaMode: _IntraMode
+    lumaPred: array[256, nint]
+    chromaPred: array[2, array[256, nint]]
+    luma: array[16, array[16, nint]]    # AC levels of the 4x4 blocks, blocks and coefficients in raster order
+    lumaDC: array[16, nint]
+    chroma: array[2, array[4, array[16, nint]]]
+    chromaDC: array[2, array[4, nint]]
+    cbpLuma: nint       # 0 or 15: all the luma AC blocks are coded or none
+    cbpChroma: nint     # 0 none, 1 DC only, 2 DC and AC
+
+def _codeLuma(enc: H264Encoder, mb: mut@_Macroblock, i: nint, j: nint, left: bool, top: bool):
+    with let:
+        stride = nint(enc.frame.lumaWidth)
+        qp = enc.qp
+        qbits = 15 + qp // 6
+        deadZone = (1 << qbits) // 3
+    with var:
+        bestSAD = high(nint)
+        pred: array[256, nint]
+        dc: array[16, nint]
+    for mode in [_IntraMode.intraVertical, _IntraMode.intraHorizontal, _IntraMode.intraDC]:
+        if (mode == _IntraMode.intraVertical and not top) or (mode == _IntraMode.intraHorizontal and not left):
+            continue
+        _predict(enc.recon.Y, stride, i * 16, j * 16, 16, mode, left, top, False, pred)
+        with let:
+            sad = _sad(enc.frame.Y, stride, i * 16, j * 16, 16, pred)
+        if sad < bestSAD:
+            bestSAD = sad
+            mb.lumaMode = mode
+            mb.lumaPred = pred
+
+    for b in range(16):
+        with let:
+            br = (b >> 2) * 4
+            bc = (b & 3) * 4
+        for y in range(4):
+            for x in range(4):
+                mb.luma[b][y * 4 + x] = (nint(luma(enc.frame, i * 16 + br + y, j * 16 + bc + x)) -
+                                         mb.lumaPred[(br + y) * 16 + bc + x])
+        _forward4x4(mb.luma[b])
+        dc[b] = mb.luma[b][0]
+        mb.luma[b][0] = 0
+        for k in range(1, 16):
+            mb.luma[b][k] = _quantize(mb.luma[b][k], _QuantScale[qp % 6][_CoefficientClass[k]], qbits, deadZone)
+            if mb.luma[b][k] != 0:
+                mb.cbpLuma = 15
+
+    _hadamard4x4(dc)
+    for k in range(16):
+        mb.lumaDC[k] = _quantize(dc[k] >> 1, _QuantScale[qp % 6][0], qbits + 1, 2 * deadZone)
+
+def _codeChroma(enc: H264Encoder, mb: mut@_Macroblock, i: nint, j: nint, left: bool, top: bool):
+    ## Both chroma components share the prediction mode
+    with let:
+        stride = nint(enc.frame.lumaWidth >> 1)
+        qp = _chromaQP(enc.qp)
+        qbits = 15 + qp // 6
+        deadZone = (1 << qbits) // 3
+    with var:
+        bestSAD = high(nint)
+        pred: array[2, array[256, nint]]
+    for mode in [_IntraMode.intraDC, _IntraMode.intraHorizontal, _IntraMode.intraVertical]:
+        if (mode == _IntraMode.intraVertical and not top) or (mode == _IntraMode.intraHorizontal and not left):
+            continue
+        _predict(enc.recon.Cb, stride, i * 8, j * 8, 8, mode, left, top, True, pred[0])
+        _predict(enc.recon.Cr, stride, i * 8, j * 8, 8, mode, left, top, True, pred[1])
+        with let:
+            sad = (_sad(enc.frame.Cb, stride, i * 8, j * 8, 8, pred[0]) +
+                   _sad(enc.frame.Cr, stride, i * 8, j * 8, 8, pred[1]))
+        if sad < bestSAD:
+            bestSAD = sad
+            mb.chromaMode = mode
+            mb.chromaPred = pred
+
+    for c in range(2):
+        with let:
+            plane = enc.frame.Cb if c == 0 else enc.frame.Cr
+        with var:
+            dc: array[4, nint]
+        for b in range(4):
+            with let:
+                br = (b >> 1) * 4
+                bc = (b & 1) * 4
+            for y in range(4):
+                for x in range(4):
+                    mb.chroma[c][b][y * 4 + x] = (nint(plane[(i * 8 + br + y) * stride + j * 8 + bc + x]) -
+                                                  mb.chromaPred[c][(br + y) * 8 + bc + x])
+            _forward4x4(mb.chroma[c][b])
+            dc[b] = mb.chroma[c][b][0]
+            mb.chroma[c][b][0] = 0
+            for k in range(1, 16):
+                mb.chroma[c][b][k] = _quantize(mb.chroma[c][b][k], _QuantScale[qp % 6][_CoefficientClass[k]],
+                                               qbits, deadZone)
+                if mb.chroma[c][b][k] != 0:
+                    mb.cbpChroma = 2
+
+        _hadamard2x2(dc)
+        for k in range(4):
+            mb.chromaDC[c][k] = _quantize(dc[k], _QuantScale[qp % 6][0], qbits + 1, 2 * deadZone)
+            if mb.chromaDC[c][k] != 0 and mb.cbpChroma == 0:
+                mb.cbpChroma = 1
+
+def _reconstruct(enc: mut@H264Encoder, mb: _Macroblock, i: nint, j: nint):
+    ## Decode the levels of the macroblock into `recon`, as a decoder does
+    with let:
+        stride = nint(enc.frame.lumaWidth)
+        qp = enc.qp
+        qpc = _chromaQP(enc.qp)
+    with var:
+        dc = mb.lumaDC
+        blk: array[16, nint]
+    _hadamard4x4(dc)
+    for b in range(16):
+        with let:
+            br = (b >> 2) * 4
+            bc = (b & 3) * 4
+        if qp >= 36:
+            blk[0] = (dc[b] * 16 * _DequantScale[qp % 6][0]) << (qp // 6 - 6)
+        else:
+            blk[0] = (dc[b] * 16 * _DequantScale[qp % 6][0] + (1 << (5 - qp // 6))) >> (6 - qp // 6)
+        for k in range(1, 16):
+            blk[k] = (mb.luma[b][k] * _DequantScale[qp % 6][_CoefficientClass[k]]) << (qp // 6)
+        _inverse4x4(blk)
+        for y in range(4):
+            for x in range(4):
+                enc.recon.Y[(i * 16 + br + y) * stride + j * 16 + bc + x] = uint8(
+                    clamp(mb.lumaPred[(br + y) * 16 + bc + x] + blk[y * 4 + x], 0, 255))
+
+    for c in range(2):
+        with let:
+            plane = enc.recon.Cb if c == 0 else enc.recon.Cr
+        with var:
+            chromaDC = mb.chromaDC[c]
+        _hadamard2x2(chromaDC)
+        for b in range(4):
+            with let:
+                br = (b >> 1) * 4
+                bc = (b & 1) * 4
+            blk[0] = ((chromaDC[b] * 16 * _DequantScale[qpc % 6][0]) << (qpc // 6)) >> 5
+            for k in range(1, 16):
+                blk[k] = (mb.chroma[c][b][k] * _DequantScale[qpc % 6][_CoefficientClass[k]]) << (qpc // 6)
+            _inverse4x4(blk)
+            for y in range(4):
+                for x in range(4):
+                    plane[(i * 8 + br + y) * (stride >> 1) + j * 8 + bc + x] = uint8(
+                        clamp(mb.chromaPred[c][(br + y) * 8 + bc + x] + blk[y * 4 + x], 0, 255))
+
+# CAVLC
+def _nC(totals: seq[uint8], base: nint, width: nint, row: nint, col: nint, firstRow: nint) -> nint:
+    ## Expected number of coefficients of the 4x4 block (row, col) of the grid at `base`
+    ## from its left and top neighbours, blocks above `firstRow` are in another slice
+    with let:
+        left = col > 0
+        top = row > firstRow
+    if left and top:
+        return (nint(totals[base + row * width + col - 1]) + nint(totals[base + (row - 1) * width + col]) + 1) >> 1
+    if left:
+        return nint(totals[base + row * width + col - 1])
+    if top:
+        return nint(totals[base + (row - 1) * width + col])
+    return 0
+
+def _putResidualBlock(bb: mut@BitBuffer, coeffs: array[16, nint], maxNumCoeff: nint, nC: nint) -> nint:
+    ## CAVLC of the first `maxNumCoeff` levels of `coeffs` in scan order, nC is -1 for the chroma DC.
+    ## Returns TotalCoeff.
+    with var:
+        levels: array[16, nint]     # Non-zero levels from the highest frequency
+        positions: array[16, nint]
+        total = 0
+        trailingOnes = 0
+    for n in range(maxNumCoeff):
+        with let:
+            k = maxNumCoeff - 1 - n
+        if coeffs[k] != 0:
+            levels[total] = coeffs[k]
+            positions[total] = k
+            total += 1
+    while trailingOnes < total and trailingOnes < 3 and abs(levels[trailingOnes]) == 1:
+        trailingOnes += 1
+
+    with let:
+        token = total * 4 + trailingOnes
+    if nC == -1:
+        _putVlc(bb, _CoeffTokenChromaDC[token])
+    elif nC < 2:
+        _putVlc(bb, _CoeffToken0[token])
+    elif nC < 4:
+        _putVlc(bb, _CoeffToken2[token])
+    elif nC < 8:
+        _putVlc(bb, _CoeffToken4[token])
+    else:
+        put(bb, 6, uint32(3) if total == 0 else uint32(((total - 1) << 2) | trailingOnes))
+    if total == 0:
+        return 0
+
+    for t in range(trailingOnes):
+        put(bb, 1, uint32(levels[t] < 0))   # trailing_ones_sign_flag
+    with var:
+        suffixLength = 1 if total > 10 and trailingOnes < 3 else 0
+    for t in range(trailingOnes, total):
+        with let:
+            level = levels[t]
+        with var:
+            code = 2 * level - 2 if level > 0 else -2 * level - 1
+        if t == trailingOnes and trailingOnes < 3:
+            code -= 2   # The first level after less than 3 trailing ones is not +-1
+        # level_prefix as leading zeros, level_suffix
+        if suffixLength == 0:
+            if code < 14:
+                put(bb, code + 1, uint32(1))
+            elif code < 30:
+                put(bb, 15, uint32(1))
+                put(bb, 4, uint32(code - 14))
+            else:
+                put(bb, 16, uint32(1))
+                put(bb, 12, uint32(code - 30))
+        elif code < (15 << suffixLength):
+            put(bb, (code >> suffixLength) + 1, uint32(1))
+            put(bb, suffixLength, uint32(code & ((1 << suffixLength) - 1)))
+        else:
+            put(bb, 16, uint32(1))
+            put(bb, 12, uint32(code - (15 << suffixLength)))
+        if suffixLength == 0:
+            suffixLength = 1
+        if abs(level) > (3 << (suffixLength - 1)) and suffixLength < 6:
+            suffixLength += 1
+
+    with let:
+        totalZeros = positions[0] + 1 - total
+    if total < maxNumCoeff:
+        if maxNumCoeff == 4:
+            _putVlc(bb, _TotalZerosChromaDC[(total - 1) * 4 + totalZeros])
+        else:
+            _putVlc(bb, _TotalZeros[(total - 1) * 16 + totalZeros])
+    with var:
+        zerosLeft = totalZeros
+    for t in range(total - 1):
+        if zerosLeft == 0:
+            break
+        with let:
+            run = positions[t] - positions[t + 1] - 1
+        _putVlc(bb, _RunBefore[(min(zerosLeft, 7) - 1) * 15 + run])
+        zerosLeft -= run
+    return total
+
+@template_expand
+def _putMacroblock(bb: mut@BitBuffer, enc: mut@H264Encoder, mb: _Macroblock, i: nint, j: nint, firstRow: nint):
+    ## Write the macroblock and record the TotalCoeff of its blocks.
+    ## 4x4 luma blocks are coded in the order of the 8x8 quadrants.
+    with let:
+        mbWidth = enc.frame.lumaWidth // 16
+        lumaWidth = mbWidth * 4
+        chromaWidth = mbWidth * 2
+        chromaBase = (enc.frame.lumaHeight // 16) * mbWidth * 16
+        chromaSize = (enc.frame.lumaHeight // 16) * mbWidth * 4
+    with var:
+        scan: array[16, nint]
+
+    UE(_intraMbTypeOffset(enc) + 1 + _lumaPredMode(mb.lumaMode) + 4 * mb.cbpChroma +
+       (12 if mb.cbpLuma == 15 else 0)) # mb_type: I_16x16
+    UE(_chromaPredMode(mb.chromaMode)) # intra_chroma_pred_mode
+    SE(0)            # mb_qp_delta
+
+    for k in range(16):
+        scan[k] = mb.lumaDC[_Zigzag[k]]
+    _ = _putResidualBlock(bb, scan, 16, _nC(enc.totalCoeffs, 0, lumaWidth, i * 4, j * 4, firstRow * 4))
+    for blkIdx in range(16):
+        with let:
+            row = i * 4 + (blkIdx >> 3) * 2 + ((blkIdx & 3) >> 1)
+            col = j * 4 + ((blkIdx >> 2) & 1) * 2 + (blkIdx & 1)
+        with var:
+            total = 0
+        if mb.cbpLuma == 15:
+            with let:
+                b = (row - i * 4) * 4 + col - j * 4
+            for k in range(15):
+                scan[k] = mb.luma[b][_Zigzag[k + 1]]
+            total = _putResidualBlock(bb, scan, 15, _nC(enc.totalCoeffs, 0, lumaWidth, row, col, firstRow * 4))
+        enc.totalCoeffs[row * lumaWidth + col] = uint8(total)
+
+    if mb.cbpChroma > 0:
+        for c in range(2):
+            for k in range(4):
+                scan[k] = mb.chromaDC[c][k]
+            _ = _putResidualBlock(bb, scan, 4, -1)
+    for c in range(2):
+        with let:
+            base = chromaBase + c * chromaSize
+        for b in range(4):
+            with let:
+                row = i * 2 + (b >> 1)
+                col = j * 2 + (b & 1)
+            with var:
+                total = 0
+            if mb.cbpChroma == 2:
+                for k in range(15):
+                    scan[k] = mb.chroma[c][b][_Zigzag[k + 1]]
+                total = _putResidualBlock(bb, scan, 15, _nC(enc.totalCoeffs, base, chromaWidth, row, col, firstRow * 2))
+            enc.totalCoeffs[base + row * chromaWidth + col] = uint8(total)
+
+def _setTotalCoeffs(enc: mut@H264Encoder, i: nint, j: nint, total: nint):
+    ## Same TotalCoeff for all the 4x4 blocks of macroblock (i, j), without CAVLC contexts with PCM
+    if len(enc.totalCoeffs) == 0:
+        return
+    with let:
+        mbWidth = enc.frame.lumaWidth // 16
+        chromaBase = (enc.frame.lumaHeight // 16) * mbWidth * 16
+        chromaSize = (enc.frame.lumaHeight // 16) * mbWidth * 4
+    for row in range(i * 4, (i + 1) * 4):
+        for col in range(j * 4, (j + 1) * 4):
+            enc.totalCoeffs[row * mbWidth * 4 + col] = uint8(total)
+    for c in range(2):
+        for row in range(i * 2, (i + 1) * 2):
+            for col in range(j * 2, (j + 1) * 2):
+                enc.totalCoeffs[chromaBase + c * chromaSize + row * mbWidth * 2 + col] = uint8(total)
+
+def _copyMacroblock(src: Frame, dst: Frame, i: nint, j: nint):
+    with let:
+        stride = nint(src.lumaWidth)
+    for x in range(i * 16, (i + 1) * 16):
+        copy_mem(addr(dst.Y[x * stride + j * 16]), addr(src.Y[x * stride + j * 16]), 16)
+    for x in range(i * 8, (i + 1) * 8):
+        copy_mem(addr(dst.Cb[x * (stride >> 1) + j * 8]), addr(src.Cb[x * (stride >> 1) + j * 8]), 8)
+        copy_mem(addr(dst.Cr[x * (stride >> 1) + j * 8]), addr(src.Cr[x * (stride >> 1) + j * 8]), 8)
+
+def _putPCM(bb: mut@BitBuffer, enc: mut@H264Encoder, i: nint, j: nint):
+    ## I_PCM macroblock written bit by bit, the samples are also the decoded ones
+    putGolomb(bb, uint32(_intraMbTypeOffset(enc) + 25)) # mb_type: I_PCM
+    if bb.shift % 8 != 0:
+        put(bb, bb.shift % 8, uint32(0)) # pcm_alignment_zero_bits
+    for x in range(i * 16, (i + 1) * 16):
+        for y in range(j * 16, (j + 1) * 16):
+            put(bb, 8, uint32(luma(enc.frame, x, y)))
+    for x in range(i * 8, (i + 1) * 8):
+        for y in range(j * 8, (j + 1) * 8):
+            put(bb, 8, uint32(chromaB(enc.frame, x, y)))
+    for x in range(i * 8, (i + 1) * 8):
+        for y in range(j * 8, (j + 1) * 8):
+            put(bb, 8, uint32(chromaR(enc.frame, x, y)))
+    if not enc.recon.is_nil:
+        _copyMacroblock(enc.frame, enc.recon, i, j)
+    # PCM blocks count as 16 coefficients in the CAVLC contexts
+    _setTotalCoeffs(enc, i, j, 16)
+
+def _isStatic(enc: H264Encoder, i: nint, j: nint) -> bool:
+    ## Macroblock (i, j) is within `skipTolerance` of the samples it was last coded with
+    with let:
+        stride = nint(enc.frame.lumaWidth)
+        tolerance = enc.skipTolerance
+    for x in range(i * 16, (i + 1) * 16):
+        for y in range(j * 16, (j + 1) * 16):
+            if abs(nint(enc.frame.Y[x * stride + y]) - nint(enc.reference.Y[x * stride + y])) > tolerance:
+                return False
     for x in range(i * 8, (i + 1) * 8):
         for y in range(j * 8, (j + 1) * 8):
-            enc.output.write(char(int(chromaR(enc.frame, x, y))))
+            with let:
+                k = x * (stride >> 1) + y
+            if (abs(nint(enc.frame.Cb[k]) - nint(enc.reference.Cb[k])) > tolerance or
+                abs(nint(enc.frame.Cr[k]) - nint(enc.reference.Cr[k])) > tolerance):
+                return False
+    return True
+
+def _encodeIntra16x16(enc: mut@H264Encoder, bb: mut@BitBuffer, i: nint, j: nint, firstRow: nint):
+    ## Code macroblock (i, j) of the slice starting at macroblock row `firstRow`
+    with let:
+        saved = bb
+        left = j > 0
+        top = i > firstRow
+    with var:
+        mb = _Macroblock()
+    _codeLuma(enc, mb, i, j, left, top)
+    _codeChroma(enc, mb, i, j, left, top)
+    _putMacroblock(bb, enc, mb, i, j, firstRow)
+    if _bitPosition(bb) - _bitPosition(saved) > _MacroblockSize * 8:
+        bb <<= saved
+        _putPCM(bb, enc, i, j)
+    else:
+        _reconstruct(enc, mb, i, j)
+
+def _putEscaped(dst: ptr[UncheckedArray[byte]], pos: nint, rbsp: seq[byte], size: nint) -> nint:
+    ## Copy `size` bytes of `rbsp` to dst[pos] with emulation prevention:
+    ## 0x03 after two zero bytes followed by a byte of 0 to 3. Returns the position past it.
+    with var:
+        pos = pos
+        zeros = 0
+    for k in range(size):
+        if zeros == 2 and rbsp[k] <= 3:
+            dst[pos] = byte(0x03)
+            pos += 1
+            zeros = 0
+        dst[pos] = rbsp[k]
+        pos += 1
+        zeros = zeros + 1 if rbsp[k] == 0 else 0
+    return pos
+
+def _maxRbspSize(enc: H264Encoder, sliceID: nint) -> nint:
+    ## Slice written bit by bit before emulation prevention: a macroblock is at most
+    ## its I_PCM samples once written, the last one may exceed them before falling back
+    with let:
+        rows = _sliceRows(enc, sliceID)
+        macroblocks = (rows.stop - rows.first) * (enc.frame.lumaWidth // 16)
+    return _MaxSliceHeaderSize + macroblocks * _MaxCodedMacroblockSize + _CodedMacroblockSlack
+
+def _encodeBitSlice(enc: mut@H264Encoder, sliceID: nint, dst: ptr[UncheckedArray[byte]]) -> nint:
+    ## Slice of intra 16x16 macroblocks, or P slice. In a P slice static macroblocks
+    ## are P_Skip: all the motion vectors are zero, P_Skip copies the reference frame.
+    ## The others are intra coded and become the reference of their macroblock.
+    ## `sliceRbsp[sliceID]` holds at least `_maxRbspSize(enc, sliceID)` bytes
+    with let:
+        rows = _sliceRows(enc, sliceID)
+        mbWidth = enc.frame.lumaWidth // 16
+    with var:
+        bb = BitBuffer(
+            shift=32,
+            cache=0,
+            buf=cast[ptr[UncheckedArray[byte]]](addr(enc.sliceRbsp[sliceID][0])),
+            cursor=0
+        )
+        skipRun = 0
+    _putSliceHeader(bb, enc, rows.first * mbWidth)
+    for i in range(rows.first, rows.stop):
+        for j in range(mbWidth):
+            if _isPFrame(enc):
+                if _isStatic(enc, i, j):
+                    skipRun += 1
+                    _setTotalCoeffs(enc, i, j, 0)
+                    continue
+                putGolomb(bb, uint32(skipRun)) # mb_skip_run
+                skipRun = 0
+                _copyMacroblock(enc.frame, enc.reference, i, j)
+            if enc.coding == H264Coding.codingPCM:
+                _putPCM(bb, enc, i, j)
+            else:
+                _encodeIntra16x16(enc, bb, i, j, rows.first)
+    if skipRun > 0:
+        putGolomb(bb, uint32(skipRun)) # mb_skip_run up to the end of the slice
+    put(bb, 1, uint32(1))   # rbsp_stop_one_bit
+    if bb.shift % 8 != 0:
+        put(bb, bb.shift % 8, uint32(0))
+    flush(bb)
+
+    dst[0] = byte(0x00); dst[1] = byte(0x00); dst[2] = byte(0x00); dst[3] = byte(0x01)
+    return _putEscaped(dst, 4, enc.sliceRbsp[sliceID], bb.cursor - (bb.shift // 8))
+
+def encodeSlice(enc: mut@H264Encoder, sliceID: nint, dst: ptr[UncheckedArray[byte]]) -> nint:
+    ## Write slice `sliceID` as a NAL unit with its start code to dst, returns its size.
+    ## `dst` holds at least `maxSliceSize(enc, sliceID)` bytes.
+    if _bitSlice(enc):
+        return _encodeBitSlice(enc, sliceID, dst)
+    with let:
+        rows = _sliceRows(enc, sliceID)
+        mbWidth = enc.frame.lumaWidth // 16
+    with var:
+        pos = _writeSliceHeader(enc, dst, rows.first * mbWidth)
+    for i in range(rows.first, rows.stop):
+        for j in range(mbWidth):
+            pos = encodeMacroblock(enc, i, j, dst, pos, first = (i == rows.first and j == 0))
+    dst[pos] = _SliceStopBit
+    return pos + 1
+
+# Slices are independent: the threads only read the frame
+# and each writes its own buffer.
+class _SliceJob(Object):
+    enc: ptr[H264Encoder]
+    nextSlice: Atomic[int32]
+
+def _sliceWorker(job: ptr[_SliceJob]):
+    """{.thread.}"""
+    while True:
+        with let:
+            sliceID = nint(fetchAdd(job.nextSlice, 1, moRelaxed))
+        if sliceID >= job.enc.numSlices:
+            return
+        job.enc.sliceSizes[sliceID] = encodeSlice(
+            job.enc.contents, sliceID,
+            cast[ptr[UncheckedArray[byte]]](addr(job.enc.sliceBuffers[sliceID][0]))
+        )
+
+def _encodeSlices(enc: mut@H264Encoder):
+    ## Encode every slice into `sliceBuffers`, sized before the threads start
+    with let:
+        numWorkers = min(enc.numSlices, countProcessors() if enc.numThreads <= 0 else enc.numThreads)
+    for sliceID in range(enc.numSlices):
+        enc.sliceBuffers[sliceID].set_len(maxSliceSize(enc, sliceID))
+        if _bitSlice(enc):
+            enc.sliceRbsp[sliceID].set_len(_maxRbspSize(enc, sliceID))
+    with var:
+        job = _SliceJob(enc = addr(enc))
+        threads = new_seq[Thread[ptr[_SliceJob]]](numWorkers)
+
+    # The calling thread works as worker 0
+    for i in range(1, numWorkers):
+        createThread(threads[i], _sliceWorker, addr(job))
+    _sliceWorker(addr(job))
+    for i in range(1, numWorkers):
+        joinThread(threads[i])
 
 # API
 class _FrameBuffers(NTuple):
@@ -225,6 +1287,10 @@ class _FrameBuffers(NTuple):
 def getFrameBuffers(enc: mut@H264Encoder) -> _FrameBuffers:
     return (enc.frame.Y, enc.frame.Cb, enc.frame.Cr)
 
+def getReconstructedBuffers(enc: mut@H264Encoder) -> _FrameBuffers:
+    ## Decoded picture of the last frame with codingIntra16x16, as a decoder outputs it
+    return (enc.recon.Y, enc.recon.Cb, enc.recon.Cr)
+
 def getFrameBuffer(enc: mut@H264Encoder) -> ptr[UncheckedArray[uint8]]:
     return addr(enc.frame.buffer)
 
@@ -237,15 +1303,51 @@ def getWidth(enc: mut@H264Encoder) -> int32:
 def getHeight(enc: mut@H264Encoder) -> int32:
     return enc.frame.lumaHeight
 
-def flushFrame(enc: mut@H264Encoder):
-    _ = write_bytes(enc.output, _SliceHeader, 0, len(_SliceHeader))
-
-    for i in range(enc.frame.lumaHeight // 16):
-        for j in range(enc.frame.lumaWidth // 16):
-            encodeMacroblock(enc, i, j)
-
-    enc.output.write(char(int(_SliceStopBit)))
+def clearStream(enc: mut@H264Encoder):
+    ## Drop the in-memory stream once consumed, its capacity is kept for the next frame
+    enc.stream.set_len(0)
+
+def _writeFrame(enc: mut@H264Encoder):
+    ## A single PCM slice is assembled in place: at the end of `stream` in memory,
+    ## otherwise in the reused `slice` buffer and written with a single call.
+    ## Several slices, or ones written bit by bit, are encoded concurrently into `sliceBuffers`,
+    ## then appended to `stream` or written in order. Every slice but the first
+    ## has a non-zero first_mb_in_slice: minimp4 muxes it as a continuation of the sample.
+    if enc.numSlices == 1 and not _bitSlice(enc):
+        with let:
+            bound = maxSliceSize(enc, 0)
+        if enc.output.is_nil:
+            with let: start = len(enc.stream)
+            enc.stream.set_len(start + bound)
+            enc.stream.set_len(start + encodeSlice(enc, 0, cast[ptr[UncheckedArray[byte]]](addr(enc.stream[start]))))
+        else:
+            enc.slice.set_len(bound)
+            with let:
+                size = encodeSlice(enc, 0, cast[ptr[UncheckedArray[byte]]](addr(enc.slice[0])))
+            _ = write_bytes(enc.output, enc.slice, 0, size)
+        return
+
+    _encodeSlices(enc)
+    if enc.output.is_nil:
+        with var:
+            pos = len(enc.stream)
+            total = pos
+        for size in enc.sliceSizes:
+            total += size
+        enc.stream.set_len(total)
+        for sliceID in range(enc.numSlices):
+            copy_mem(addr(enc.stream[pos]), addr(enc.sliceBuffers[sliceID][0]), enc.sliceSizes[sliceID])
+            pos += enc.sliceSizes[sliceID]
+    else:
+        for sliceID in range(enc.numSlices):
+            _ = write_bytes(enc.output, enc.sliceBuffers[sliceID], 0, enc.sliceSizes[sliceID])
 
+def flushFrame(enc: mut@H264Encoder):
+    ## Encode the current frame: an IDR frame every `gopSize` frames, P frames in between
+    _writeFrame(enc)
+    if not enc.reference.is_nil and not _isPFrame(enc):
+        copy_mem(addr(enc.reference.buffer), addr(enc.frame.buffer), enc.frame.size)
+    enc.gopIndex = (enc.gopIndex + 1) % enc.gopSize
 
 
 # Trace of Radiance
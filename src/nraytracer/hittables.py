@@ -12,10 +12,12 @@ from hittables_lists import *
 from hittables_variants import *
 from spheres import *
 from moving_spheres import *
+from bvhs import *
+from spheres_soa import *
 
-import hittables_lists, hittables_variants, spheres, moving_spheres
+import hittables_lists, hittables_variants, spheres, moving_spheres, bvhs, spheres_soa
 with export:
-  hittables_lists, hittables_variants, spheres, moving_spheres
+  hittables_lists, hittables_variants, spheres, moving_spheres, bvhs, spheres_soa
 
 # Trace of Radiance
 # Copyright (c) 2020 Mamy André-Ratsimbazafy
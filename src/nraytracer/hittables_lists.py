@@ -9,31 +9,41 @@ from __future__ import annotations
 from nimic.ntypes import *
 
 from hittables_variants import HittableVariant, toVariant
-from core import HitRecord
-from primitives import Ray
+from core import HitRecord, Material, MaterialTable
+from primitives import Ray, CTime
+from bvhs import BVH, BVHBuildMode, buildBVH
+from spheres_soa import SphereSoA, buildSphereSoA
 
 class HittableList(Object):
     ## TODO openarray as value
     ## ⚠: lifetime
     len: nint
     objects: ptr[UncheckedArray[HittableVariant]]
+    materials: ptr[UncheckedArray[Material]]
 
     def hit(self: HittableList, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
         """{.inline, noSideEffect.}"""
-        result = False
-        with var: closest_so_far = t_max
+        ## Finds the nearest t and object first,
+        ## the hit record is only built for that object.
+        with var:
+            closest_so_far = t_max
+            closest = -1
+            t = 0.0
 
         for i in range(self.len):
-            with let: hit = self.objects[i].hit(r, t_min, closest_so_far, rec)
-            if hit:
-                closest_so_far = rec.t
-                result = True
-        return result
+            if self.objects[i].intersect(r, t_min, closest_so_far, t):
+                closest_so_far = t
+                closest = i
+        if closest < 0:
+            return False
+        self.objects[closest].setHitRecord(r, closest_so_far, rec)
+        return True
 
 class Scene(Object):
     ## A list of hittable objects.
     ## ⚠ not thread-safe
     objects: seq[HittableVariant]
+    materials: MaterialTable
 
     # Mutable routines
     # ---------------------------------------------------------
@@ -47,9 +57,16 @@ class Scene(Object):
         """{.inline, noSideEffect.}"""
         self.objects.add(toVariant(h))
 
+    def addMaterial[T](self: mut @ Scene, m: T) -> uint16:
+        """{.inline, noSideEffect.}"""
+        ## Returns the material id to give to the objects using `m`.
+        ## Identical materials share the same id.
+        return self.materials.add(m)
+
     def clear(self: mut @ Scene):
         """{.inline, noSideEffect.}"""
         self.objects.set_len(0)
+        self.materials.clear()
 
     # Immutable routines
     # ---------------------------------------------------------
@@ -62,8 +79,26 @@ class Scene(Object):
         result.objects = cast[ptr[UncheckedArray[HittableVariant]]](
         unsafe_addr(scene.objects[0])
         )
+        result.materials = cast[ptr[UncheckedArray[Material]]](
+        unsafe_addr(scene.materials.entries[0])
+        )
         return result
 
+    def bvh(scene: Scene, time0 = CTime(0.0), time1 = CTime(1.0),
+            mode = BVHBuildMode.bvhSAH) -> BVH:
+        ## Build a bounding volume hierarchy over the scene.
+        ## The BVH owns a copy of the objects and materials, it is not updated
+        ## by later changes to the scene.
+        ## [time0, time1] must cover the camera shutter interval.
+        ## `bvhMedian` builds faster, `bvhSAH` traverses faster.
+        return buildBVH(scene.objects, scene.materials.entries, time0, time1, mode)
+
+    def soa(scene: Scene) -> SphereSoA:
+        ## Copy the spheres of the scene in structure-of-arrays layout,
+        ## tested in batches instead of one HittableVariant at a time.
+        ## Like `bvh`, it is not updated by later changes to the scene.
+        return buildSphereSoA(scene.objects, scene.materials.entries)
+
 # Sanity checks
 # -----------------------------------------------------
 
@@ -8,7 +8,8 @@
 from __future__ import annotations
 from nimic.ntypes import *
 
-from primitives import Ray
+from primitives import Ray, CTime
+from aabbs import AABB
 from core import HitRecord
 from spheres import Sphere
 from moving_spheres import MovingSphere
@@ -35,6 +36,32 @@ class HittableVariant(Object):
                 result = self.fMovingSphere.hit(r, t_min, t_max, rec)
         return result
 
+    def intersect(self: HittableVariant, r: Ray, t_min: float64, t_max: float64, t: mut @ float64) -> bool:
+        """{.inline, noSideEffect.}"""
+        match self.kind:
+            case HittableVariantKind.kSphere:
+                result = self.fSphere.intersect(r, t_min, t_max, t)
+            case HittableVariantKind.kMovingSphere:
+                result = self.fMovingSphere.intersect(r, t_min, t_max, t)
+        return result
+
+    def setHitRecord(self: HittableVariant, r: Ray, t: float64, rec: mut @ HitRecord):
+        """{.inline, noSideEffect.}"""
+        match self.kind:
+            case HittableVariantKind.kSphere:
+                self.fSphere.setHitRecord(r, t, rec)
+            case HittableVariantKind.kMovingSphere:
+                self.fMovingSphere.setHitRecord(r, t, rec)
+
+    def bounding_box(self: HittableVariant, time0: CTime, time1: CTime) -> AABB:
+        """{.inline, noSideEffect.}"""
+        match self.kind:
+            case HittableVariantKind.kSphere:
+                result = self.fSphere.bounding_box(time0, time1)
+            case HittableVariantKind.kMovingSphere:
+                result = self.fMovingSphere.bounding_box(time0, time1)
+        return result
+
 @dispatch
 def toVariant(subtype: Sphere) -> HittableVariant:
     """{.inline, noSideEffect.}"""
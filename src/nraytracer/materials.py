@@ -13,7 +13,7 @@ from math import pow, sqrt
 # Internal
 from core import Lambertian, Metal, Dielectric, HitRecord, Material, MaterialKind
 from primitives import Attenuation, attenuation, reflect, refract, Ray, ray, Vec3, UnitVector
-from sampling import Rng, random, random_in_unit_sphere
+from sampling import Rng, QmcSampler, random, random_in_unit_sphere
 
 
 # Lambert / Diffuse Materials
@@ -26,9 +26,9 @@ def lambertian(albedo: Attenuation) -> Lambertian:
     return result
 
 @dispatch
-def _scatter(self: Lambertian, r_in: Ray,
-              rec: HitRecord, rng: mut @ Rng,
-              attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
+def _scatter[R](self: Lambertian, r_in: Ray,
+                 rec: HitRecord, rng: mut @ R,
+                 attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
     """{.noSideEffect,inline.}"""
     with let:
         scatter_direction = rec.normal + random(rng, UnitVector).toVec3()
@@ -47,9 +47,9 @@ def metal(albedo: Attenuation, fuzz: float64) -> Metal:
     return result
 
 @dispatch
-def _scatter(self: Metal, r_in: Ray,
-              rec: HitRecord, rng: mut @ Rng,
-              attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
+def _scatter[R](self: Metal, r_in: Ray,
+                 rec: HitRecord, rng: mut @ R,
+                 attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
     """{.noSideEffect.}"""
     with let:
         reflected = reflect(r_in.direction.unit_vector(), rec.normal)
@@ -78,9 +78,9 @@ def _schlick(cosine: float64, refraction_index: float64) -> float64:
     return r0 + (1-r0)*pow(1-cosine, 5)
 
 @dispatch
-def _scatter(self: Dielectric, r_in: Ray,
-              rec: HitRecord, rng: mut @ Rng,
-              _attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
+def _scatter[R](self: Dielectric, r_in: Ray,
+                 rec: HitRecord, rng: mut @ R,
+                 _attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
     """{.noSideEffect.}"""
     _attenuation <<= attenuation(1.0, 1.0, 1.0)
     with let:
@@ -110,9 +110,10 @@ def _scatter(self: Dielectric, r_in: Ray,
     scattered <<= ray(rec.p, refracted)
     return True
 
-def scatter(self: Material, r_in: Ray,
-            rec: HitRecord, rng: mut @ Rng,
-            attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
+def scatter[R](self: Material, r_in: Ray,
+               rec: HitRecord, rng: mut @ R,
+               attenuation: mut @ Attenuation, scattered: mut @ Ray) -> bool:
+    ## `rng` is an Rng or a QmcSampler
     match self.kind:
         case MaterialKind.kMetal:
             result = _scatter(self.fMetal, r_in, rec, rng, attenuation, scattered)
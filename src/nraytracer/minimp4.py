@@ -44,6 +44,28 @@ with const:
 
     _MOOV_TIMESCALE = u32(1000)
 
+# Allocation counters for benchmarks, only with -d:minimp4Stats
+if comptime(defined(minimp4Stats)):
+    with var:
+        minimp4_allocations = 0     # c_malloc and c_realloc calls
+        minimp4_scratch_grows = 0   # Growths of the scratch buffers of mp4_h26x_write_nal
+
+    def _malloc(size: csize_t) -> pointer:
+        minimp4_allocations += 1
+        return c_malloc(size)
+
+    def _realloc(p: pointer, size: csize_t) -> pointer:
+        minimp4_allocations += 1
+        return c_realloc(p, size)
+else:
+    @template
+    def _malloc(size: csize_t) -> pointer:
+        return c_malloc(size)
+
+    @template
+    def _realloc(p: pointer, size: csize_t) -> pointer:
+        return c_realloc(p, size)
+
 def _fourCC(a: char, b: char, c: char, d: char) -> uint32:
     """{.inline.}"""
     return (uint32(ord(a)) << 24) | (uint32(ord(b)) << 16) | (uint32(ord(c)) << 8) | uint32(ord(d))
@@ -93,6 +115,7 @@ with let:
     _BOX_traf = _fourCC(ch('t'),ch('r'),ch('a'),ch('f'))
     _BOX_tfhd = _fourCC(ch('t'),ch('f'),ch('h'),ch('d'))
     _BOX_trun = _fourCC(ch('t'),ch('r'),ch('u'),ch('n'))
+    _BOX_tfdt = _fourCC(ch('t'),ch('f'),ch('d'),ch('t'))
     _BOX_mehd = _fourCC(ch('m'),ch('e'),ch('h'),ch('d'))
     _BOX_meta = _fourCC(ch('m'),ch('e'),ch('t'),ch('a'))
     _BOX_ilst = _fourCC(ch('i'),ch('l'),ch('s'),ch('t'))
@@ -146,6 +169,7 @@ class _TrackT(Object):
     vsps: _MiniMp4Vector
     vpps: _MiniMp4Vector
     vvps: _MiniMp4Vector
+    fragment_dts: uint64    # Decode time of the first pending sample, with fragmentation
 
 @calltype
 def WriteCallback(offset: int64, buffer: pointer, size: csize_t, token: pointer) -> cint:
@@ -186,6 +210,8 @@ class mp4_h26x_writer_t(Object):
     need_sps: nint
     need_pps: nint
     need_idr: nint
+    nal1: _MiniMp4Vector    # Scratch buffers of mp4_h26x_write_nal, grown on demand
+    nal2: _MiniMp4Vector
 
 class _BsT(Object):
     shift: nint
@@ -201,7 +227,7 @@ def _vectorInit(h: ptr[_MiniMp4Vector], capacity: nint) -> nint:
     h.bytes = 0
     h.capacity = capacity
     if capacity > 0:
-        h.data = cast[ptr[UncheckedArray[uint8]]](c_malloc(csize_t(capacity)))
+        h.data = cast[ptr[UncheckedArray[uint8]]](_malloc(csize_t(capacity)))
         if h.data == None: return 0
     else:
         h.data = None
@@ -218,7 +244,7 @@ def _vectorGrow(h: ptr[_MiniMp4Vector], _bytes: nint) -> nint:
     if _newSize < h.capacity + _bytes:
         _newSize = h.capacity + _bytes + 1024
     with let:
-        _p = c_realloc(h.data, csize_t(_newSize))
+        _p = _realloc(h.data, csize_t(_newSize))
     if _p == None: return 0
     h.data = cast[ptr[UncheckedArray[uint8]]](_p)
     h.capacity = _newSize
@@ -423,6 +449,7 @@ with const:
     _MP4E_HANDLER_TYPE_MDIR = u32(0x6D646972)
     _FILE_HEADER_BYTES = 256
     _TRACK_HEADER_BYTES = 512
+    _FRAGMENT_HEADER_BYTES = 128
 
 @template_expand
 def _mp4eFlushIndex(mux: ptr[MP4E_mux_t]) -> nint:
@@ -443,9 +470,12 @@ def _mp4eFlushIndex(mux: ptr[MP4E_mux_t]) -> nint:
         _indexBytes += _tr.smpl.bytes * (sizeof(_SampleT) + 4 + 4) // sizeof(_SampleT)
         _indexBytes += _tr.vsps.bytes
         _indexBytes += _tr.vpps.bytes
-        _ERR(_writePendingData(mux, _tr))
+        if mux.enable_fragmentation != 0:
+            _indexBytes += 32   # trex
+        else:
+            _ERR(_writePendingData(mux, _tr))
     with let:
-        _base = cast[ptr[uint8]](c_malloc(csize_t(_indexBytes)))
+        _base = cast[ptr[uint8]](_malloc(csize_t(_indexBytes)))
     if _base == None: return MP4E_STATUS_NO_MEMORY
     with var:
         p = _base.copy()
@@ -475,7 +505,7 @@ def _mp4eFlushIndex(mux: ptr[MP4E_mux_t]) -> nint:
         with let:
             _tr0 = cast[ptr[_TrackT]](mux.tracks.data)
         with var:
-            _dur = _getDuration(_tr0)
+            _dur = _getDuration(_tr0) if mux.enable_fragmentation == 0 else uint32(0)
         _dur = uint32(uint64(_dur) * uint64(_MOOV_TIMESCALE) // uint64(_tr0.info.time_scale))
         _WRITE_4(p, _MOOV_TIMESCALE)
         _WRITE_4(p, _dur)
@@ -491,7 +521,7 @@ def _mp4eFlushIndex(mux: ptr[MP4E_mux_t]) -> nint:
     for _ntr in range(_ntracks):
         with let:
             _tr = cast[ptr[_TrackT]](cast[intp](mux.tracks.data) + _ntr * sizeof(_TrackT))
-            _duration = _getDuration(_tr)
+            _duration = _getDuration(_tr) if mux.enable_fragmentation == 0 else uint32(0)
         with var:
             _samplesCount = _tr.smpl.bytes // sizeof(_SampleT)
         with let:
@@ -724,6 +754,16 @@ def _mp4eFlushIndex(mux: ptr[MP4E_mux_t]) -> nint:
 
         _END_ATOM(p, _stack); _END_ATOM(p, _stack); _END_ATOM(p, _stack); _END_ATOM(p, _stack)
 
+    if mux.enable_fragmentation != 0:
+        # Samples and durations are in the movie fragments that follow
+        _ATOM(p, _stack, _BOX_mvex)
+        for _ntr in range(_ntracks):
+            _ATOM_FULL(p, _stack, _BOX_trex, u32(0))
+            _WRITE_4(p, uint32(_ntr + 1)); _WRITE_4(p, u32(1))
+            _WRITE_4(p, u32(0)); _WRITE_4(p, u32(0)); _WRITE_4(p, u32(0))
+            _END_ATOM(p, _stack)
+        _END_ATOM(p, _stack)
+
     if mux.text_comment != None:
         with let:
             _comment = str(mux.text_comment)
@@ -747,6 +787,71 @@ def _mp4eFlushIndex(mux: ptr[MP4E_mux_t]) -> nint:
     c_free(_base)
     return _err2
 
+# =========================================================================
+# mp4eWriteFragment — write moof + mdat of the pending samples of a track
+# =========================================================================
+
+@template_expand
+def _mp4eWriteFragment(mux: ptr[MP4E_mux_t], track_num: nint) -> nint:
+    ## The samples are dropped from the index once written:
+    ## a fragmented file keeps one GOP per track in memory at most
+    with let:
+        _tr = cast[ptr[_TrackT]](cast[intp](mux.tracks.data) + track_num * sizeof(_TrackT))
+        _samplesCount = _tr.smpl.bytes // sizeof(_SampleT)
+        _sample = cast[ptr[UncheckedArray[_SampleT]]](_tr.smpl.data)
+    if _samplesCount == 0: return MP4E_STATUS_OK
+    if mux.fragments_count == 0:
+        _ERR(_mp4eFlushIndex(mux))  # moov before the first fragment, once the SPS and PPS are known
+    mux.fragments_count += 1
+    with var:
+        _stackBase = array[8, ptr[uint8]]()
+    with var:
+        _stack = cast[ptr[ptr[uint8]]](addr(_stackBase[0]))
+    with let:
+        _base = cast[ptr[uint8]](_malloc(csize_t(_FRAGMENT_HEADER_BYTES + _samplesCount * 12)))
+    if _base == None: return MP4E_STATUS_NO_MEMORY
+    with var:
+        p = _base.copy()
+
+    _ATOM(p, _stack, _BOX_moof)
+    _ATOM_FULL(p, _stack, _BOX_mfhd, u32(0))
+    _WRITE_4(p, uint32(mux.fragments_count))
+    _END_ATOM(p, _stack)
+    _ATOM(p, _stack, _BOX_traf)
+    _ATOM_FULL(p, _stack, _BOX_tfhd, u32(0x020000))    # default-base-is-moof
+    _WRITE_4(p, uint32(track_num + 1))
+    _END_ATOM(p, _stack)
+    _ATOM_FULL(p, _stack, _BOX_tfdt, u32(0x01000000))  # version 1, 64-bit decode time
+    _WRITE_4(p, uint32(_tr.fragment_dts >> 32)); _WRITE_4(p, uint32(_tr.fragment_dts & u64(0xFFFFFFFF)))
+    _END_ATOM(p, _stack)
+    _ATOM_FULL(p, _stack, _BOX_trun, u32(0x000701))    # data offset, sample duration, size and flags
+    _WRITE_4(p, uint32(_samplesCount))
+    with let:
+        _pdataOffset = cast[ptr[uint8]](p)
+    _WRITE_4(p, u32(0))
+    for _i in range(_samplesCount):
+        _WRITE_4(p, _sample[_i].duration)
+        _WRITE_4(p, uint32(_sample[_i].size))
+        # sample_depends_on 2 for sync samples, else 1 with sample_is_non_sync_sample
+        _WRITE_4(p, u32(0x02000000) if _sample[_i].flag_random_access != 0 else u32(0x01010000))
+        _tr.fragment_dts += uint64(_sample[_i].duration)
+    _END_ATOM(p, _stack); _END_ATOM(p, _stack); _END_ATOM(p, _stack)
+    _WR4(_pdataOffset, _ptrDiff(p, _base) + 8)    # From the moof start to the mdat payload
+    _WRITE_4(p, uint32(_tr.pending_sample.bytes + 8))
+    _WRITE_4(p, _BOX_mdat)
+
+    with let:
+        _headerBytes = _ptrDiff(p, _base)
+        _err2 = mux.write_callback(mux.write_pos, _base, csize_t(_headerBytes), mux.token)
+    c_free(_base)
+    if _err2 != 0: return _err2
+    mux.write_pos += _headerBytes
+    _ERR(mux.write_callback(mux.write_pos, _tr.pending_sample.data, csize_t(_tr.pending_sample.bytes), mux.token))
+    mux.write_pos += _tr.pending_sample.bytes
+    _tr.pending_sample.bytes = 0
+    _tr.smpl.bytes = 0
+    return MP4E_STATUS_OK
+
 # =========================================================================
 # MP4E API
 # =========================================================================
@@ -757,7 +862,7 @@ def MP4E_open(sequential_mode_flag: nint, enable_fragmentation: nint,
     if write_callback(0, unsafe_addr(_box_ftyp_data[0]), csize_t(sizeof(_box_ftyp_data)), token) != 0:
         return None
     with let:
-        mux = cast[ptr[MP4E_mux_t]](c_malloc(csize_t(sizeof(MP4E_mux_t))))
+        mux = cast[ptr[MP4E_mux_t]](_malloc(csize_t(sizeof(MP4E_mux_t))))
     if mux == None: return None
     mux.sequential_mode_flag = 1 if (sequential_mode_flag != 0 or enable_fragmentation != 0) else 0
     mux.enable_fragmentation = enable_fragmentation
@@ -820,18 +925,17 @@ def MP4E_put_sample(mux: ptr[MP4E_mux_t], track_num: nint, data: pointer,
     if mux == None or data == None: return MP4E_STATUS_BAD_ARGUMENTS
     with let:
         _tr = cast[ptr[_TrackT]](cast[intp](mux.tracks.data) + track_num * sizeof(_TrackT))
-    if mux.enable_fragmentation != 0:
-        if mux.fragments_count == 0:
-            _ERR(_mp4eFlushIndex(mux))
-        mux.fragments_count += 1
-        return MP4E_STATUS_OK
     if _kind != MP4E_SAMPLE_CONTINUATION:
-        if mux.sequential_mode_flag != 0:
+        if mux.enable_fragmentation != 0:
+            # One fragment per GOP: a random access sample closes the previous one
+            if _kind == MP4E_SAMPLE_RANDOM_ACCESS:
+                _ERR(_mp4eWriteFragment(mux, track_num))
+        elif mux.sequential_mode_flag != 0:
             _ERR(_writePendingData(mux, _tr))
         if _addSampleDescriptor(mux, _tr, data_bytes, _duration, _kind) == 0:
             return MP4E_STATUS_NO_MEMORY
     else:
-        if mux.sequential_mode_flag == 0:
+        if mux.sequential_mode_flag == 0 or mux.enable_fragmentation != 0:
             if _tr.smpl.bytes < sizeof(_SampleT):
                 return MP4E_STATUS_NO_MEMORY
             with let:
@@ -851,6 +955,14 @@ def MP4E_close(mux: ptr[MP4E_mux_t]) -> nint:
     if mux == None: return MP4E_STATUS_BAD_ARGUMENTS
     if mux.enable_fragmentation == 0:
         _err = _mp4eFlushIndex(mux)
+    else:
+        with let:
+            _ntracks = mux.tracks.bytes // sizeof(_TrackT)
+        for _ntr in range(_ntracks):
+            if _err == MP4E_STATUS_OK:
+                _err = _mp4eWriteFragment(mux, _ntr)
+        if _err == MP4E_STATUS_OK and mux.fragments_count == 0:
+            _err = _mp4eFlushIndex(mux)
     if mux.text_comment != None:
         c_free(mux.text_comment)
     with let:
@@ -964,7 +1076,7 @@ def _findMemCache(cache: mut@openArray[pointer], _cacheBytes: mut@openArray[nint
             return _i
     for _i in range(_cacheSize):
         if _cacheBytes[_i] == 0:
-            cache[_i] = c_malloc(csize_t(_bytes))
+            cache[_i] = _malloc(csize_t(_bytes))
             if cache[_i] != None:
                 copy_mem(cache[_i], mem, _bytes)
                 _cacheBytes[_i] = _bytes
@@ -1186,6 +1298,8 @@ def mp4_h26x_write_init(h: ptr[mp4_h26x_writer_t], mux: ptr[MP4E_mux_t],
     h.need_pps = 1
     h.need_idr = 1
     zero_mem(addr(h.sps_patcher), sizeof(_H264SpsIdPatcher))
+    zero_mem(addr(h.nal1), sizeof(_MiniMp4Vector))
+    zero_mem(addr(h.nal2), sizeof(_MiniMp4Vector))
     return MP4E_STATUS_OK
 
 def mp4_h26x_write_close(h: ptr[mp4_h26x_writer_t]):
@@ -1195,8 +1309,43 @@ def mp4_h26x_write_close(h: ptr[mp4_h26x_writer_t]):
         if _p.sps_cache[_i] != None: c_free(_p.sps_cache[_i])
     for _i in range(_MINIMP4_MAX_PPS):
         if _p.pps_cache[_i] != None: c_free(_p.pps_cache[_i])
+    _vectorReset(addr(h.nal1))
+    _vectorReset(addr(h.nal2))
     zero_mem(h, sizeof(mp4_h26x_writer_t))
 
+def _scratch(v: ptr[_MiniMp4Vector], _bytes: nint) -> ptr[UncheckedArray[uint8]]:
+    ## At least `_bytes` of scratch memory, kept for the next NAL units
+    if v.capacity < _bytes:
+        if _vectorGrow(v, _bytes - v.capacity) == 0:
+            return None
+        if comptime(defined(minimp4Stats)):
+            minimp4_scratch_grows += 1
+    return v.data
+
+with const:
+    _MAPPED_SLICE_HEADER_BYTES = 8 # Holds first_mb_in_slice, slice_type and pic_parameter_set_id
+
+def _isMappedSlice(h: ptr[mp4_h26x_writer_t], nal: ptr[UncheckedArray[uint8]], _sizeofNal: nint) -> bool:
+    ## Slice whose PPS id maps to itself: transcoding would give back the same bytes.
+    ## Its header must not hold emulation prevention bytes to be read in place.
+    with let:
+        _payloadType = nint(nal[0]) & 31
+    if (_payloadType != 1 and _payloadType != 2 and _payloadType != 5) or h.need_pps != 0:
+        return False
+    if _sizeofNal < _MAPPED_SLICE_HEADER_BYTES:
+        return False
+    for _i in range(2, _MAPPED_SLICE_HEADER_BYTES):
+        if nal[_i] == 0 and nal[_i - 1] == 0:
+            return False
+    with var:
+        _bs = _BitReaderT()
+    _initBits(addr(_bs), _ptrAdd(cast[ptr[uint8]](nal), 1), _MAPPED_SLICE_HEADER_BYTES - 1)
+    _ = _ueBits(addr(_bs))  # first_mb_in_slice
+    _ = _ueBits(addr(_bs))  # slice_type
+    with let:
+        _ppsId = nint(_ueBits(addr(_bs)))
+    return _ppsId < _MINIMP4_MAX_PPS and h.sps_patcher.map_pps[_ppsId] == _ppsId
+
 def mp4_h26x_write_nal(h: ptr[mp4_h26x_writer_t], nal: ptr[UncheckedArray[uint8]],
                         length: nint, _timeStamp90kHz_next: uint32) -> nint:
     with let:
@@ -1216,22 +1365,23 @@ def mp4_h26x_write_nal(h: ptr[mp4_h26x_writer_t], nal: ptr[UncheckedArray[uint8]
             return _err
 
         with let:
-            _nal1 = cast[ptr[UncheckedArray[uint8]]](c_malloc(csize_t(_sizeofNal * 17 // 16 + 32)))
-        if _nal1 == None: return MP4E_STATUS_NO_MEMORY
-        with let:
-            _nal2 = cast[ptr[UncheckedArray[uint8]]](c_malloc(csize_t(_sizeofNal * 17 // 16 + 32)))
-        if _nal2 == None:
-            c_free(_nal1)
-            return MP4E_STATUS_NO_MEMORY
-
+            _nal2 = _scratch(addr(h.nal2), _sizeofNal * 17 // 16 + 32)
+        if _nal2 == None: return MP4E_STATUS_NO_MEMORY
         with var:
+            _escapedSize = nint(0)
+        if _isMappedSlice(h, _curNal, _sizeofNal):
+            # Fast path: the escaped NAL unit is muxed as is, after its 4 bytes size
+            copy_mem(addr(_nal2[4]), _curNal, _sizeofNal)
+            _escapedSize = _sizeofNal + 4
+        else:
+            with let:
+                _nal1 = _scratch(addr(h.nal1), _sizeofNal * 17 // 16 + 32)
+            if _nal1 == None: return MP4E_STATUS_NO_MEMORY
             _escapedSize = _removeNalEscapes(_nal2, _curNal, _sizeofNal)
-        if _escapedSize == 0:
-            c_free(_nal1); c_free(_nal2)
-            return MP4E_STATUS_BAD_ARGUMENTS
-
-        _escapedSize = _transcodeNalu(addr(h.sps_patcher), _nal2, _escapedSize, _nal1)
-        _escapedSize = _nalPutEsc(_nal2, _nal1, _escapedSize)
+            if _escapedSize == 0:
+                return MP4E_STATUS_BAD_ARGUMENTS
+            _escapedSize = _transcodeNalu(addr(h.sps_patcher), _nal2, _escapedSize, _nal1)
+            _escapedSize = _nalPutEsc(_nal2, _nal1, _escapedSize)
 
 
         match _payloadType:
@@ -1241,38 +1391,18 @@ def mp4_h26x_write_nal(h: ptr[mp4_h26x_writer_t], nal: ptr[UncheckedArray[uint8]
                 h.need_sps = 0
             case 8:
                 if h.need_sps != 0:
-                    c_free(_nal1); c_free(_nal2)
                     return MP4E_STATUS_BAD_ARGUMENTS
                 _ = MP4E_set_pps(h.mux, h.mux_track_id,
                                  _ptrAdd(cast[ptr[uint8]](_nal2), 4), _escapedSize - 4)
                 h.need_pps = 0
-            case 5:
-                if h.need_sps != 0:
-                    c_free(_nal1); c_free(_nal2)
-                    return MP4E_STATUS_BAD_ARGUMENTS
-                h.need_idr = 0
-                if h.need_pps == 0 and h.need_idr == 0:
-                    with var:
-                        _bs = _BitReaderT()
-                    _initBits(addr(_bs), _ptrAdd(cast[ptr[uint8]](_curNal), 1), _sizeofNal - 4 - 1)
-                    with let:
-                        _firstMbInSlice = _ueBits(addr(_bs))
-                    with var:
-                        _sampleKind = MP4E_SAMPLE_DEFAULT
-                    _nal2[0] = uint8((_escapedSize - 4) >> 24)
-                    _nal2[1] = uint8((_escapedSize - 4) >> 16)
-                    _nal2[2] = uint8((_escapedSize - 4) >> 8)
-                    _nal2[3] = uint8(_escapedSize - 4)
-                    if _firstMbInSlice != 0:
-                        _sampleKind = MP4E_SAMPLE_CONTINUATION
-                    elif _payloadType == 5:
-                        _sampleKind = MP4E_SAMPLE_RANDOM_ACCESS
-                    _err = MP4E_put_sample(h.mux, h.mux_track_id, _nal2, _escapedSize,
-                                           nint(_timeStamp90kHz_next), _sampleKind)
             case _:
                 if h.need_sps != 0:
-                    c_free(_nal1); c_free(_nal2)
                     return MP4E_STATUS_BAD_ARGUMENTS
+                if _payloadType == 5:
+                    h.need_idr = 0
+                # Slices before the first IDR slice are dropped. A sample starts with the
+                # slice of first_mb_in_slice 0: IDR samples are sync samples (stss),
+                # non-IDR samples, P frames, are not and need the previous frames to decode
                 if h.need_pps == 0 and h.need_idr == 0:
                     with var:
                         _bs = _BitReaderT()
@@ -1292,7 +1422,6 @@ def mp4_h26x_write_nal(h: ptr[mp4_h26x_writer_t], nal: ptr[UncheckedArray[uint8]
                     _err = MP4E_put_sample(h.mux, h.mux_track_id, _nal2, _escapedSize,
                                            nint(_timeStamp90kHz_next), _sampleKind)
 
-        c_free(_nal1); c_free(_nal2)
         if _err != 0: break
         _curNal <<= cast[ptr[UncheckedArray[uint8]]](cast[intp](_curNal) + 1)
     return _err
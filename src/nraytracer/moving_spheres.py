@@ -10,8 +10,9 @@ from nimic.ntypes import *
 # Stdlib
 from math import sqrt
 # Internals
-from core import HitRecord, Material, material
-from primitives import Point3, CTime
+from core import HitRecord
+from primitives import Point3, CTime, vec3
+from aabbs import AABB, aabb, surrounding_box
 
 
 class MovingSphere(Object):
@@ -21,13 +22,15 @@ class MovingSphere(Object):
     time0: CTime
     time1: CTime
     radius: float64
-    material: Material
+    materialId: uint16
 
     def center(self: MovingSphere, time: CTime) -> Point3:
         return self.center0 + (time - self.time0) / (self.time1 - self.time0) * (self.center1 - self.center0)
     
     @template_expand
-    def hit(self: MovingSphere, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+    def intersect(self: MovingSphere, r: Ray, t_min: float64, t_max: float64, t: mut @ float64) -> bool:
+        """{.inline, noSideEffect.}"""
+        ## Nearest intersection in (t_min, t_max) without building the hit record
         with let:
             oc = r.origin - self.center(r.time)
             a = r.direction.length_squared()
@@ -45,41 +48,55 @@ class MovingSphere(Object):
                     with let:
                         sol = root
                     if t_min < sol and sol < t_max:
-                        rec.t = sol
-                        rec.p = r.at(rec.t)
-                        with let:
-                            outward_normal = (rec.p - self.center(r.time)) / self.radius
-                        rec.set_face_normal(r, outward_normal)
-                        rec.material = self.material
+                        t <<= sol
                         return True
             _checkSol((-half_b - root)/a)
             _checkSol((-half_b + root)/a)
         return False
-    
 
-@dispatch
+    def setHitRecord(self: MovingSphere, r: Ray, t: float64, rec: mut @ HitRecord):
+        """{.inline, noSideEffect.}"""
+        ## Surface interaction at `t`, a result of `intersect`
+        rec.t = t
+        rec.p = r.at(t)
+        with let:
+            outward_normal = (rec.p - self.center(r.time)) / self.radius
+        rec.set_face_normal(r, outward_normal)
+        rec.materialId = self.materialId
+
+    def hit(self: MovingSphere, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.inline, noSideEffect.}"""
+        with var: t = 0.0
+        if self.intersect(r, t_min, t_max, t):
+            self.setHitRecord(r, t, rec)
+            return True
+        return False
+
+    def bounding_box(self: MovingSphere, time0: CTime, time1: CTime) -> AABB:
+        """{.noSideEffect.}"""
+        ## Box swept by the sphere over the shutter interval [time0, time1]
+        with let:
+            r = vec3(self.radius, self.radius, self.radius)
+            c0 = self.center(time0)
+            c1 = self.center(time1)
+        return surrounding_box(aabb(c0 - r, c0 + r), aabb(c1 - r, c1 + r))
+
+
 def movingSphere(
        center0: Point3, time0: CTime,
        center1: Point3, time1: CTime,
-       radius: float64, material: Material) -> MovingSphere:
+       radius: float64, materialId: uint16) -> MovingSphere:
     """{.inline.}"""
+    ## `materialId` comes from the MaterialTable of the scene, see Scene.addMaterial
     result = MovingSphere()
     result.center0 = center0
     result.center1 = center1
     result.time0 = time0
     result.time1 = time1
     result.radius = radius
-    result.material = material
+    result.materialId = materialId
     return result
 
-@dispatch
-def movingSphere[T](
-       center0: Point3, time0: CTime,
-       center1: Point3, time1: CTime,
-       radius: float64, materialKind: T) -> MovingSphere:
-    """{.inline.}"""
-    return movingSphere(center0, time0, center1, time1, radius, material(materialKind))
-
 # Sanity checks
 # -----------------------------------------------------
 # assert Hittable.is_concept_of(MovingSphere)
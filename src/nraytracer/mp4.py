@@ -11,12 +11,15 @@ from nimic.ntypes import *
 from nimic.std.os import *
 from nimic.std.strformat import *
 from nimic.system.ansi_c import *
-from nimic.std.syncio import read_file, write_buffer, set_file_pos
+from nimic.std.syncio import read_file, write_buffer, set_file_pos, flush_file
 from minimp4 import MP4E_mux_t, mp4_h26x_writer_t, MP4E_close, mp4_h26x_write_close, MP4E_STATUS_OK, mp4_h26x_write_nal, MP4E_open, mp4_h26x_write_init
 
 class MP4Muxer(Object):
     _muxer: ptr[MP4E_mux_t]
     _writer: ptr[mp4_h26x_writer_t]
+    _file: File
+    frameDuration: uint32   # Default frame duration, in 1/90000 s
+    fragmented: bool        # One movie fragment (moof + mdat) per GOP
 
 def close(m: mut@MP4Muxer):
     _ = MP4E_close(m._muxer)
@@ -36,19 +39,58 @@ def writeToFile(offset: int64, buffer: pointer, size: csize_t, token: pointer) -
         return -50
     return 0
 
-def writeMP4_from(self: mut@MP4Muxer, src: string):
+def writeMP4(self: mut@MP4Muxer, stream: openArray[byte]):
+    ## Mux an in-memory Annex B stream
     with let:
-        _buffer = read_file(src)
-        data = cast[ptr[UncheckedArray[uint8]]](addr(_buffer[0]))
-        dataLen = len(_buffer)
+        data = cast[ptr[UncheckedArray[uint8]]](unsafe_addr(stream[0]))
+        dataLen = len(stream)
+    with let:
+        ok = mp4_h26x_write_nal(self._writer, data, dataLen, self.frameDuration)
+    doAssert(ok == MP4E_STATUS_OK, "error: mp4_h26x_write_nal failed, code=" + str(ok))
+
+@dispatch
+def writeFrame(self: mut@MP4Muxer, nal: openArray[byte], duration90kHz: uint32):
+    ## Mux the NAL units of one encoded frame as soon as they are produced.
+    ## minimp4 takes the time until the next sample,
+    ## `duration90kHz` is the display duration of this frame in 1/90000 s.
+    ## Samples are written to the file immediately, only their index is kept
+    ## so memory doesn't grow with the frame data.
+    ## Fragmented files keep the current GOP instead, and the file is flushed
+    ## after each fragment so that it stays playable if the process is killed.
+    doAssert(len(nal) > 0, "Empty frame")
     with let:
-        ok = mp4_h26x_write_nal(self._writer, data, dataLen, uint32(90000 // 30))
+        fragments = self._muxer.fragments_count
+        ok = mp4_h26x_write_nal(
+            self._writer,
+            cast[ptr[UncheckedArray[uint8]]](unsafe_addr(nal[0])), len(nal),
+            duration90kHz
+        )
     doAssert(ok == MP4E_STATUS_OK, "error: mp4_h26x_write_nal failed, code=" + str(ok))
+    if self._muxer.fragments_count != fragments:
+        self._file.flush_file()
+
+@dispatch
+def writeFrame(self: mut@MP4Muxer, nal: openArray[byte]):
+    ## Mux one encoded frame with the default frame duration
+    self.writeFrame(nal, self.frameDuration)
+
+def writeMP4_from(self: mut@MP4Muxer, src: string):
+    ## Mux a .264 file, loaded whole in memory
+    with let:
+        _buffer = read_file(src)
+    self.writeMP4(to_open_array_byte(_buffer, 0, len(_buffer) - 1))
 
-def initialize(self: mut@MP4Muxer, file: File, width: int32, height: int32):
+def initialize(self: mut@MP4Muxer, file: File, width: int32, height: int32, fps = 30, fragmented = False):
+    ## `fps` sets the default frame duration of writeFrame and writeMP4.
+    ## With `fragmented`, the moov box only describes the track and is written
+    ## before the first GOP, each GOP is then a movie fragment:
+    ## the index memory is bounded by the GOP size instead of the frame count.
     doAssert(self._muxer.is_nil, "Already initialized")
+    self.frameDuration = uint32(90000 // fps)
+    self.fragmented = fragmented
+    self._file = file
     doAssert(self._writer.is_nil, "Already initialized")
-    self._muxer = MP4E_open(0, 0, cast[pointer](file), writeToFile)
+    self._muxer = MP4E_open(0, nint(fragmented), cast[pointer](file), writeToFile)
     doAssert(self._muxer.is_nil == False, "MP4E_open returned NULL! muxer init failed!")
     self._writer = cast[ptr[mp4_h26x_writer_t]](c_malloc(csize_t(sizeof(mp4_h26x_writer_t))))
     with let:
@@ -12,51 +12,116 @@ from nimic.std.os import *
 from nimic.std.paths import *
 from nimic.std.strformat import *
 from nimic.std.strutils import *
+from nimic.std.syncio import write_buffer
 from primitives import Canvas, clamp
 
-@dispatch
-def exportToPPM(canvas: Canvas, f: TextIOWrapper):
-    @template
-    def _conv(c: float64) -> nint:
-        return nint(256 * clamp(c, 0.0, 0.999))
-
-    f.write(f"P3\n{canvas.ncols} {canvas.nrows}\n255\n")
-
+# PPM export
+# ------------------------------------------------------------------------
+# ppmBinary (P6) quantizes the whole canvas into one byte buffer
+# and writes it with a single call.
+# ppmAscii (P3) writes one formatted line per pixel, it is kept
+# for human-readable output and is ~3x larger on disk.
+# Both encode the same 8-bit values.
+
+class PPMFormat(NIntEnum):
+    ppmBinary = auto()  # P6
+    ppmAscii = auto()   # P3
+
+@template
+def _conv(c: float64) -> uint8:
+    return uint8(256 * clamp(c, 0.0, 0.999))
+
+def quantizeToRGB(canvas: Canvas, buffer: mut @ seq[uint8]):
+    ## Translate the canvas to [0, 255] RGB triplets, bottom row first,
+    ## into `buffer` which is resized to ncols * nrows * 3 bytes.
+    ## Reusing the same buffer across frames avoids any allocation.
+    buffer.set_len(canvas.ncols * canvas.nrows * 3)
+    with var:
+        pos = 0
     for i in countdown(canvas.nrows-1, 0):
         for j in range(canvas.ncols):
-            # Write the translated [0, 255] value of each color component
             with let:
                 pixel = canvas[i, j]
-                r = pixel.x
-                g = pixel.y
-                b = pixel.z
-            f.write(f"{_conv(r)} {_conv(g)} {_conv(b)}\n")
+            buffer[pos] = _conv(pixel.x)
+            buffer[pos+1] = _conv(pixel.y)
+            buffer[pos+2] = _conv(pixel.z)
+            pos += 3
+
+def _writePPM(canvas: Canvas, f: TextIOWrapper, format: PPMFormat, buffer: mut @ seq[uint8]):
+    match format:
+        case PPMFormat.ppmBinary:
+            f.write(f"P6\n{canvas.ncols} {canvas.nrows}\n255\n")
+            quantizeToRGB(canvas, buffer)
+            with let:
+                written = write_buffer(f, addr(buffer[0]), len(buffer))
+            doAssert(written == len(buffer), "Failed to write the PPM pixels")
+        case PPMFormat.ppmAscii:
+            f.write(f"P3\n{canvas.ncols} {canvas.nrows}\n255\n")
+
+            for i in countdown(canvas.nrows-1, 0):
+                for j in range(canvas.ncols):
+                    # Write the translated [0, 255] value of each color component
+                    with let:
+                        pixel = canvas[i, j]
+                        r = pixel.x
+                        g = pixel.y
+                        b = pixel.z
+                    f.write(f"{_conv(r)} {_conv(g)} {_conv(b)}\n")
+
+@dispatch
+def exportToPPM(canvas: Canvas, f: TextIOWrapper, format = PPMFormat.ppmBinary):
+    with var:
+        buffer = seq[uint8]()
+    _writePPM(canvas, f, format, buffer)
 
 @dispatch
-def exportToPPM(canvas: Canvas, path: string, imageSeries: string, sceneID: nint):
-    @template
-    def _conv(c: float64) -> nint:
-        return nint(256 * clamp(c, 0.0, 0.999))
-
-    with let: f = open(
-              str(Path(path) / Path(imageSeries + "_" + int_to_str(sceneID, minchars = 5) + ".ppm")),
-              fmWrite
-            )
+def exportToPPM(canvas: Canvas, path: string, imageSeries: string, sceneID: nint,
+                format = PPMFormat.ppmBinary):
+    with var:
+        buffer = seq[uint8]()
+    exportToPPM(canvas, path, imageSeries, sceneID, buffer, format)
+
+def seriesFramePath(path: string, imageSeries: string, sceneID: nint) -> string:
+    ## File of frame `sceneID` of an image series exported by `exportToPPM`
+    return str(Path(path) / Path(imageSeries + "_" + int_to_str(sceneID, minchars = 5) + ".ppm"))
+
+def binaryPPMSize(nrows: nint, ncols: nint) -> nint:
+    ## Size in bytes of a complete P6 export of a `nrows` x `ncols` canvas
+    return len(f"P6\n{ncols} {nrows}\n255\n") + nrows * ncols * 3
+
+@dispatch
+def exportToPPM(canvas: Canvas, path: string, imageSeries: string, sceneID: nint,
+                buffer: mut @ seq[uint8], format = PPMFormat.ppmBinary):
+    ## Export one frame of an image series,
+    ## `buffer` is scratch space reused across frames.
+    with let: f = open(seriesFramePath(path, imageSeries, sceneID), fmWrite)
     try:
-        f.write(f"P3\n{canvas.ncols} {canvas.nrows}\n255\n")
-
-        for i in countdown(canvas.nrows-1, 0):
-            for j in range(canvas.ncols):
-                # Write the translated [0, 255] value of each color component
-                with let:
-                    pixel = canvas[i, j]
-                    r = pixel.x
-                    g = pixel.y
-                    b = pixel.z
-                f.write(f"{_conv(r)} {_conv(g)} {_conv(b)}\n")
+        _writePPM(canvas, f, format, buffer)
     finally:
         f.close()
 
+def exportSampleHeatmap(sampleCounts: openArray[int32], nrows: nint, ncols: nint,
+                        maxSamples: nint, f: TextIOWrapper):
+    ## Write the per-pixel sample counts of `renderAdaptive` as a P6 image,
+    ## same orientation as the canvas.
+    ## Blue: few samples, green: half of `maxSamples`, red: `maxSamples`.
+    assert len(sampleCounts) == nrows * ncols
+    with var:
+        buffer = new_seq[uint8](nrows * ncols * 3)
+        pos = 0
+    for i in countdown(nrows-1, 0):
+        for j in range(ncols):
+            with let:
+                t = float64(sampleCounts[i * ncols + j]) / float64(maxSamples)
+            buffer[pos] = _conv(2.0 * t - 1.0)
+            buffer[pos+1] = _conv(1.0 - abs(2.0 * t - 1.0))
+            buffer[pos+2] = _conv(1.0 - 2.0 * t)
+            pos += 3
+    f.write(f"P6\n{ncols} {nrows}\n255\n")
+    with let:
+        written = write_buffer(f, addr(buffer[0]), len(buffer))
+    doAssert(written == len(buffer), "Failed to write the PPM pixels")
+
 # Trace of Radiance
 # Copyright (c) 2020 Mamy André-Ratsimbazafy
 # Licensed and distributed under either of
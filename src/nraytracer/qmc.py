@@ -0,0 +1,198 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+
+from __future__ import annotations
+from nimic.ntypes import *
+
+from math import pi, sqrt, sin, cos, cbrt
+# Internal
+from primitives import Vec3, vec3, UnitVector
+
+# Quasi-Monte Carlo sampling
+# ------------------------------------------------------------------------
+# Low-discrepancy points fill the sample space more evenly than independent
+# random numbers, so the error of a pixel decreases faster with the number
+# of samples, for powers of 2 in particular.
+#
+# QmcSampler draws the Sobol sequence with hash-based Owen scrambling
+# (Burley, "Practical Hash-based Owen Scrambling", JCGT 2020).
+# Dimensions are drawn in order and grouped by 4: each group is a 4D Sobol
+# point whose sample index is shuffled by a per-group hash, so that groups
+# are decorrelated while each stays stratified. With the pixel loop of `render`
+# the first group holds the pixel jitter and the lens position.
+#
+# Each pixel has its own scrambling, seeded from its coordinates like Rng,
+# and the sample index is set by the pixel loop with `startSample`.
+# Sampling routines consume a fixed number of dimensions: unlike the Rng ones
+# they map the unit square or cube instead of rejecting points.
+
+with const:
+    _SobolDimensions = 4
+
+def _sobolDirections() -> array[_SobolDimensions, array[32, uint32]]:
+    ## Direction numbers of Joe and Kuo (new-joe-kuo-6.21201),
+    ## the first dimension is the van der Corput sequence.
+    with const:
+        degree = [1, 2, 3]
+        coefs = [0, 1, 1]
+        initial = [[1, 0, 0], [1, 3, 0], [1, 3, 1]]
+    for i in range(32):
+        result[0][i] = uint32(1) << (31 - i)
+    for d in range(1, _SobolDimensions):
+        with let:
+            s = degree[d - 1]
+            a = coefs[d - 1]
+        for i in range(s):
+            result[d][i] = uint32(initial[d - 1][i]) << (31 - i)
+        for i in range(s, 32):
+            result[d][i] = result[d][i - s] ^ (result[d][i - s] >> s)
+            for k in range(1, s):
+                if ((a >> (s - 1 - k)) & 1) != 0:
+                    result[d][i] = result[d][i] ^ result[d][i - k]
+    return result
+
+with const:
+    _SobolMatrices = _sobolDirections()
+
+def _sobol(index: uint32, dimension: uint32) -> uint32:
+    """{.inline, noSideEffect.}"""
+    with var:
+        bits = index
+    result = uint32(0)
+    for bit in range(32):
+        if bits == 0:
+            break
+        if (bits & 1) != 0:
+            result = result ^ _SobolMatrices[dimension][bit]
+        bits = bits >> 1
+    return result
+
+def _reverseBits(x: uint32) -> uint32:
+    """{.inline, noSideEffect.}"""
+    with var:
+        y = ((x >> 1) & uint32(0x55555555)) | ((x & uint32(0x55555555)) << 1)
+    y = ((y >> 2) & uint32(0x33333333)) | ((y & uint32(0x33333333)) << 2)
+    y = ((y >> 4) & uint32(0x0F0F0F0F)) | ((y & uint32(0x0F0F0F0F)) << 4)
+    y = ((y >> 8) & uint32(0x00FF00FF)) | ((y & uint32(0x00FF00FF)) << 8)
+    return (y >> 16) | (y << 16)
+
+def _laineKarras(x: uint32, seed: uint32) -> uint32:
+    """{.inline, noSideEffect.}"""
+    ## Hash where each bit only depends on the lower bits
+    with var:
+        h = x + seed
+    h = h ^ (h * uint32(0x6c50b47c))
+    h = h ^ (h * uint32(0xb82f1e52))
+    h = h ^ (h * uint32(0xc7afe638))
+    h = h ^ (h * uint32(0x8d22f6e6))
+    return h
+
+def _owenScramble(x: uint32, seed: uint32) -> uint32:
+    """{.inline, noSideEffect.}"""
+    ## Nested uniform scrambling: each bit is flipped depending on the higher bits
+    return _reverseBits(_laineKarras(_reverseBits(x), seed))
+
+def _hashCombine(seed: uint32, v: uint32) -> uint32:
+    """{.inline, noSideEffect.}"""
+    return seed ^ (v + uint32(0x9e3779b9) + (seed << 6) + (seed >> 2))
+
+def _hash32(x: uint64) -> uint32:
+    """{.inline, noSideEffect.}"""
+    ## SplitMix64 finalizer, high bits
+    with var:
+        z = x + u64(0x9e3779b97f4a7c15)
+    z = (z ^ (z >> 30)) * u64(0xbf58476d1ce4e5b9)
+    z = (z ^ (z >> 27)) * u64(0x94d049bb133111eb)
+    return uint32((z ^ (z >> 31)) >> 32)
+
+class QmcSampler(Object):
+    ## Owen-scrambled Sobol points, usable instead of Rng
+    ## by the camera, the materials and `radiance`
+    scramble: uint32    # Seed of the pixel
+    index: uint32       # Sample of the pixel
+    dimension: uint32   # Next dimension to draw
+
+    def seed(s: mut @ QmcSampler, x: SomeInteger, y: SomeInteger):
+        """{.noSideEffect.}"""
+        ## Scrambling of a pixel, from its coordinates like `Rng.seed(row, col)`
+        s.scramble = _hash32((uint64(x) << 32) ^ uint64(y))
+        s.index = 0
+        s.dimension = 0
+
+    def startSample(s: mut @ QmcSampler, index: SomeInteger):
+        """{.inline, noSideEffect.}"""
+        ## Start drawing the sample `index` of the pixel, from the first dimension
+        s.index = uint32(index)
+        s.dimension = 0
+
+    def _next(s: mut @ QmcSampler) -> uint32:
+        """{.noSideEffect.}"""
+        with let:
+            group = _hashCombine(s.scramble, s.dimension // _SobolDimensions)
+            index = _owenScramble(s.index, group)
+            dimension = s.dimension % _SobolDimensions
+        s.dimension += 1
+        return _owenScramble(_sobol(index, dimension), _hashCombine(group, dimension + 1))
+
+    def uniform(s: mut @ QmcSampler, _: type[float64]) -> float64:
+        """{.noSideEffect.}"""
+        return float64(s._next()) * (1.0 / 4294967296.0)
+
+    def uniform(s: mut @ QmcSampler, maxExcl: float64) -> float64:
+        """{.noSideEffect.}"""
+        return s.uniform(float64) * maxExcl
+
+    def uniform(s: mut @ QmcSampler, minIncl: float64, maxExcl: float64) -> float64:
+        """{.noSideEffect.}"""
+        return max(minIncl, s.uniform(float64) * (maxExcl - minIncl) + minIncl)
+
+# Sampling routines
+# ------------------------------------------------------
+
+@dispatch
+def random(s: mut @ QmcSampler, _: type[float64]) -> float64:
+    """{.inline, noSideEffect.}"""
+    return s.uniform(float64)
+
+@dispatch
+def random(s: mut @ QmcSampler, _: type[float64], max: float64) -> float64:
+    """{.inline, noSideEffect.}"""
+    return s.uniform(max)
+
+@dispatch
+def random(s: mut @ QmcSampler, _: type[float64], min: float64, max: float64) -> float64:
+    """{.inline, noSideEffect.}"""
+    return s.uniform(min, max)
+
+@dispatch
+def random(s: mut @ QmcSampler, _: type[UnitVector]) -> UnitVector:
+    """{.noSideEffect.}"""
+    ## 2 dimensions
+    with let: a = random(s, float64, 2*pi)
+    with let: z = random(s, float64, -1.0, 1.0)
+    with let: r = sqrt(1.0 - z*z)
+    return vec3(r*cos(a), r*sin(a), z).toUV()
+
+def random_in_unit_sphere(s: mut @ QmcSampler, _: type[Vec3]) -> Vec3:
+    """{.noSideEffect.}"""
+    ## 3 dimensions: a direction and a radius
+    with let: direction = random(s, UnitVector).toVec3()
+    return cbrt(random(s, float64)) * direction
+
+def random_in_unit_disk(s: mut @ QmcSampler, _: type[Vec3]) -> Vec3:
+    """{.noSideEffect.}"""
+    ## 2 dimensions, concentric mapping of Shirley and Chiu
+    with let:
+        a = random(s, float64, -1.0, 1.0)
+        b = random(s, float64, -1.0, 1.0)
+    if a == 0.0 and b == 0.0:
+        return vec3(0, 0, 0)
+    if abs(a) > abs(b):
+        with let: phi = (pi / 4.0) * (b / a)
+        return vec3(a * cos(phi), a * sin(phi), 0)
+    with let: phi = pi / 2.0 - (pi / 4.0) * (a / b)
+    return vec3(b * cos(phi), b * sin(phi), 0)
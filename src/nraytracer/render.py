@@ -7,24 +7,63 @@
 
 from __future__ import annotations
 from nimic.ntypes import *
-from math import inf
+from math import inf, sqrt
+from nimic.std.atomics import *
+from nimic.std.cpuinfo import countProcessors
+from nimic.std.typedthreads import *
+from nimic.std.monotimes import *
+from nimic.std.times import *
 # Internals
-from primitives import Canvas, Color, Ray, color, draw, attenuation
-from sampling import Rng, random
-from core import HitRecord
-from hittables import HittableList
+from primitives import Canvas, Color, Ray, Attenuation, color, draw, attenuation
+from sampling import Rng, QmcSampler, random
+from core import HitRecord, MaterialKind
+from hittables import HittableList, BVH, BVHList
 from cameras import Camera
 from materials import scatter
+from checkpoints import CheckpointWriter, CheckpointReader, writeValue, writeSeq, readValue, readSeq
 
 # Rendering routines
 # ------------------------------------------------------------------------
 
-def radiance(ray: Ray, world: HittableList, max_depth: nint, rng: mut @ Rng) -> Color:
+with const:
+    NoRussianRoulette = -1  # `roulette_depth` that disables Russian roulette
+
+def _russianRoulette[R](throughput: mut @ Attenuation, rng: mut @ R) -> bool:
+    """{.inline.}"""
+    ## Randomly terminates a path, the dimmer the more likely.
+    ## Survivors are reweighted by the inverse of their survival probability
+    ## so that the estimator stays unbiased.
+    with let:
+        survival = min(max(throughput.x, max(throughput.y, throughput.z)), 1.0)
+    if random(rng, float64) >= survival:
+        return False
+    throughput *= attenuation(1.0 / survival, 1.0 / survival, 1.0 / survival)
+    return True
+
+def _background(ray: Ray) -> Color:
+    """{.inline.}"""
+    ## Sky gradient seen by rays that escape the scene
+    with let:
+        unit_direction = ray.direction.unit_vector()
+        t = 0.5 * unit_direction.y + 1.0
+    return (1.0 - t) * color(1, 1, 1) + t * color(0.5, 0.7, 1)
+
+def radiance[W, R](ray: Ray, world: W, max_depth: nint, rng: mut @ R,
+                   roulette_depth = NoRussianRoulette) -> Color:
+    ## `world` is any hittable: a HittableList, a BVH or a BVHList.
+    ## Its `materials` are indexed by the material id of the closest hit.
+    ## `rng` is an Rng or a QmcSampler.
+    ## From `roulette_depth` bounces on, paths are terminated by Russian roulette
+    ## driven by their throughput; `max_depth` still bounds the path length.
     with var:
         _attenuation = attenuation(1.0, 1.0, 1.0)
         ray = ray.copy() # create mutable copy
 
-    for _ in range(max_depth):
+    for depth in range(max_depth):
+        if roulette_depth >= 0 and depth >= roulette_depth:
+            if not _russianRoulette(_attenuation, rng):
+                return color(0, 0, 0)
+
         # Hit surface?
         with var:
            rec = HitRecord()
@@ -35,7 +74,7 @@ def radiance(ray: Ray, world: HittableList, max_depth: nint, rng: mut @ Rng) ->
                 materialAttenuation = attenuation()
                 scattered = Ray()
             with let:
-                maybeScatter = scatter(rec.material, ray, rec, rng, materialAttenuation, scattered)
+                maybeScatter = scatter(world.materials[rec.materialId], ray, rec, rng, materialAttenuation, scattered)
             # Bounce on surface
             if maybeScatter:
                 _attenuation *= materialAttenuation
@@ -44,41 +83,515 @@ def radiance(ray: Ray, world: HittableList, max_depth: nint, rng: mut @ Rng) ->
             return color(0, 0, 0)
 
         # No hit
-        with let:
-            unit_direction = ray.direction.unit_vector()
-            t = 0.5 * unit_direction.y + 1.0
-        result = (1.0 - t) * color(1, 1, 1) + t * color(0.5, 0.7, 1)
+        result = _background(ray)
         result *= _attenuation
         return result
 
     return color(0, 0, 0)
 
-def render(canvas: mut @ Canvas, cam: Camera, world: HittableList, max_depth: nint):
+class SamplerKind(NIntEnum):
+    ## Source of the sample positions of `render` and `renderParallel`
+    samplerRandom = auto()  # Independent random numbers, `Rng`
+    samplerSobol = auto()   # Owen-scrambled Sobol points, `QmcSampler`
 
+def _sample[W, R](canvas: ptr[Canvas], cam: ptr[Camera], world: W, max_depth: nint, roulette_depth: nint,
+                  rng: mut @ R, row: nint, col: nint) -> Color:
+    """{.inline.}"""
     with let:
-        canvas = addr(canvas) # Mutable
-        #cam = unsafeAddr(cam) # Too big for capture
+        u = (float64(col) + random(rng, float64)) / float64(canvas.ncols - 1)
+        v = (float64(row) + random(rng, float64)) / float64(canvas.nrows - 1)
+        r = cam.contents.ray(u, v, rng)
+    return radiance(r, world, max_depth, rng, roulette_depth)
 
-    #parallelFor row in 0 ..< canvas.nrows:
-    for row in range(canvas.nrows):
-        # captures: {canvas, cam, world, max_depth}
-        #parallelFor col in 0 ..< canvas.ncols:
-        for col in range(canvas.ncols):
-            # captures: {row, canvas, cam, world, max_depth}
+def _renderPixel[W](canvas: ptr[Canvas], cam: ptr[Camera], world: W, max_depth: nint, roulette_depth: nint,
+                    sampler: SamplerKind, row: nint, col: nint):
+    """{.inline.}"""
+    with var:
+        pixel = color(0, 0, 0)
+    match sampler:
+        case SamplerKind.samplerRandom:
             with var:
                 rng = Rng()   # We reseed per pixel to be able to parallelize the outer loops
             rng.seed(row, col) # And use a "perfect hash" as the seed
-            with var:
-                pixel = color(0, 0, 0)
             for _ in range(canvas.samples_per_pixel):
-                # loadBalance(Weave)
-                with let:
-                    u = (float64(col) + random(rng, float64)) / float64(canvas.ncols - 1)
-                    v = (float64(row) + random(rng, float64)) / float64(canvas.nrows - 1)
-                    r = cam.ray(u, v, rng)
-                    rad = radiance(r, world, max_depth, rng)
-                pixel += rad
-            draw(canvas.contents, row, col, pixel)
+                pixel += _sample(canvas, cam, world, max_depth, roulette_depth, rng, row, col)
+        case SamplerKind.samplerSobol:
+            with var:
+                qmc = QmcSampler()
+            qmc.seed(row, col)
+            for i in range(canvas.samples_per_pixel):
+                qmc.startSample(i)
+                pixel += _sample(canvas, cam, world, max_depth, roulette_depth, qmc, row, col)
+    draw(canvas.contents, row, col, pixel)
+
+# Adaptive sampling
+# ------------------------------------------------------------------------
+# Tracks the running mean and variance of the luminance of the samples
+# of each pixel (Welford's algorithm) and stops sampling once the standard
+# error of the mean is below a fraction of the mean.
+# `canvas.samples_per_pixel` is the maximum number of samples.
+# A pixel takes the same first samples as with `render`, only fewer of them.
+
+class AdaptiveSampling(Object):
+    ## Settings of `renderAdaptive`
+    minSamples: int32       # Samples before the first convergence test, at least 2
+    relativeError: float64  # Target standard error, relative to the mean luminance
+
+def _luminance(c: Color) -> float64:
+    """{.inline.}"""
+    return 0.2126 * c.x + 0.7152 * c.y + 0.0722 * c.z
+
+def _renderPixelAdaptive[W](canvas: ptr[Canvas], cam: ptr[Camera], world: W, max_depth: nint, roulette_depth: nint,
+                            adaptive: ptr[AdaptiveSampling], row: nint, col: nint) -> int32:
+    """{.inline.}"""
+    ## Returns the number of samples taken
+    with var:
+        rng = Rng()
+    rng.seed(row, col)
+    with var:
+        pixel = color(0, 0, 0)
+        n = 0
+        mean = 0.0
+        m2 = 0.0    # Sum of squared deviations from the mean
+    while n < canvas.samples_per_pixel:
+        with let:
+            u = (float64(col) + random(rng, float64)) / float64(canvas.ncols - 1)
+            v = (float64(row) + random(rng, float64)) / float64(canvas.nrows - 1)
+            r = cam.contents.ray(u, v, rng)
+            rad = radiance(r, world, max_depth, rng, roulette_depth)
+        pixel += rad
+        n += 1
+
+        with let:
+            y = _luminance(rad)
+            delta = y - mean
+        mean += delta / float64(n)
+        m2 += delta * (y - mean)
+        if n >= adaptive.minSamples:
+            with let:
+                stdError = sqrt(m2 / float64((n - 1) * n))
+            if stdError <= adaptive.relativeError * mean:
+                break
+    draw(canvas.contents, row, col, pixel, n)
+    return int32(n)
+
+def render[W](canvas: mut @ Canvas, cam: Camera, world: W, max_depth: nint,
+              roulette_depth = NoRussianRoulette, sampler = SamplerKind.samplerRandom):
+    ## Single-threaded reference renderer
+
+    with let:
+        canvas = addr(canvas) # Mutable
+        cam = unsafe_addr(cam) # Too big for capture
+
+    for row in range(canvas.nrows):
+        for col in range(canvas.ncols):
+            _renderPixel(canvas, cam, world, max_depth, roulette_depth, sampler, row, col)
+
+# Progressive rendering
+# ------------------------------------------------------------------------
+# The samples are accumulated in linear radiance with a per-pixel count,
+# in passes of a few samples per pixel. After each pass the accumulation
+# is resolved (averaged and gamma-corrected) into a canvas for preview,
+# and rendering can stop on a time budget, a sample count or convergence.
+#
+# Each pixel keeps its RNG between passes: after passes totalling N samples
+# per pixel the resolved canvas is bit-identical to `render` with N samples.
+
+class Progressive(Object):
+    ## Accumulation buffer of a progressive render
+    nrows: int32
+    ncols: int32
+    samples: int32              # Samples per pixel accumulated so far
+    passes: int32
+    sums: seq[Color]            # Sum of the samples, linear radiance
+    lumaSquares: seq[float64]   # Sum of the squared luminance of the samples
+    rngs: seq[Rng]
+
+class ProgressiveBudget(Object):
+    ## Stop conditions of `renderProgressive`, 0 disables a condition
+    samplesPerPass: int32
+    maxSamples: int32           # Target samples per pixel
+    time: Duration              # Wall-clock budget, a pass is not started if it would not fit
+    relativeError: float64      # Target `meanRelativeError`
+
+def clear(prog: mut @ Progressive):
+    ## Drop the accumulated samples and reseed the pixels, to render another image
+    for i in range(len(prog.sums)):
+        prog.sums[i] = color(0, 0, 0)
+        prog.lumaSquares[i] = 0.0
+    for row in range(prog.nrows):
+        for col in range(prog.ncols):
+            prog.rngs[row * prog.ncols + col].seed(row, col) # Like `_renderPixel`
+    prog.samples = 0
+    prog.passes = 0
+
+def initProgressive(nrows: SomeInteger, ncols: SomeInteger) -> Progressive:
+    result = Progressive()
+    result.nrows = int32(nrows)
+    result.ncols = int32(ncols)
+    result.sums = new_seq[Color](nrows * ncols)
+    result.lumaSquares = new_seq[float64](nrows * ncols)
+    result.rngs = new_seq[Rng](nrows * ncols)
+    result.clear()
+    return result
+
+def writeState(prog: Progressive, w: mut @ CheckpointWriter):
+    ## Save the accumulation and the RNG of every pixel:
+    ## the render resumed by `readState` is bit-identical to an uninterrupted one
+    w.writeValue(prog.nrows)
+    w.writeValue(prog.ncols)
+    w.writeValue(prog.samples)
+    w.writeValue(prog.passes)
+    w.writeSeq(prog.sums)
+    w.writeSeq(prog.lumaSquares)
+    w.writeSeq(prog.rngs)
+
+def readState(prog: mut @ Progressive, r: mut @ CheckpointReader):
+    ## Restore a state saved by `writeState` into `prog` of the same size
+    with var:
+        nrows = int32(0)
+        ncols = int32(0)
+    r.readValue(nrows)
+    r.readValue(ncols)
+    doAssert(nrows == prog.nrows and ncols == prog.ncols, "Checkpoint of a different image size")
+    r.readValue(prog.samples)
+    r.readValue(prog.passes)
+    r.readSeq(prog.sums)
+    r.readSeq(prog.lumaSquares)
+    r.readSeq(prog.rngs)
+    doAssert(len(prog.sums) == nrows * ncols and len(prog.lumaSquares) == nrows * ncols and
+             len(prog.rngs) == nrows * ncols, "Corrupted checkpoint")
+
+def _accumulatePixel[W](prog: ptr[Progressive], cam: ptr[Camera], world: W, max_depth: nint, roulette_depth: nint,
+                        passSamples: nint, row: nint, col: nint):
+    """{.inline.}"""
+    with let:
+        i = row * prog.ncols + col
+    with template_inline:
+        """{.dirty.}"""
+        rng = prog.rngs[i]
+    for _ in range(passSamples):
+        with let:
+            u = (float64(col) + random(rng, float64)) / float64(prog.ncols - 1)
+            v = (float64(row) + random(rng, float64)) / float64(prog.nrows - 1)
+            r = cam.contents.ray(u, v, rng)
+            rad = radiance(r, world, max_depth, rng, roulette_depth)
+            y = _luminance(rad)
+        prog.sums[i] += rad
+        prog.lumaSquares[i] += y * y
+
+def resolve(prog: Progressive, canvas: mut @ Canvas):
+    ## Average and gamma-correct the accumulated samples into `canvas`
+    assert canvas.nrows == prog.nrows and canvas.ncols == prog.ncols
+    assert prog.samples > 0
+    for row in range(canvas.nrows):
+        for col in range(canvas.ncols):
+            draw(canvas, row, col, prog.sums[row * prog.ncols + col], prog.samples)
+
+def meanRelativeError(prog: Progressive) -> float64:
+    ## Mean over the lit pixels of the standard error of the luminance,
+    ## relative to the mean luminance. Decreases as 1/sqrt(samples).
+    if prog.samples < 2:
+        return inf
+    with let:
+        n = float64(prog.samples)
+    with var:
+        sum = 0.0
+        lit = 0
+    for i in range(len(prog.sums)):
+        with let:
+            mean = _luminance(prog.sums[i]) / n
+            variance = max(prog.lumaSquares[i] / n - mean * mean, 0.0) * n / (n - 1.0)
+        if mean > 0.0:
+            sum += sqrt(variance / n) / mean
+            lit += 1
+    return 0.0 if lit == 0 else sum / float64(lit)
+
+# Parallel rendering
+# ------------------------------------------------------------------------
+# The canvas is split in square tiles, numbered in row-major order.
+# Each worker owns a contiguous range of tiles and claims them one by one
+# with an atomic counter. When its range is exhausted it steals from the
+# ranges of the other workers, so that workers whose tiles are cheap (sky)
+# help those whose tiles are expensive (glass spheres, deep paths).
+#
+# Each pixel is rendered exactly once with an RNG seeded from its coordinates,
+# the output is bit-identical to `render` whatever the number of threads.
+
+with const:
+    TileSize = 16
+
+class _TileRange(Object):
+    ## Tiles [next, stop) still to be rendered.
+    ## Padded to a cache line: the counters of different workers
+    ## must not share one.
+    next: Atomic[int32]
+    stop: int32
+    _pad: array[56, byte]
+
+class _RenderJob[W](Object):
+    canvas: ptr[Canvas]
+    cam: ptr[Camera]
+    world: ptr[W]
+    max_depth: nint
+    roulette_depth: nint
+    sampler: SamplerKind
+    adaptive: ptr[AdaptiveSampling]             # nil for a fixed sample count
+    sampleCounts: ptr[UncheckedArray[int32]]    # Written in adaptive mode
+    progressive: ptr[Progressive]               # Accumulates instead of drawing when not nil
+    passSamples: nint
+    ranges: ptr[UncheckedArray[_TileRange]]
+    numWorkers: nint
+    id: nint
+
+def _renderTile[W](job: ptr[_RenderJob[W]], tile: nint):
+    with let:
+        tilesPerRow = (job.canvas.ncols + TileSize - 1) // TileSize
+        row0 = (tile // tilesPerRow) * TileSize
+        col0 = (tile % tilesPerRow) * TileSize
+        row1 = min(row0 + TileSize, job.canvas.nrows)
+        col1 = min(col0 + TileSize, job.canvas.ncols)
+    for row in range(row0, row1):
+        for col in range(col0, col1):
+            if not job.progressive.is_nil:
+                _accumulatePixel(job.progressive, job.cam, job.world.contents, job.max_depth, job.roulette_depth,
+                                 job.passSamples, row, col)
+            elif not job.adaptive.is_nil:
+                job.sampleCounts[row * job.canvas.ncols + col] = _renderPixelAdaptive(
+                    job.canvas, job.cam, job.world.contents, job.max_depth, job.roulette_depth,
+                    job.adaptive, row, col
+                )
+            else:
+                _renderPixel(job.canvas, job.cam, job.world.contents, job.max_depth, job.roulette_depth,
+                             job.sampler, row, col)
+
+def _renderWorker[W](job: ptr[_RenderJob[W]]):
+    """{.thread.}"""
+    # Own range first, then steal from the next workers in turn
+    for k in range(job.numWorkers):
+        with let:
+            victim = (job.id + k) % job.numWorkers
+        while True:
+            with let:
+                tile = fetchAdd(job.ranges[victim].next, 1, moRelaxed)
+            if tile >= job.ranges[victim].stop:
+                break
+            _renderTile(job, tile)
+
+def _renderTiles[W](setup: _RenderJob[W], numThreads: nint):
+    ## Render all the tiles of `setup.canvas`.
+    ## `setup` holds the scene and the mode, the scheduling fields are filled here.
+    with let:
+        numWorkers = countProcessors() if numThreads <= 0 else numThreads
+        tilesPerRow = (setup.canvas.ncols + TileSize - 1) // TileSize
+        tilesPerCol = (setup.canvas.nrows + TileSize - 1) // TileSize
+        numTiles = tilesPerRow * tilesPerCol
+    with var:
+        ranges = new_seq[_TileRange](numWorkers)
+        jobs = new_seq[_RenderJob[W]](numWorkers)
+        threads = new_seq[Thread[ptr[_RenderJob[W]]]](numWorkers)
+
+    for i in range(numWorkers):
+        ranges[i].next.store(int32(i * numTiles // numWorkers), moRelaxed)
+        ranges[i].stop = int32((i + 1) * numTiles // numWorkers)
+        jobs[i] = setup
+        jobs[i].ranges = cast[ptr[UncheckedArray[_TileRange]]](addr(ranges[0]))
+        jobs[i].numWorkers = numWorkers
+        jobs[i].id = i
+
+    # The calling thread works as worker 0
+    for i in range(1, numWorkers):
+        createThread(threads[i], _renderWorker[W], addr(jobs[i]))
+    _renderWorker(addr(jobs[0]))
+    for i in range(1, numWorkers):
+        joinThread(threads[i])
+
+def renderParallel[W](canvas: mut @ Canvas, cam: Camera, world: W, max_depth: nint, numThreads = 0,
+                      roulette_depth = NoRussianRoulette, sampler = SamplerKind.samplerRandom):
+    ## Multi-threaded tile renderer.
+    ## `numThreads` of 0 uses one thread per core.
+    ## `world` is shared read-only by all threads.
+    _renderTiles(_RenderJob[W](
+        canvas = addr(canvas), cam = unsafe_addr(cam), world = unsafe_addr(world),
+        max_depth = max_depth, roulette_depth = roulette_depth, sampler = sampler
+    ), numThreads)
+
+def renderAdaptive[W](canvas: mut @ Canvas, cam: Camera, world: W, max_depth: nint,
+                      settings: AdaptiveSampling, sampleCounts: mut @ seq[int32],
+                      numThreads = 0, roulette_depth = NoRussianRoulette):
+    ## Multi-threaded tile renderer with adaptive sampling,
+    ## between `settings.minSamples` and `canvas.samples_per_pixel` samples per pixel.
+    ## The number of samples of each pixel is written to `sampleCounts`, in row-major order,
+    ## see `exportSampleHeatmap`.
+    assert settings.minSamples >= 2 and settings.minSamples <= canvas.samples_per_pixel
+    sampleCounts.set_len(canvas.nrows * canvas.ncols)
+    _renderTiles(_RenderJob[W](
+        canvas = addr(canvas), cam = unsafe_addr(cam), world = unsafe_addr(world),
+        max_depth = max_depth, roulette_depth = roulette_depth,
+        adaptive = unsafe_addr(settings),
+        sampleCounts = cast[ptr[UncheckedArray[int32]]](addr(sampleCounts[0]))
+    ), numThreads)
+
+def renderPass[W](prog: mut @ Progressive, canvas: mut @ Canvas, cam: Camera, world: W, max_depth: nint,
+                  samples: nint, numThreads = 0, roulette_depth = NoRussianRoulette):
+    ## Multi-threaded pass adding `samples` samples to every pixel of `prog`,
+    ## then resolved into `canvas`
+    assert canvas.nrows == prog.nrows and canvas.ncols == prog.ncols
+    _renderTiles(_RenderJob[W](
+        canvas = addr(canvas), cam = unsafe_addr(cam), world = unsafe_addr(world),
+        max_depth = max_depth, roulette_depth = roulette_depth,
+        progressive = addr(prog), passSamples = samples
+    ), numThreads)
+    prog.samples += int32(samples)
+    prog.passes += 1
+    prog.resolve(canvas)
+
+#iterator
+def renderProgressive[W](prog: mut @ Progressive, canvas: mut @ Canvas, cam: Camera, world: W, max_depth: nint,
+                         budget: ProgressiveBudget, numThreads = 0, roulette_depth = NoRussianRoulette) -> int32:
+    ## Renders passes of `budget.samplesPerPass` until a stop condition of `budget` is met.
+    ## Yields the samples per pixel so far after each pass,
+    ## `canvas` then holds the preview. `prog` may already hold samples.
+    assert budget.samplesPerPass > 0
+    with let:
+        start = get_mono_time()
+    with var:
+        lastPass = Duration()
+    while True:
+        if budget.maxSamples > 0 and prog.samples >= budget.maxSamples:
+            break
+        if budget.relativeError > 0.0 and prog.meanRelativeError() <= budget.relativeError:
+            break
+        if budget.time > Duration() and get_mono_time() - start + lastPass > budget.time:
+            break
+        with let:
+            passStart = get_mono_time()
+            samples = min(budget.samplesPerPass, budget.maxSamples - prog.samples) if budget.maxSamples > 0 else budget.samplesPerPass
+        renderPass(prog, canvas, cam, world, max_depth, samples, numThreads, roulette_depth)
+        lastPass = get_mono_time() - passStart
+        yield prog.samples
+
+
+# Wavefront rendering
+# ------------------------------------------------------------------------
+# Instead of tracing one path to the end before starting the next one,
+# a batch of pixels advances one bounce at a time: all the rays of the batch
+# are intersected, the hits are grouped by material kind and each group
+# is scattered together, then the surviving rays loop.
+# Consecutive calls run the same code on similar data,
+# which is friendlier to the caches and the branch predictor.
+#
+# Each pixel keeps its own RNG, seeded like `_renderPixel`,
+# and consumes it in the same order: the output is bit-identical to `render`.
+
+with const:
+    WavefrontBatchSize = 256    # Pixels per batch, one tile
+    _MaterialKinds = [MaterialKind.kLambertian, MaterialKind.kMetal, MaterialKind.kDielectric]
+
+class _Path(Object):
+    ## Current sample of a pixel of the batch
+    ray: Ray
+    throughput: Attenuation
+    pixel: Color                # Sum of the samples
+    rng: Rng
+    row: int32
+    col: int32
+
+class _Wavefront(Object):
+    paths: seq[_Path]
+    recs: seq[HitRecord]
+    active: seq[int32]                          # Paths still bouncing
+    groups: array[MaterialKind, seq[int32]]     # Paths that hit a surface, by material kind
+
+def _traceBatch[W](wave: mut @ _Wavefront, canvas: mut @ Canvas, cam: Camera, world: W,
+                   max_depth: nint, roulette_depth: nint):
+    ## Render all the samples of the pixels of the batch, then empty it
+    for _ in range(canvas.samples_per_pixel):
+        # Camera rays
+        wave.active.set_len(0)
+        for i in range(len(wave.paths)):
+            with template_inline:
+                """{.dirty.}"""
+                path = wave.paths[i]
+            with let:
+                u = (float64(path.col) + random(path.rng, float64)) / float64(canvas.ncols - 1)
+                v = (float64(path.row) + random(path.rng, float64)) / float64(canvas.nrows - 1)
+            path.ray = cam.ray(u, v, path.rng)
+            path.throughput = attenuation(1.0, 1.0, 1.0)
+            wave.active.add(int32(i))
+
+        for depth in range(max_depth):
+            if roulette_depth >= 0 and depth >= roulette_depth:
+                with var: survivors = 0
+                for k in range(len(wave.active)):
+                    with let: i = wave.active[k]
+                    if _russianRoulette(wave.paths[i].throughput, wave.paths[i].rng):
+                        wave.active[survivors] = i
+                        survivors += 1
+                wave.active.set_len(survivors)
+            if len(wave.active) == 0:
+                break
+
+            # Intersect, escaped rays collect the sky
+            for kind in _MaterialKinds:
+                wave.groups[kind].set_len(0)
+            for i in wave.active:
+                with template_inline:
+                    """{.dirty.}"""
+                    path = wave.paths[i]
+                if world.hit(path.ray, 0.001, inf, wave.recs[i]):
+                    wave.groups[world.materials[wave.recs[i].materialId].kind].add(i)
+                else:
+                    with var:
+                        sky = _background(path.ray)
+                    sky *= path.throughput
+                    path.pixel += sky
+
+            # Scatter one material kind at a time, absorbed rays are dropped
+            wave.active.set_len(0)
+            for kind in _MaterialKinds:
+                for i in wave.groups[kind]:
+                    with template_inline:
+                        """{.dirty.}"""
+                        path = wave.paths[i]
+                    with var:
+                        materialAttenuation = attenuation()
+                        scattered = Ray()
+                    if scatter(world.materials[wave.recs[i].materialId], path.ray, wave.recs[i],
+                               path.rng, materialAttenuation, scattered):
+                        path.throughput *= materialAttenuation
+                        path.ray = scattered
+                        wave.active.add(i)
+        # Rays still bouncing after max_depth contribute nothing, like in `radiance`
+
+    for i in range(len(wave.paths)):
+        draw(canvas, nint(wave.paths[i].row), nint(wave.paths[i].col), wave.paths[i].pixel)
+    wave.paths.set_len(0)
+
+def renderWavefront[W](canvas: mut @ Canvas, cam: Camera, world: W, max_depth: nint,
+                       batchSize = WavefrontBatchSize, roulette_depth = NoRussianRoulette):
+    ## Single-threaded wavefront renderer, bit-identical to `render`.
+    ## Pixels are batched tile by tile, `batchSize` pixels per batch.
+    with var:
+        wave = _Wavefront()
+    wave.paths = new_seq_of_cap[_Path](batchSize)
+    wave.recs = new_seq[HitRecord](batchSize)
+    wave.active = new_seq_of_cap[int32](batchSize)
+    for kind in _MaterialKinds:
+        wave.groups[kind] = new_seq_of_cap[int32](batchSize)
+
+    for row0 in countup(0, canvas.nrows - 1, TileSize):
+        for col0 in countup(0, canvas.ncols - 1, TileSize):
+            for row in range(row0, min(row0 + TileSize, canvas.nrows)):
+                for col in range(col0, min(col0 + TileSize, canvas.ncols)):
+                    with var:
+                        path = _Path(row = int32(row), col = int32(col), pixel = color(0, 0, 0))
+                    path.rng.seed(row, col)
+                    wave.paths.add(path)
+                    if len(wave.paths) == batchSize:
+                        _traceBatch(wave, canvas, cam, world, max_depth, roulette_depth)
+    if len(wave.paths) > 0:
+        _traceBatch(wave, canvas, cam, world, max_depth, roulette_depth)
 
 
 # Trace of Radiance
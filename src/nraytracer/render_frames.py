@@ -0,0 +1,177 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+
+from __future__ import annotations
+from nimic.ntypes import *
+
+from nimic.std.atomics import *
+from nimic.std.locks import *
+from nimic.std.cpuinfo import countProcessors
+from nimic.std.typedthreads import *
+from primitives import Canvas, newCanvas
+from cameras import Camera
+from hittables import BVH
+from render import render, NoRussianRoulette
+from scenes_animated import Animation, frames
+
+# Frame-parallel animation rendering
+# ------------------------------------------------------------------------
+# Frames only depend on the physics of the animation, which is cheap.
+# The calling thread steps the animation and snapshots each frame
+# (camera and a copy of the refit BVH) into a slot of a FramePool;
+# worker threads render whole frames, one frame per thread, each into
+# the canvas of its slot. Finished frames are handed back to the caller
+# strictly in order: the slots are a bounded reorder buffer, a slot is only
+# reused once its frame has been consumed, so at most `len(slots)` frames
+# are in flight and a slow frame holds back the submission of new ones.
+# Workers and the caller block on condition variables until the frame they
+# wait for is submitted or rendered, so handoffs don't wait for a polling tick.
+#
+# Each frame is rendered by `render`, the output is bit-identical
+# to the serial loop with `renderParallel`.
+
+class _FrameSlot(Object):
+    canvas: Canvas
+    cam: Camera
+    world: BVH
+    submitted: Atomic[int32]    # Last frame snapshotted into this slot
+    rendered: Atomic[int32]     # Last frame rendered in this slot
+
+class FramePool(Object):
+    ## Canvases and world snapshots of the frames in flight, reused across frames
+    slots: seq[_FrameSlot]
+
+def initFramePool(nrows: SomeInteger, ncols: SomeInteger,
+                  samples_per_pixel: SomeInteger, gamma_correction: SomeFloat,
+                  framesInFlight: nint) -> FramePool:
+    ## A few more frames in flight than render threads keep the threads busy
+    ## while the oldest frame is consumed.
+    assert framesInFlight > 0
+    result = FramePool()
+    result.slots = new_seq[_FrameSlot](framesInFlight)
+    for slot in result.slots.mitems:
+        slot.canvas = newCanvas(nrows, ncols, samples_per_pixel, gamma_correction)
+    return result
+
+def delete(pool: mut @ FramePool):
+    for slot in pool.slots.mitems:
+        slot.canvas.delete()
+
+class _FrameJob(Object):
+    slots: ptr[UncheckedArray[_FrameSlot]]
+    numSlots: nint
+    nextFrame: Atomic[int32]    # Next frame to claim by a worker
+    closed: Atomic[bool]        # No more frames
+    max_depth: nint
+    roulette_depth: nint
+    lock: Lock                  # Guards the updates of `submitted`, `rendered` and `closed`
+    submittedCond: Cond         # A frame was submitted or the job closed
+    renderedCond: Cond          # A frame was rendered
+
+def _frameWorker(job: ptr[_FrameJob]):
+    """{.thread.}"""
+    while True:
+        with let:
+            frame = fetchAdd(job.nextFrame, 1, moRelaxed)
+        with template_inline:
+            """{.dirty.}"""
+            slot = job.slots[frame % job.numSlots]
+        acquire(job.lock)
+        while slot.submitted.load(moAcquire) != frame:
+            # All submitted frames are consumed before closing
+            if job.closed.load(moAcquire):
+                release(job.lock)
+                return
+            wait(job.submittedCond, job.lock)
+        release(job.lock)
+        render(slot.canvas, slot.cam, slot.world.list(), job.max_depth, job.roulette_depth)
+        acquire(job.lock)
+        slot.rendered.store(frame, moRelease)
+        signal(job.renderedCond)
+        release(job.lock)
+
+def _waitRendered(job: mut @ _FrameJob, slot: mut @ _FrameSlot, frame: nint):
+    acquire(job.lock)
+    while slot.rendered.load(moAcquire) != frame:
+        wait(job.renderedCond, job.lock)
+    release(job.lock)
+
+class _ReturnFrame(NTuple):
+    sceneID: nint
+    canvas: ptr[Canvas]
+
+#iterator
+def renderFrames(pool: mut @ FramePool, anim: mut @ Animation, skip: int, max_depth: nint,
+                 numThreads = 0, roulette_depth = NoRussianRoulette, firstFrame = 0) -> _ReturnFrame:
+    ## Renders the frames of `anim` on `numThreads` threads, one frame per thread,
+    ## and yields them in order. `numThreads` of 0 uses one thread per core.
+    ## Frames before `firstFrame` only advance the physics, they are neither rendered nor yielded.
+    ## ⚠ `canvas` is a view, valid until the next frame
+    with let:
+        numWorkers = countProcessors() if numThreads <= 0 else numThreads
+        numSlots = len(pool.slots)
+    with var:
+        job = _FrameJob(
+            slots = cast[ptr[UncheckedArray[_FrameSlot]]](addr(pool.slots[0])),
+            numSlots = numSlots,
+            max_depth = max_depth, roulette_depth = roulette_depth
+        )
+        threads = new_seq[Thread[ptr[_FrameJob]]](numWorkers)
+        submitted = 0
+        consumed = 0
+        skipped = 0
+    for slot in pool.slots.mitems:
+        slot.submitted.store(-1, moRelaxed)
+        slot.rendered.store(-1, moRelaxed)
+    initLock(job.lock)
+    initCond(job.submittedCond)
+    initCond(job.renderedCond)
+    for i in range(numWorkers):
+        createThread(threads[i], _frameWorker, addr(job))
+
+    try:
+        for cam, _ in frames(anim, skip=skip):
+            if skipped < firstFrame:
+                skipped += 1
+                continue
+            if submitted - consumed == numSlots:
+                # Reorder buffer full: hand over the oldest frame to free its slot
+                with template_inline:
+                    """{.dirty.}"""
+                    oldest = pool.slots[consumed % numSlots]
+                _waitRendered(job, oldest, consumed)
+                yield _ReturnFrame(sceneID = firstFrame + consumed, canvas = addr(oldest.canvas))
+                consumed += 1
+
+            with template_inline:
+                """{.dirty.}"""
+                slot = pool.slots[submitted % numSlots]
+            slot.cam = cam
+            anim.copyWorld(slot.world)
+            acquire(job.lock)
+            slot.submitted.store(int32(submitted), moRelease)
+            broadcast(job.submittedCond)
+            release(job.lock)
+            submitted += 1
+
+        while consumed < submitted:
+            with template_inline:
+                """{.dirty.}"""
+                oldest = pool.slots[consumed % numSlots]
+            _waitRendered(job, oldest, consumed)
+            yield _ReturnFrame(sceneID = firstFrame + consumed, canvas = addr(oldest.canvas))
+            consumed += 1
+    finally:
+        acquire(job.lock)
+        job.closed.store(True, moRelease)
+        broadcast(job.submittedCond)
+        release(job.lock)
+        for i in range(numWorkers):
+            joinThread(threads[i])
+        deinitCond(job.renderedCond)
+        deinitCond(job.submittedCond)
+        deinitLock(job.lock)
@@ -12,10 +12,11 @@ from math import pi, sqrt, sin, cos
 # Internal
 from primitives import Vec3, vec3, UnitVector, Attenuation, attenuation
 from rng import Rng
+from qmc import QmcSampler
 
-import rng
+import rng, qmc
 with export:
-    rng
+    rng, qmc
 
 # Random routines
 # ------------------------------------------------------
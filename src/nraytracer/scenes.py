@@ -16,7 +16,7 @@ from sampling import Rng, random
 
 def random_scene(rng: mut @ Rng) -> Scene:
     result = Scene()
-    with let: ground_material = lambertian(attenuation(0.5, 0.5, 0.5))
+    with let: ground_material = result.addMaterial(lambertian(attenuation(0.5, 0.5, 0.5)))
     result.add(sphere(point3(0, -1000, 0), 1000.0, ground_material))
 
     for a in range(-11, 11):
@@ -34,7 +34,7 @@ def random_scene(rng: mut @ Rng) -> Scene:
                     # Diffuse
                     with let:
                         albedo = random(rng, Attenuation) * random(rng, Attenuation)
-                        sphere_material = lambertian(albedo)
+                        sphere_material = result.addMaterial(lambertian(albedo))
                         center2 = center + vec3(0, random(rng, float64, 0.5), 0)
                     result.add(movingSphere(
                                 center, CTime(0.0),
@@ -45,16 +45,16 @@ def random_scene(rng: mut @ Rng) -> Scene:
                     with let:
                         albedo = random(rng, Attenuation, 0.5, 1.0)
                         fuzz = random(rng, float64, 0.5)
-                        sphere_material = metal(albedo, fuzz)
+                        sphere_material = result.addMaterial(metal(albedo, fuzz))
                     result.add(sphere(center, 0.2, sphere_material))
                 else:
                     # Glass
-                    with let: sphere_material = dielectric(1.5)
+                    with let: sphere_material = result.addMaterial(dielectric(1.5))
                     result.add(sphere(center, 0.2, sphere_material))
 
-    result.add(sphere(point3(0,1,0), 1.0, dielectric(1.5)))
-    result.add(sphere(point3(-4,1,0), 1.0, lambertian(attenuation(0.4, 0.2, 0.1))))
-    result.add(sphere(point3(4,1,0), 1.0, metal(attenuation(0.7, 0.6, 0.5), fuzz = 0.0)))
+    result.add(sphere(point3(0,1,0), 1.0, result.addMaterial(dielectric(1.5))))
+    result.add(sphere(point3(-4,1,0), 1.0, result.addMaterial(lambertian(attenuation(0.4, 0.2, 0.1)))))
+    result.add(sphere(point3(4,1,0), 1.0, result.addMaterial(metal(attenuation(0.7, 0.6, 0.5), fuzz = 0.0))))
     return result
 
 if comptime(__name__=="__main__"):
@@ -16,6 +16,7 @@ from cameras import *
 from core import *
 from primitives import *
 from sampling import *
+from checkpoints import CheckpointWriter, CheckpointReader, writeValue, writeSeq, readValue, readSeq
 
 # Animated scene from book 1
 # ------------------------------------------------------------------------
@@ -80,7 +81,7 @@ class _MovingSphere(Object):
     x: float64
     z: float64
     radius: float64
-    material: Material
+    materialId: uint16
 
 class Animation(Object):
     _nrows: int32
@@ -97,6 +98,11 @@ class Animation(Object):
     _t: ATime
     _lookFromAngle: Radians
     _movingSpheres: seq[_MovingSphere]
+    _materials: MaterialTable   # Materials of the moving spheres
+
+    # Persistent scene, updated in place by `frames`
+    _scene: Scene
+    _bvh: BVH
 
     def _stepCamera(self: mut @ Animation):
         self._lookFromAngle -= Radians(2.0 * pi / 1200.0)
@@ -118,6 +124,96 @@ class Animation(Object):
         self._stepCamera()
         self._stepPhysics()
 
+    def _camera(self: Animation) -> Camera:
+        with const: r = sqrt(200.0)
+        with let:
+            aspect_ratio = self._ncols / self._nrows # truediv of two ints
+            lookFrom = point3(
+                r * cos(float64(self._lookFromAngle)),
+                2.0,
+                r * sin(float64(self._lookFromAngle))
+            )
+        return camera(
+            lookFrom,
+            lookAt = point3(4, 1, 0),
+            view_up = vec3(0,1,0),
+            vertical_field_of_view = Degrees(20),
+            aspect_ratio = aspect_ratio,
+            aperture = 0.1,
+            focus_distance = 10.0
+        )
+
+    def _fillScene(self: Animation, scene: mut @ Scene):
+        ## Layout: ground, then the moving spheres in order, then the big spheres
+        scene.clear()
+        scene.materials = self._materials
+
+        # Ground
+        scene.add(sphere(point3(0,-1000,0), 1000.0, scene.addMaterial(lambertian(attenuation(0.5,0.5,0.5)))))
+
+        # Moving spheres
+        for i in range(self._movingSpheres.len): # TODO: Change when Nim iterators speed fix https://github.com/nim-lang/Nim/issues/14421
+            with template_inline:
+                """{.dirty.}"""
+                _sph = self._movingSpheres[i]
+            scene.add(sphere( # Poor man's closure with "y" as the only dynamic param
+                point3(_sph.x, float64(_sph.pos_y), _sph.z),
+                _sph.radius,
+                _sph.materialId
+            ))
+
+        # Big spheres
+        scene.add(sphere(point3(0,1,0), 1.0, scene.addMaterial(dielectric(1.5))))
+        scene.add(sphere(point3(-4,1,0), 1.0, scene.addMaterial(lambertian(attenuation(0.4, 0.2, 0.1)))))
+        scene.add(sphere(point3(4,1,0), 1.0, scene.addMaterial(metal(attenuation(0.7, 0.6, 0.5), fuzz = 0.0))))
+
+    def _updateScene(self: mut @ Animation):
+        ## Build the persistent scene and its BVH on the first call,
+        ## afterwards only move the sphere centers and refit the BVH.
+        if len(self._scene.objects) == 0:
+            self._fillScene(self._scene)
+            self._bvh = self._scene.bvh(mode = BVHBuildMode.bvhSAH)
+            return
+        for i in range(self._movingSpheres.len):
+            self._scene.objects[1 + i].fSphere.center.y = float64(self._movingSpheres[i].pos_y)
+        self._bvh.refit(self._scene.objects, CTime(0.0), CTime(1.0))
+
+    def copyWorld(self: Animation, dst: mut @ BVH):
+        ## Copy the world of the current frame, within `frames`,
+        ## to render it while the animation advances
+        dst <<= self._bvh
+
+    def writeState(self: Animation, w: mut @ CheckpointWriter):
+        ## Save the time-dependent state and the BVH topology, within `frames`
+        assert len(self._bvh.nodes) > 0, "The scene is built by the first frame"
+        w.writeValue(self._t)
+        w.writeValue(self._lookFromAngle)
+        w.writeSeq(self._movingSpheres)
+        w.writeSeq(self._bvh.nodes)
+        w.writeSeq(self._bvh.indices)
+
+    def readState(self: mut @ Animation, r: mut @ CheckpointReader):
+        ## Restore a state saved by `writeState` into an animation
+        ## created by `random_moving_spheres` with the same seed and parameters,
+        ## `frames` then continues from the saved frame without replaying the physics.
+        ## The BVH keeps the topology it was built with on the first frame
+        ## and is refit, so the world is the same as in an uninterrupted run.
+        with let: count = len(self._movingSpheres)
+        r.readValue(self._t)
+        r.readValue(self._lookFromAngle)
+        r.readSeq(self._movingSpheres)
+        doAssert(len(self._movingSpheres) == count, "Checkpoint of a different animation")
+
+        self._fillScene(self._scene)
+        self._bvh = BVH(
+            objects = new_seq[HittableVariant](len(self._scene.objects)),
+            materials = self._scene.materials.entries
+        )
+        r.readSeq(self._bvh.nodes)
+        r.readSeq(self._bvh.indices)
+        doAssert(len(self._bvh.indices) == len(self._bvh.objects), "Checkpoint of a different animation")
+        self._bvh.refit(self._scene.objects, CTime(0.0), CTime(1.0))
+
 def random_moving_spheres(
        rng: mut @ Rng,
        height: int32, width: int32,
@@ -154,7 +250,7 @@ def random_moving_spheres(
                       pos_y=_Distance(center.y),
                       z=center.z,
                       radius=SmallRadius,
-                      material=material(lambertian(albedo))
+                      materialId=result._materials.add(lambertian(albedo))
                   ))
               elif choose_mat < 0.95:
                   # Metal
@@ -168,7 +264,7 @@ def random_moving_spheres(
                       pos_y=_Distance(center.y),
                       z=center.z,
                       radius=SmallRadius,
-                      material=material(metal(albedo, fuzz))
+                      materialId=result._materials.add(metal(albedo, fuzz))
                   ))
               else:
                   # Glass
@@ -179,7 +275,7 @@ def random_moving_spheres(
                       pos_y=_Distance(center.y),
                       z=center.z,
                       radius=SmallRadius,
-                      material=material(dielectric(refraction_index = 1.5))
+                      materialId=result._materials.add(dielectric(refraction_index = 1.5))
                   ))
   return result
 	
@@ -190,8 +286,8 @@ class _ReturnScenes(NTuple):
 
 #iterator 
 def scenes(anim: mut @ Animation, skip: int) -> _ReturnScenes:
-    with let: aspect_ratio = anim._ncols / anim._nrows # truediv of two ints
-
+    ## Yields a freshly built Scene per frame,
+    ## prefer `frames` to render the animation.
     # Skip
     while anim._t < anim._t_min:
         anim.step()
@@ -199,46 +295,30 @@ def scenes(anim: mut @ Animation, skip: int) -> _ReturnScenes:
     while anim._t < anim._t_max:
         with var: 
             result = _ReturnScenes()
-        
-        def _block():
-            with const: r = sqrt(200.0)
-            with let: lookFrom = point3(
-                r * cos(float64(anim._lookFromAngle)),
-                2.0,
-                r * sin(float64(anim._lookFromAngle))
-            )
-            return camera(
-                lookFrom,
-                lookAt = point3(4, 1, 0),
-                view_up = vec3(0,1,0),
-                vertical_field_of_view = Degrees(20),
-                aspect_ratio = aspect_ratio,
-                aperture = 0.1,
-                focus_distance = 10.0
-            )
-        result.cam = _block()
-
-
-        # Ground
-        result.scene.add(sphere(point3(0,-1000,0), 1000.0, lambertian(attenuation(0.5,0.5,0.5))))
+        result.cam = anim._camera()
+        anim._fillScene(result.scene)
+        yield result
 
-        # Moving spheres
-        for i in range(anim._movingSpheres.len): # TODO: Change when Nim iterators speed fix https://github.com/nim-lang/Nim/issues/14421
-            with template_inline:
-                """{.dirty.}"""
-                _sph = anim._movingSpheres[i]
-            result.scene.add(sphere( # Poor man's closure with "y" as the only dynamic param
-                point3(_sph.x, float64(_sph.pos_y), _sph.z),
-                _sph.radius,
-                _sph.material
-            ))
+        for _ in range(skip):
+            anim.step()
 
-        # Big spheres
-        result.scene.add(sphere(point3(0,1,0), 1.0, dielectric(1.5)))
-        result.scene.add(sphere(point3(-4,1,0), 1.0, lambertian(attenuation(0.4, 0.2, 0.1))))
-        result.scene.add(sphere(point3(4,1,0), 1.0, metal(attenuation(0.7, 0.6, 0.5), fuzz = 0.0)))
+class _ReturnFrames(NTuple):
+    cam: Camera
+    world: BVHList
+
+#iterator
+def frames(anim: mut @ Animation, skip: int) -> _ReturnFrames:
+    ## Yields the camera and the world of each frame.
+    ## The scene and its BVH persist across frames: sphere centers are updated in place
+    ## and the BVH is refit, so there is no allocation after the first frame.
+    ## ⚠ `world` is a view, valid until the next frame
+    # Skip
+    while anim._t < anim._t_min:
+        anim.step()
 
-        yield result
+    while anim._t < anim._t_max:
+        anim._updateScene()
+        yield _ReturnFrames(cam = anim._camera(), world = anim._bvh.list())
 
         for _ in range(skip):
             anim.step()
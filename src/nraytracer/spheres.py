@@ -9,15 +9,18 @@ from __future__ import annotations
 from nimic.ntypes import *
 
 from math import sqrt
-from core import HitRecord, Material, material
-from primitives import Point3, Ray
+from core import HitRecord
+from primitives import Point3, Ray, vec3, CTime
+from aabbs import AABB, aabb
 
 class Sphere(Object):
     center: Point3
     radius: float64
-    material: Material
+    materialId: uint16
 
-    def hit(self: Sphere, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+    def intersect(self: Sphere, r: Ray, t_min: float64, t_max: float64, t: mut @ float64) -> bool:
+        """{.inline, noSideEffect.}"""
+        ## Nearest intersection in (t_min, t_max) without building the hit record
         with let:
             oc = r.origin - self.center
             a = r.direction.length_squared()
@@ -27,55 +30,50 @@ class Sphere(Object):
 
         if discriminant > 0:
             with let: root = sqrt(discriminant)
-
-            # @template
-            # def checkSol(root: untyped) -> untyped:
-            #     """{.dirty.}"""
-            #     with block:
-            #         with let: sol = root
-            #         if t_min < sol and sol < t_max:
-            #             rec.t = sol
-            #             rec.p = r.at(rec.t)
-            #             with let: outward_normal = (rec.p - self.center) / self.radius
-            #             rec.set_face_normal(r, outward_normal)
-            #             rec.material = self.material
-            #             return True
-            # checkSol((-half_b - root)/a)
-            # checkSol((-half_b + root)/a)
             with block:
                 with let: sol = (-half_b - root)/a
                 if t_min < sol and sol < t_max:
-                    rec.t = sol
-                    rec.p = r.at(rec.t)
-                    with let: outward_normal = (rec.p - self.center) / self.radius
-                    rec.set_face_normal(r, outward_normal)
-                    rec.material = self.material
+                    t <<= sol
                     return True
             with block:
                 with let: sol = (-half_b + root)/a
                 if t_min < sol and sol < t_max:
-                    rec.t = sol
-                    rec.p = r.at(rec.t)
-                    with let: outward_normal = (rec.p - self.center) / self.radius
-                    rec.set_face_normal(r, outward_normal)
-                    rec.material = self.material
+                    t <<= sol
                     return True
         return False
 
-@dispatch
-def sphere(center: Point3, radius: float64, material: Material) -> Sphere:
+    def setHitRecord(self: Sphere, r: Ray, t: float64, rec: mut @ HitRecord):
+        """{.inline, noSideEffect.}"""
+        ## Surface interaction at `t`, a result of `intersect`
+        rec.t = t
+        rec.p = r.at(t)
+        with let: outward_normal = (rec.p - self.center) / self.radius
+        rec.set_face_normal(r, outward_normal)
+        rec.materialId = self.materialId
+
+    def hit(self: Sphere, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.inline, noSideEffect.}"""
+        with var: t = 0.0
+        if self.intersect(r, t_min, t_max, t):
+            self.setHitRecord(r, t, rec)
+            return True
+        return False
+
+    def bounding_box(self: Sphere, time0: CTime, time1: CTime) -> AABB:
+        """{.inline, noSideEffect.}"""
+        ## A static sphere has the same box over the whole shutter interval
+        with let: r = vec3(self.radius, self.radius, self.radius)
+        return aabb(self.center - r, self.center + r)
+
+def sphere(center: Point3, radius: float64, materialId: uint16) -> Sphere:
     """{.inline.}"""
+    ## `materialId` comes from the MaterialTable of the scene, see Scene.addMaterial
     result = Sphere()
     result.center = center
     result.radius = radius
-    result.material = material
+    result.materialId = materialId
     return result
 
-@dispatch
-def sphere[T](center: Point3, radius: float64, materialKind: T) -> Sphere:
-    """{.inline.}"""
-    return sphere(center, radius, material(materialKind))
-
 # Sanity checks
 # -----------------------------------------------------
 
@@ -0,0 +1,209 @@
+# Python NDSL Raytracer
+# Copyright (c) 2025 Dmytro Makogon, see LICENSE (MIT or Apache 2.0, as an option)
+# The project is mostly a port of Trace of Radiance (https://github.com/mratsim/trace-of-radiance, see below)
+# /// nimic
+#
+# ///
+
+from __future__ import annotations
+from nimic.ntypes import *
+
+# Stdlib
+from math import sqrt, inf
+# Internals
+from core import HitRecord, Material
+from primitives import Point3, Ray, point3, CTime
+from hittables_variants import HittableVariant, HittableVariantKind
+
+# Structure-of-arrays spheres
+# ------------------------------------------------------------------------------------------
+# HittableList stores HittableVariant tagged unions: each test branches on the kind
+# and loads the whole union. The stock scenes only contain spheres,
+# so SphereSoA stores their fields in separate contiguous arrays instead
+# and tests a ray against `lanes` spheres per iteration with straight-line code
+# (no branch, conditional selects only) that the C compiler can auto-vectorize.
+#
+# Static spheres are stored as moving spheres with no motion.
+# Results are identical to HittableList: same arithmetic, same closest hit.
+
+with const:
+    SoALanes = 8    # Spheres per batch of the default `hit`
+
+def _view[T](s: seq[T]) -> ptr[UncheckedArray[T]]:
+    """{.inline.}"""
+    return cast[ptr[UncheckedArray[T]]](unsafe_addr(s[0]))
+
+class SphereSoAList(Object):
+    ## A view over the arrays of a SphereSoA
+    ## ⚠: lifetime
+    len: nint
+    centerX: ptr[UncheckedArray[float64]]   # Center at time0
+    centerY: ptr[UncheckedArray[float64]]
+    centerZ: ptr[UncheckedArray[float64]]
+    motionX: ptr[UncheckedArray[float64]]   # center1 - center0, 0 for static spheres
+    motionY: ptr[UncheckedArray[float64]]
+    motionZ: ptr[UncheckedArray[float64]]
+    time0: ptr[UncheckedArray[float64]]
+    duration: ptr[UncheckedArray[float64]]  # time1 - time0, 1 for static spheres
+    radius: ptr[UncheckedArray[float64]]
+    radius2: ptr[UncheckedArray[float64]]
+    materialId: ptr[UncheckedArray[uint16]]
+    materials: ptr[UncheckedArray[Material]]
+
+    def _center(self: SphereSoAList, i: nint, time: CTime) -> Point3:
+        """{.inline, noSideEffect.}"""
+        with let: s = (time - self.time0[i]) / self.duration[i]
+        return point3(
+            self.centerX[i] + s * self.motionX[i],
+            self.centerY[i] + s * self.motionY[i],
+            self.centerZ[i] + s * self.motionZ[i]
+        )
+
+    def _nearest(self: SphereSoAList, r: Ray, base: nint, lanes: static[int],
+                 t_min: float64, t_max: float64,
+                 closest_so_far: mut @ float64, closest: mut @ nint):
+        """{.inline, noSideEffect.}"""
+        ## Tests `lanes` spheres from `base` and updates the nearest hit
+        with var:
+            ts = array[lanes, float64]()
+        with let:
+            a = r.direction.length_squared()
+
+        # Independent lanes, no early exit: auto-vectorizable
+        for k in range(lanes):
+            with let:
+                i = base + k
+                s = (r.time - self.time0[i]) / self.duration[i]
+                ocX = r.origin.x - (self.centerX[i] + s * self.motionX[i])
+                ocY = r.origin.y - (self.centerY[i] + s * self.motionY[i])
+                ocZ = r.origin.z - (self.centerZ[i] + s * self.motionZ[i])
+                half_b = ocX * r.direction.x + ocY * r.direction.y + ocZ * r.direction.z
+                c = (ocX * ocX + ocY * ocY + ocZ * ocZ) - self.radius2[i]
+                discriminant = half_b*half_b - a*c
+                root = sqrt(max(discriminant, 0.0))
+                near = (-half_b - root)/a
+                far = (-half_b + root)/a
+                t = near if t_min < near and near < t_max else (far if t_min < far and far < t_max else inf)
+            ts[k] = t if discriminant > 0 else inf
+
+        # In order, so that ties keep the first sphere like the scalar scan
+        for k in range(lanes):
+            if ts[k] < closest_so_far:
+                closest_so_far <<= ts[k]
+                closest <<= base + k
+
+    def hitLanes(self: SphereSoAList, r: Ray, t_min: float64, t_max: float64,
+                 rec: mut @ HitRecord, lanes: static[int]) -> bool:
+        """{.noSideEffect.}"""
+        ## `hit` with a batch width of `lanes` spheres, the tail is tested one by one
+        with var:
+            closest_so_far = t_max
+            closest = -1
+        with let:
+            batched = self.len - self.len % lanes
+        for base in countup(0, batched - 1, lanes):
+            self._nearest(r, base, lanes, t_min, closest_so_far, closest_so_far, closest)
+        for i in range(batched, self.len):
+            self._nearest(r, i, 1, t_min, closest_so_far, closest_so_far, closest)
+
+        if closest < 0:
+            return False
+        rec.t = closest_so_far
+        rec.p = r.at(closest_so_far)
+        with let: outward_normal = (rec.p - self._center(closest, r.time)) / self.radius[closest]
+        rec.set_face_normal(r, outward_normal)
+        rec.materialId = self.materialId[closest]
+        return True
+
+    def hit(self: SphereSoAList, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.inline, noSideEffect.}"""
+        return self.hitLanes(r, t_min, t_max, rec, SoALanes)
+
+class SphereSoA(Object):
+    ## The spheres of a Scene as a structure of arrays.
+    ## ⚠ not thread-safe
+    centerX: seq[float64]
+    centerY: seq[float64]
+    centerZ: seq[float64]
+    motionX: seq[float64]
+    motionY: seq[float64]
+    motionZ: seq[float64]
+    time0: seq[float64]
+    duration: seq[float64]
+    radius: seq[float64]
+    radius2: seq[float64]
+    materialId: seq[uint16]
+    materials: seq[Material]
+
+    def list(self: SphereSoA) -> SphereSoAList:
+        """{.inline, noSideEffect.}"""
+        assert len(self.radius) > 0
+        result = SphereSoAList()
+        result.len = len(self.radius)
+        result.centerX = _view(self.centerX)
+        result.centerY = _view(self.centerY)
+        result.centerZ = _view(self.centerZ)
+        result.motionX = _view(self.motionX)
+        result.motionY = _view(self.motionY)
+        result.motionZ = _view(self.motionZ)
+        result.time0 = _view(self.time0)
+        result.duration = _view(self.duration)
+        result.radius = _view(self.radius)
+        result.radius2 = _view(self.radius2)
+        result.materialId = _view(self.materialId)
+        result.materials = _view(self.materials)
+        return result
+
+    def hit(self: SphereSoA, r: Ray, t_min: float64, t_max: float64, rec: mut @ HitRecord) -> bool:
+        """{.inline, noSideEffect.}"""
+        return self.list().hit(r, t_min, t_max, rec)
+
+def buildSphereSoA(objects: openArray[HittableVariant], materials: openArray[Material]) -> SphereSoA:
+    ## Copy `objects`, spheres or moving spheres, in the same order
+    result = SphereSoA()
+    with let: n = len(objects)
+    result.centerX = new_seq[float64](n)
+    result.centerY = new_seq[float64](n)
+    result.centerZ = new_seq[float64](n)
+    result.motionX = new_seq[float64](n)
+    result.motionY = new_seq[float64](n)
+    result.motionZ = new_seq[float64](n)
+    result.time0 = new_seq[float64](n)
+    result.duration = new_seq[float64](n)
+    result.radius = new_seq[float64](n)
+    result.radius2 = new_seq[float64](n)
+    result.materialId = new_seq[uint16](n)
+
+    for i in range(n):
+        match objects[i].kind:
+            case HittableVariantKind.kSphere:
+                with template_inline:
+                    """{.dirty.}"""
+                    sph = objects[i].fSphere
+                result.centerX[i] = sph.center.x
+                result.centerY[i] = sph.center.y
+                result.centerZ[i] = sph.center.z
+                result.duration[i] = 1.0
+                result.radius[i] = sph.radius
+                result.materialId[i] = sph.materialId
+            case HittableVariantKind.kMovingSphere:
+                with template_inline:
+                    """{.dirty.}"""
+                    sph = objects[i].fMovingSphere
+                with let: motion = sph.center1 - sph.center0
+                result.centerX[i] = sph.center0.x
+                result.centerY[i] = sph.center0.y
+                result.centerZ[i] = sph.center0.z
+                result.motionX[i] = motion.x
+                result.motionY[i] = motion.y
+                result.motionZ[i] = motion.z
+                result.time0[i] = sph.time0
+                result.duration[i] = sph.time1 - sph.time0
+                result.radius[i] = sph.radius
+                result.materialId[i] = sph.materialId
+        result.radius2[i] = result.radius[i] * result.radius[i]
+
+    result.materials = new_seq[Material](len(materials))
+    for i in range(len(materials)):
+        result.materials[i] = materials[i]
+    return result
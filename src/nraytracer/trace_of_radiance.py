@@ -13,11 +13,12 @@ from nimic.std.monotimes import *
 from nimic.std.times import *
 from primitives import newCanvas, point3, vec3, CTime, Degrees
 from cameras import camera
-from hittables import Scene # this declaration should present because "list" function is defined in Scene
-from render import render
+from hittables import Scene # this declaration should present because "bvh" function is defined in Scene
+from render import renderParallel, renderAdaptive, AdaptiveSampling, NoRussianRoulette, \
+    ProgressiveBudget, initProgressive, renderProgressive, SamplerKind
 from scenes import random_scene
 from sampling import Rng
-from ppm import exportToPPM
+from ppm import exportToPPM, exportSampleHeatmap
 
 
 def main():
@@ -31,11 +32,22 @@ def main():
     The camera position, vertical field of view, aspect ratio, aperture, and shutter open/close times
     are all hard-coded.
 
-    The scene is rendered using the `render` function and the time it takes to render is measured using the
+    The scene is rendered on all cores using the `renderParallel` function and the time it takes to render is measured using the
     `get_mono_time` function.
 
     The rendered image is exported to the standard output using the `exportToPPM` function.
     The time it took to render is printed to the standard error using the `write` function.
+
+    With `--adaptive`, pixels stop sampling once converged (`renderAdaptive`),
+    `samples_per_pixel` becomes the maximum and the number of samples of each pixel
+    is written as a heatmap to `sample_counts.ppm`.
+
+    With `--progressive`, samples are accumulated in passes (`renderProgressive`)
+    until `samples_per_pixel` or the time budget is reached,
+    the preview after each pass is written to `preview.ppm`.
+
+    With `--sobol`, the samples are Owen-scrambled Sobol points (`QmcSampler`)
+    instead of independent random numbers: less noise for the same `samples_per_pixel`.
     """
     with const:
         aspect_ratio = 16.0 / 9.0
@@ -44,6 +56,13 @@ def main():
         samples_per_pixel = 100
         gamma_correction = 2.2
         max_depth = 50
+        roulette_depth = NoRussianRoulette # e.g. 5 for Russian roulette after 5 bounces
+        adaptive_settings = AdaptiveSampling(minSamples = 16, relativeError = 0.02)
+        progressive_budget = ProgressiveBudget(
+            samplesPerPass = 10,
+            maxSamples = samples_per_pixel,
+            time = init_duration(seconds = 60)
+        )
 
     with var:
         worldRNG = Rng()
@@ -51,6 +70,7 @@ def main():
 
     with let:
         world = random_scene(worldRNG)
+        worldBVH = world.bvh(CTime(0.0), CTime(1.0)) # matches the camera shutter
 
     with let:
         lookFrom = point3(13,2,3)
@@ -79,12 +99,44 @@ def main():
                )
 
     try:
-        with let: start = get_mono_time()
+        with let:
+            adaptive = paramCount() >= 1 and paramStr(1) == "--adaptive"
+            progressive = paramCount() >= 1 and paramStr(1) == "--progressive"
+            sobol = paramCount() >= 1 and paramStr(1) == "--sobol"
+            start = get_mono_time()
+        with var:
+            sampleCounts = seq[int32]()
         # init(Weave)
-        render(canvas, cam, world.list(), max_depth)
+        if adaptive:
+            renderAdaptive(canvas, cam, worldBVH.list(), max_depth, adaptive_settings, sampleCounts,
+                           roulette_depth = roulette_depth)
+        elif progressive:
+            with var:
+                prog = initProgressive(image_height, image_width)
+            for samples in renderProgressive(prog, canvas, cam, worldBVH.list(), max_depth, progressive_budget,
+                                             roulette_depth = roulette_depth):
+                with let: preview = open("preview.ppm", fmWrite)
+                try:
+                    exportToPPM(canvas, preview)
+                finally:
+                    preview.close()
+                stderr.write(f"\rPass {prog.passes}: {samples} samples per pixel")
+        else:
+            renderParallel(canvas, cam, worldBVH.list(), max_depth, roulette_depth = roulette_depth,
+                           sampler = SamplerKind.samplerSobol if sobol else SamplerKind.samplerRandom)
         # exit(Weave)
         with let: stop = get_mono_time()
         exportToPPM(canvas, stdout)
+        if adaptive:
+            with let: heatmap = open("sample_counts.ppm", fmWrite)
+            try:
+                exportSampleHeatmap(sampleCounts, canvas.nrows, canvas.ncols, samples_per_pixel, heatmap)
+            finally:
+                heatmap.close()
+            with var: total = 0
+            for n in sampleCounts:
+                total += n
+            stderr.write(f"\nAverage samples per pixel: {float64(total) / float64(len(sampleCounts)):.1f}")
         stderr.write("\nDone.\n")
         with let: elapsed = in_milliseconds(stop - start)
         stderr.write(f"Time spent: {float64(elapsed) * 1e-3:>6.3f} s\n")
@@ -12,24 +12,56 @@ from nimic.std.os import *
 from nimic.std.strformat import *
 from nimic.std.monotimes import *
 from nimic.std.times import *
+from nimic.std.cpuinfo import countProcessors
 from primitives import newCanvas, point3, vec3, CTime, Degrees
 from cameras import camera
-from hittables import Scene  # this declaration should present because "list" function is defined in Scene
-from render import render
-from scenes_animated import random_moving_spheres, scenes, ATime
+from hittables import BVHList  # this declaration should present because "hit" function is defined in BVHList
+from render import renderParallel, NoRussianRoulette, Progressive, ProgressiveBudget, initProgressive, \
+    renderProgressive, clear, writeState, readState
+from scenes_animated import Animation, random_moving_spheres, frames, ATime
+from render_frames import FramePool, initFramePool, renderFrames, delete
 from sampling import Rng
-from ppm import exportToPPM
+from ppm import exportToPPM, seriesFramePath, binaryPPMSize
+from checkpoints import CheckpointWriter, writeValue, readValue, saveCheckpoint, loadCheckpoint
+from color_conversions import initChannelDesc, canvas_to_ycbcr420, YCbCrKind
+from h264 import H264Encoder, init, getFrameBuffers, flushFrame, clearStream, finish
+from mp4 import MP4Muxer, initialize, writeFrame, close
 
 # Animated scene from book 1
 # ------------------------------------------------------------------------
 # This is an extra after book 1
 # An animated scene with a rudimentary physics engine
 # And either PPM series or MP4 output (video encoding in pure Nim!)
-# This does not incorporate motion blur from book 2 or acceleration structures
-# to speed up compute.
+# The MP4 output is produced in memory, without intermediate PPM or .264 files.
+# This does not incorporate motion blur from book 2,
+# the scene and its BVH are built once and updated in place every frame.
+#
+# The PPM series can be interrupted and resumed: frames are rendered in passes
+# and a checkpoint (accumulation buffer, RNG of every pixel, animation state)
+# is saved between passes every few minutes. On restart the checkpoint is restored,
+# frames already on disk are skipped, and the output is byte-identical
+# to an uninterrupted run.
+#
+# With `--frame-parallel` whole frames are rendered concurrently, one per thread,
+# and written or encoded in order (see render_frames), there is no checkpoint:
+# the PPM series resumes after the frames already on disk, and refuses to start
+# over the checkpoint of an interrupted serial run.
+
+def _checkpoint(path: string, sceneID: nint, animation: Animation, prog: Progressive):
+    with var:
+        w = CheckpointWriter()
+    w.writeValue(sceneID)
+    animation.writeState(w)
+    prog.writeState(w)
+    w.saveCheckpoint(path)
 
+def _frameDone(destDir: string, series: string, sceneID: nint, nrows: nint, ncols: nint) -> bool:
+    ## The frame was exported completely, a frame interrupted while written is rendered again
+    with let: path = seriesFramePath(destDir, series, sceneID)
+    return file_exists(path) and get_file_size(path) == binaryPPMSize(nrows, ncols)
 
-def main_animation_ppm():
+
+def main_animation_ppm(frameParallel = False):
     # Animation is an extra added at the end of the first book
     # it's slow, and defines its own moving spheres
     # that are different from the second book
@@ -41,6 +73,7 @@ def main_animation_ppm():
         samples_per_pixel = 300
         gamma_correction = 2.2
         max_depth = 50
+        roulette_depth = NoRussianRoulette # e.g. 5 for Russian roulette after 5 bounces
 
     with const:
         dt = 0.005
@@ -52,6 +85,11 @@ def main_animation_ppm():
         destDir = string("build") / "rendered16"
         series = "animation"
 
+    with const:
+        checkpointPath = destDir / (series + ".checkpoint")
+        checkpointInterval = init_duration(minutes = 5)
+        budget = ProgressiveBudget(samplesPerPass = 30, maxSamples = samples_per_pixel) # checkpoints between passes
+
     with var:
         worldRNG = Rng()
     worldRNG.seed(0xFACADE)
@@ -69,6 +107,7 @@ def main_animation_ppm():
             samples_per_pixel,
             gamma_correction
         )
+        prog = initProgressive(image_height, image_width)
 
     try:
         create_dir(destDir)
@@ -81,7 +120,43 @@ def main_animation_ppm():
         with var:
             sceneID = nint(0)
             elapsed = Duration()
-        for cam, scene in scenes(animation, skip=skip):
+            rgbBuffer = seq[uint8]() # reused by every frame export
+            lastCheckpoint = get_mono_time()
+        if frameParallel:
+            doAssert(not file_exists(checkpointPath),
+                     "Resume " + checkpointPath + " without --frame-parallel, or remove it to discard its progress")
+            # Frames are exported in order, those on disk are the first ones
+            while sceneID < totalScenes and _frameDone(destDir, series, sceneID, image_height, image_width):
+                sceneID += 1
+            if sceneID > 0:
+                stderr.write(f"\nResuming after {sceneID} frames on disk\n")
+            with var:
+                pool = initFramePool(image_height, image_width, samples_per_pixel, gamma_correction,
+                                     countProcessors() + 2)
+            try:
+                for frameID, frame in renderFrames(pool, animation, skip, max_depth, roulette_depth = roulette_depth,
+                                                   firstFrame = sceneID):
+                    exportToPPM(frame.contents, destDir, series, frameID, rgbBuffer)
+                    stderr.write(f"\rScenes remaining: {totalScenes - frameID - 1:>5}")
+                    stderr.flush_file()
+            finally:
+                pool.delete()
+            return
+
+        if file_exists(checkpointPath):
+            with var:
+                r = loadCheckpoint(checkpointPath)
+            r.readValue(sceneID)
+            animation.readState(r)
+            prog.readState(r)
+            stderr.write(f"\nResuming scene {sceneID} from {prog.samples} samples per pixel\n")
+
+        for cam, world in frames(animation, skip=skip):
+            if _frameDone(destDir, series, sceneID, image_height, image_width):
+                # Finished before an interruption, only the physics advance
+                prog.clear()
+                sceneID += 1
+                continue
             with let:
                 remaining = totalScenes - sceneID
                 timeSpent = in_seconds(elapsed)
@@ -90,20 +165,155 @@ def main_animation_ppm():
             stderr.flush_file()
             with let:
                 start = get_mono_time()
-            render(canvas, cam, scene.list(), max_depth)
+            for samples in renderProgressive(prog, canvas, cam, world, max_depth, budget, roulette_depth = roulette_depth):
+                if samples < samples_per_pixel and get_mono_time() - lastCheckpoint >= checkpointInterval:
+                    _checkpoint(checkpointPath, sceneID, animation, prog)
+                    lastCheckpoint = get_mono_time()
             # syncRoot(Weave)
-            exportToPPM(canvas, destDir, series, sceneID)
+            exportToPPM(canvas, destDir, series, sceneID, rgbBuffer)
 
+            prog.clear()
             sceneID += 1
             elapsed = get_mono_time() - start
 
+        if file_exists(checkpointPath):
+            remove_file(checkpointPath)
         # exit(Weave)
     finally:
         canvas.delete()
 
+@template_expand
+def main_animation_mp4(dumpPPM = False, frameParallel = False):
+    # Same animation as main_animation_ppm, streamed to MP4:
+    # each canvas is converted directly to YCbCr 4:2:0 into the encoder frame buffers,
+    # encoded and muxed right away, memory use doesn't depend on the animation length.
+    # With `dumpPPM` the frames are also written as a PPM series.
+    # With `frameParallel` the frames are rendered concurrently and encoded in order.
+    # An IDR frame every second, the frames in between only code the macroblocks
+    # that changed since the previous frame, the static background is P_Skip.
+    # The MP4 is fragmented, one fragment per GOP: if the render is interrupted,
+    # the frames muxed so far stay playable.
+    with const:
+        aspect_ratio = 16.0 / 9.0
+        image_width = 512 # so that we have multiples of 16 everywhere
+        image_height = int32(image_width / aspect_ratio)
+        samples_per_pixel = 300
+        gamma_correction = 2.2
+        max_depth = 50
+        roulette_depth = NoRussianRoulette # e.g. 5 for Russian roulette after 5 bounces
+
+    with const:
+        dt = 0.005
+        t_min = 0.0
+        t_max = 6.0
+        skip = 6  # Render every 6 physics update
+        fps = 30
+
+    with const:
+        destDir = string("build") / "rendered16"
+        series = "animation"
+
+    with var:
+        worldRNG = Rng()
+    worldRNG.seed(0xFACADE)
+
+    with var:
+        animation = random_moving_spheres(
+            worldRNG,
+            image_height, image_width,
+            ATime(dt), ATime(t_min), ATime(t_max)
+        )
+
+    with var:
+        canvas = newCanvas(
+            image_height, image_width,
+            samples_per_pixel,
+            gamma_correction
+        )
+
+    # Encoding
+    # ----------------------------------------------------------------------
+    with var:
+        encoder = init(H264Encoder, image_width, image_height, gopSize = fps)
+        rgbBuffer = seq[uint8]() # reused by every PPM dump
+    with let:
+        (Y, Cb, Cr) = getFrameBuffers(encoder)
+        yD = initChannelDesc(Y, image_width, subsampled=False)
+        uD = initChannelDesc(Cb, image_width, subsampled=True)
+        vD = initChannelDesc(Cr, image_width, subsampled=True)
+
+    create_dir(destDir)
+    with let:
+        mp4Path = destDir / (series + ".mp4")
+        mp4File = open(mp4Path, fmWrite)
+    with var:
+        muxer = MP4Muxer()
+    initialize(muxer, mp4File, int32(image_width), int32(image_height), fps, fragmented = True)
+
+    @template
+    def _encode(frame: untyped, frameID: untyped) -> untyped:
+        """{.dirty.}"""
+        # Video
+        canvas_to_ycbcr420(frame, yD, uD, vD, YCbCrKind.BT601)
+        flushFrame(encoder)
+        writeFrame(muxer, encoder.stream)
+        clearStream(encoder)
+
+        if dumpPPM:
+            exportToPPM(frame, destDir, series, frameID, rgbBuffer)
+
+    try:
+        with let:
+            totalScenes = nint((t_max - t_min) / (dt * skip))
+        stderr.write(f"Total scenes: {totalScenes}")
+
+        with var:
+            sceneID = nint(0)
+            elapsed = Duration()
+        if frameParallel:
+            with var:
+                pool = initFramePool(image_height, image_width, samples_per_pixel, gamma_correction,
+                                     countProcessors() + 2)
+            try:
+                for frameID, frame in renderFrames(pool, animation, skip, max_depth, roulette_depth = roulette_depth):
+                    _encode(frame.contents, frameID)
+                    stderr.write(f"\rScenes remaining: {totalScenes - frameID - 1:>5}")
+                    stderr.flush_file()
+            finally:
+                pool.delete()
+        else:
+            for cam, world in frames(animation, skip=skip):
+                with let:
+                    remaining = totalScenes - sceneID
+                    timeSpent = in_seconds(elapsed)
+                    timeLeft = remaining * timeSpent
+                stderr.write(f"\rScenes remaining: {remaining:>5}, {timeSpent:>2} seconds/scene, estimated time left {timeLeft:>4} seconds")
+                stderr.flush_file()
+                with let:
+                    start = get_mono_time()
+                renderParallel(canvas, cam, world, max_depth, roulette_depth = roulette_depth)
+                _encode(canvas, sceneID)
+
+                sceneID += 1
+                elapsed = get_mono_time() - start
+
+        stderr.write(f"\nFinished! Rendering available at \"{mp4Path}\"\n")
+    finally:
+        close(muxer)
+        mp4File.close()
+        finish(encoder)
+        canvas.delete()
+
 
 if comptime(__name__ == "__main__"):
-    main_animation_ppm()
+    # Usage: trace_of_radiance_animation [--ppm | --mp4-and-ppm] [--frame-parallel]
+    # MP4 by default
+    with let:
+        frameParallel = paramCount() >= 1 and paramStr(paramCount()) == "--frame-parallel"
+    if paramCount() >= 1 and paramStr(1) == "--ppm":
+        main_animation_ppm(frameParallel)
+    else:
+        main_animation_mp4(dumpPPM = paramCount() >= 1 and paramStr(1) == "--mp4-and-ppm", frameParallel = frameParallel)
 
 
 